@@ -0,0 +1,417 @@
+"""
+ASGI variant of the CSV to FHIR JSON API
+
+JSON conversion of POST /entity/fhirjson of csvtofhirjsonparser, but the upload is read from the socket without
+blocking, parsed incrementally as chunks arrive and the bundles are built on a process pool while the event loop keeps
+serving other clients. The JSON array is streamed back as the bundles complete.
+
+    uvicorn asgiapp:app --host 0.0.0.0 --port 8000
+
+Form fields (dedupe_practitioners, resources, filter, deterministic_ids) must come before the file part or be given in
+the query string, since the file is converted while it is being uploaded. The other options of the Flask endpoint
+(deliver, tables, store, trace, profile) are answered with 400 and an Accept header without JSON with 406. A
+conversion failing once the response has started aborts the connection, so the client never takes the truncated
+array for a complete one.
+"""
+import asyncio
+import codecs
+import csv
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from urllib.parse import parse_qs
+from bundlebuilder import generate_bundle, mapped_columns, parse_resources, RecordIds
+from conversion import practitioner_index_for, RowFilter, warm_up
+from dateparsing import DateParser
+
+# rows sent to a worker at a time, and batches in flight per request
+BATCH_SIZE = int(os.environ.get('FHIRJSON_ASGI_BATCH_SIZE', 32))
+MAX_IN_FLIGHT = int(os.environ.get('FHIRJSON_ASGI_MAX_IN_FLIGHT', 4))
+
+EXECUTOR = None
+WARMED_UP = False
+# options of POST /entity/fhirjson of the Flask app only
+UNSUPPORTED_FIELDS = ('deliver', 'tables', 'store', 'trace', 'profile')
+FALSE_VALUES = ('', 'false', '0', 'no', 'off')
+JSON_MEDIA_RANGES = ('application/json', 'application/*', '*/*')
+
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser. Chunks are fed as they are received, the parser returns the events
+    ('headers', dict), ('data', bytes) and ('end', None) for every part.
+    """
+
+    def __init__(self, boundary):
+        self.delimiter = b'\r\n--' + boundary
+        self.buffer = b'\r\n'
+        self.state = 'preamble'
+
+    def feed(self, chunk):
+        """
+        This function parses the next chunk of the body
+        :param chunk: bytes received
+        :return: returns the list of events completed by the chunk
+        """
+        self.buffer += chunk
+        events = []
+        while True:
+            if self.state == 'preamble':
+                index = self.buffer.find(self.delimiter)
+                if index < 0:
+                    self.buffer = self.buffer[-len(self.delimiter):]
+                    return events
+                self.buffer = self.buffer[index + len(self.delimiter):]
+                self.state = 'after-delimiter'
+            elif self.state == 'after-delimiter':
+                if len(self.buffer) < 2:
+                    return events
+                if self.buffer[:2] == b'--':
+                    self.state = 'done'
+                    return events
+                self.buffer = self.buffer[2:]
+                self.state = 'headers'
+            elif self.state == 'headers':
+                index = self.buffer.find(b'\r\n\r\n')
+                if index < 0:
+                    return events
+                headers = {}
+                for line in self.buffer[:index].decode('utf-8').split('\r\n'):
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                events.append(('headers', headers))
+                self.buffer = self.buffer[index + 4:]
+                self.state = 'body'
+            elif self.state == 'body':
+                index = self.buffer.find(self.delimiter)
+                if index < 0:
+                    # keep enough bytes to recognise a delimiter split across chunks
+                    safe = len(self.buffer) - len(self.delimiter) + 1
+                    if safe > 0:
+                        events.append(('data', self.buffer[:safe]))
+                        self.buffer = self.buffer[safe:]
+                    return events
+                if index:
+                    events.append(('data', self.buffer[:index]))
+                events.append(('end', None))
+                self.buffer = self.buffer[index + len(self.delimiter):]
+                self.state = 'after-delimiter'
+            else:
+                return events
+
+
+class CsvRowParser:
+    """
+    Incremental CSV parser. Bytes are fed as they arrive and complete records are returned as json objects keyed
+    on the column names of the first row, holding only the given columns. A record is complete at a newline outside
+    of a quoted field.
+    """
+
+    def __init__(self, columns=None):
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.record = ''
+        self.quotes = 0
+        self.columns = columns
+        self.column_name = None
+        self.fields = None
+
+    def feed(self, data, final=False):
+        """
+        This function parses the next bytes of the CSV file
+        :param data: bytes received
+        :param final: True for the end of the file
+        :return: returns the list of json objects of the records completed
+        """
+        self.text += self.decoder.decode(data, final)
+        rows = []
+        start = 0
+        while True:
+            index = self.text.find('\n', start)
+            if index < 0:
+                break
+            line = self.text[start:index + 1]
+            start = index + 1
+            self.record += line
+            self.quotes += line.count('"')
+            if self.quotes % 2 == 0:
+                self._parse(rows)
+        self.text = self.text[start:]
+        if final:
+            self.record += self.text
+            self.text = ''
+            if self.record:
+                self._parse(rows)
+        return rows
+
+    def _parse(self, rows):
+        for row in csv.reader(StringIO(self.record), delimiter=','):
+            if self.column_name is None:
+                self.column_name = list(row)
+                self.fields = [(i, name) for i, name in enumerate(self.column_name)
+                               if self.columns is None or name in self.columns]
+            else:
+                json_object = {}
+                for i, name in self.fields:
+                    if i < len(row):
+                        json_object[name] = row[i]
+                rows.append(json_object)
+        self.record = ''
+        self.quotes = 0
+
+
+class ResolvedPractitioner:
+    """
+    Practitioner index lookup resolved in the event loop, sent to the worker with its row
+    """
+
+    def __init__(self, reference, is_new):
+        self.result = (reference, is_new)
+
+    def lookup(self, csvjsondata):  # pylint: disable=W0613
+        """
+        :return: returns the practitioner's reference and True if it is emitted with this row
+        """
+        return self.result
+
+
+def build_bundles(rows, resources=None, record_ids=None):
+    """
+    This function builds the bundles of a batch of rows, it runs in the process pool
+    :param rows: list of (json object, practitioner lookup) tuples
+    :param resources: resource types to emit, all of them by default
+    :param record_ids: optional RecordIds, the ids of every bundle are then derived from the natural key of its row
+    :return: returns the list of bundles serialized as JSON
+    """
+    # the rows of a batch are from one upload, the formats of its date columns are detected once per batch
+    dates = DateParser()
+    return [json.dumps(generate_bundle(json_object, practitioner, resources,
+                                       record_ids(json_object) if record_ids is not None else None, dates=dates))
+            for json_object, practitioner in rows]
+
+
+def get_executor():
+    """
+    This function returns the process pool building the bundles, it is created on first use. The workers are
+    spawned rather than forked so they don't inherit the open client and listening sockets.
+    :return: returns the process pool executor
+    """
+    global EXECUTOR  # pylint: disable=W0603
+    if EXECUTOR is None:
+        EXECUTOR = ProcessPoolExecutor(max_workers=int(os.environ.get('FHIRJSON_ASGI_WORKERS', os.cpu_count())),
+                                       mp_context=multiprocessing.get_context('spawn'), initializer=warm_up)
+    return EXECUTOR
+
+
+def unsupported_field(fields):
+    """
+    This function finds an option of the Flask endpoint the ASGI app doesn't implement
+    :param fields: form fields and query parameters, every value of a field
+    :return: returns the name of the first option asked for, None when there is none
+    """
+    for name in UNSUPPORTED_FIELDS:
+        if any(value.strip().lower() not in FALSE_VALUES for value in fields.get(name, [])):
+            return name
+    return None
+
+
+def accepts_json(headers):
+    """
+    This function tells whether the Accept header of a request allows a JSON response
+    :param headers: dictionary of the request headers
+    :return: returns True without an Accept header or when it has a JSON media range
+    """
+    accept = headers.get(b'accept', b'').decode('latin-1')
+    if not accept.strip():
+        return True
+    for media_range in accept.split(','):
+        media_type, _, parameters = media_range.partition(';')
+        quality = parameters.replace(' ', '').partition('q=')[2]
+        if media_type.strip().lower() in JSON_MEDIA_RANGES and quality not in ('0', '0.0', '0.00', '0.000'):
+            return True
+    return False
+
+
+async def send_json(send, status, body):
+    """
+    This function sends a complete JSON response
+    """
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode('utf-8')})
+
+
+async def convert_upload(scope, receive, send):
+    """
+    This function converts the uploaded CSV file while it is received and streams the JSON array of bundles back
+    """
+    headers = dict(scope['headers'])
+    content_type = headers.get(b'content-type', b'')
+    _, _, boundary = content_type.partition(b'boundary=')
+    if not content_type.startswith(b'multipart/form-data') or not boundary:
+        await send_json(send, 400, {"message": "expected a multipart/form-data upload"})
+        return
+    if not accepts_json(headers):
+        # MessagePack and CBOR are served by the Flask app
+        await send_json(send, 406, {"message": "only application/json is served here"})
+        return
+
+    # every value of a field, filter can be repeated
+    fields = parse_qs(scope.get('query_string', b'').decode('utf-8'), keep_blank_values=True)
+    multipart = MultipartParser(boundary.strip(b'"'))
+    csv_parser = None
+    part_name = None
+    field_value = b''
+    practitioner_index = None
+    resources = None
+    row_filter = None
+    record_ids = None
+    loop = asyncio.get_event_loop()
+    pending = []
+    batch = []
+    started = False
+    first = True
+
+    async def flush(wait_all):
+        # send the finished batches in order, waiting while too many are in flight
+        nonlocal started, first
+        while pending and (wait_all or len(pending) >= MAX_IN_FLIGHT or pending[0].done()):
+            bundles = await pending.pop(0)
+            if not started:
+                await send({'type': 'http.response.start', 'status': 200,
+                            'headers': [(b'content-type', b'application/json')]})
+                await send({'type': 'http.response.body', 'body': b'[', 'more_body': True})
+                started = True
+            for bundle in bundles:
+                body = bundle if first else ',' + bundle
+                first = False
+                await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+
+    async def add_rows(rows):
+        for json_object in rows:
+            if not row_filter.matches(json_object):
+                continue
+            practitioner = None
+            if practitioner_index is not None:
+                practitioner = ResolvedPractitioner(*practitioner_index.lookup(json_object))
+            batch.append((json_object, practitioner))
+            if len(batch) >= BATCH_SIZE:
+                pending.append(loop.run_in_executor(get_executor(), build_bundles, list(batch), resources,
+                                                   record_ids))
+                del batch[:]
+                # a chunk holding many rows waits for its batches like the next chunks would, and the other
+                # clients are served in between
+                await flush(False)
+
+    try:
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                for future in pending:
+                    future.cancel()
+                return
+            more_body = message.get('more_body', False)
+            for event, value in multipart.feed(message.get('body', b'')):
+                if event == 'headers':
+                    disposition = value.get('content-disposition', '')
+                    part_name = disposition.partition('name="')[2].partition('"')[0]
+                    if part_name == 'file':
+                        unsupported = unsupported_field(fields)
+                        if unsupported is not None:
+                            await send_json(send, 400, {"message": "%s is not supported by the ASGI app"
+                                                                   % unsupported})
+                            return
+                        if fields.get('deterministic_ids', [''])[-1].lower() in ('true', '1', 'yes', 'on'):
+                            record_ids = RecordIds(os.environ.get('FHIRJSON_ID_NAMESPACE'))
+                        practitioner_index = practitioner_index_for(
+                            fields.get('dedupe_practitioners', [''])[-1].lower() in ('true', '1', 'yes', 'on'),
+                            record_ids)
+                        try:
+                            resources = parse_resources(','.join(fields.get('resources', [])).split(','))
+                            row_filter = RowFilter(fields.get('filter', []))
+                        except ValueError as error:
+                            # invalid resources or filter, nothing is converted
+                            await send_json(send, 400, {"message": str(error)})
+                            return
+                        csv_parser = CsvRowParser(mapped_columns(resources, row_filter, record_ids))
+                    field_value = b''
+                elif event == 'data' and part_name == 'file':
+                    await add_rows(csv_parser.feed(value))
+                elif event == 'data':
+                    field_value += value
+                elif part_name == 'file':
+                    await add_rows(csv_parser.feed(b'', final=True))
+                else:
+                    fields.setdefault(part_name, []).append(field_value.decode('utf-8'))
+                    unsupported = unsupported_field(fields) if csv_parser is not None else None
+                    if unsupported is not None and not started:
+                        # after the file part, the conversion is stopped
+                        for future in pending:
+                            future.cancel()
+                        await send_json(send, 400, {"message": "%s is not supported by the ASGI app" % unsupported})
+                        return
+                    if unsupported is not None:
+                        raise ValueError('%s is not supported by the ASGI app' % unsupported)
+            await flush(False)
+        if csv_parser is None:
+            # the upload is required, as by the Flask endpoint
+            await send_json(send, 400, {"message": "a file part is required"})
+            return
+        if batch:
+            pending.append(loop.run_in_executor(get_executor(), build_bundles, list(batch), resources,
+                                               record_ids))
+        await flush(True)
+    except Exception:  # pylint: disable=W0703
+        for future in pending:
+            future.cancel()
+        if not started:
+            await send_json(send, 500, {"message": "Internal Server Error"})
+            return
+        # the 200 status is already sent: the server aborts the connection without ending the body, a truncated
+        # array would pass for a complete conversion
+        raise
+
+    if not started:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': b'[', 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b']\n'})
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application
+    """
+    global WARMED_UP  # pylint: disable=W0603
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                warm_up()
+                get_executor()
+                WARMED_UP = True
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if EXECUTOR is not None:
+                    EXECUTOR.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    path = scope['path'].rstrip('/')
+    if scope['method'] == 'POST' and path == '/entity/fhirjson':
+        await convert_upload(scope, receive, send)
+    elif scope['method'] == 'GET' and path == '/health/ready':
+        if WARMED_UP:
+            await send_json(send, 200, {"status": "ready"})
+        else:
+            await send_json(send, 503, {"status": "warming up"})
+    else:
+        await send_json(send, 404, {"message": "Not Found"})
+
+
+if __name__ == '__main__':
+    import uvicorn  # pylint: disable=C0411,C0413
+    uvicorn.run('asgiapp:app', host=os.environ.get('FHIRJSON_HOST', '127.0.0.1'),
+                port=int(os.environ.get('FHIRJSON_PORT', 8000)))
@@ -0,0 +1,141 @@
+"""
+Throughput and allocations of the CSV readers on wide files
+
+Generates a wide synthetic CSV file (the mapped columns followed by unmapped padding columns, like a 300+ column
+vital-records export, a share of the rows with a quoted multi-line address) and reads it with the csv module
+keeping every column, the csv module keeping only the mapped columns and the memory-mapped reader. Prints MB/sec,
+rows/sec, the field strings created per row and the peak memory traced by tracemalloc over a sample of rows.
+
+    python benchmark_csv_readers.py --size-mb 1024 --extra-columns 240
+"""
+import argparse
+import csv
+import itertools
+import os
+import tempfile
+import time
+import tracemalloc
+from bundlebuilder import MAPPED_COLUMNS
+from conversion import read_csv_rows
+from mmapcsvreader import MappedCsvReader
+
+
+def write_synthetic_csv(path, size_mb, extra_columns, quoted_every):
+    """
+    This function writes a synthetic CSV file of about size_mb megabytes
+    :param path: output path
+    :param size_mb: file size in megabytes
+    :param extra_columns: number of unmapped columns
+    :param quoted_every: every n-th row has a quoted address with an embedded newline, 0 for none
+    """
+    column_name = list(MAPPED_COLUMNS) + ['EXTRA_COLUMN_%d' % number for number in range(extra_columns)]
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(column_name)
+        row_number = 0
+        while csvfile.tell() < size_mb << 20:
+            row_number += 1
+            row = ['%s%d' % (name[:6].lower(), row_number % 1000) for name in column_name]
+            if quoted_every and row_number % quoted_every == 0:
+                row[column_name.index('PATIENTS_ADDRESS_LINE')] = '1 Main St, "Apt 2"\nBuilding %d' % row_number
+            writer.writerow(row)
+
+
+class CsvModuleReader:
+    """
+    read_csv_rows over a text file, every field of a row becomes a string
+    """
+
+    def __init__(self, path, columns=None):
+        self.file = open(path, newline='')
+        self.columns = len(next(csv.reader(self.file)))
+        self.file.seek(0)
+        self.rows = read_csv_rows(self.file, columns=columns)
+
+    def strings(self, rows):
+        """
+        :return: returns the number of field strings created for the rows read
+        """
+        return rows * self.columns
+
+    def close(self):
+        """
+        This function closes the file
+        """
+        self.file.close()
+
+
+class MappedReader:
+    """
+    MappedCsvReader, only the mapped fields of the unquoted rows become strings
+    """
+
+    def __init__(self, path, columns=None):
+        self.reader = MappedCsvReader(path, columns)
+        self.rows = iter(self.reader)
+
+    def strings(self, rows):
+        """
+        :return: returns the number of field strings created for the rows read
+        """
+        parsed = self.reader.parsed_records - 1
+        return (rows - parsed) * len(self.reader.fields) + parsed * len(self.reader.column_name)
+
+    def close(self):
+        """
+        This function unmaps the file
+        """
+        self.reader.close()
+
+
+READERS = (
+    ('csv', lambda path: CsvModuleReader(path)),
+    ('csv projected', lambda path: CsvModuleReader(path, MAPPED_COLUMNS)),
+    ('mmap projected', lambda path: MappedReader(path, MAPPED_COLUMNS)),
+)
+
+
+def main():
+    """
+    This function runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description='CSV reader throughput and allocations')
+    parser.add_argument('--csv', help='existing CSV file, a synthetic one is generated by default')
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--extra-columns', type=int, default=240)
+    parser.add_argument('--quoted-every', type=int, default=10)
+    parser.add_argument('--sample-rows', type=int, default=20000, help='rows read under tracemalloc')
+    args = parser.parse_args()
+
+    path = args.csv
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        write_synthetic_csv(path, args.size_mb, args.extra_columns, args.quoted_every)
+    size_mb = os.path.getsize(path) / (1 << 20)
+    try:
+        print('reader           rows     MB/sec   rows/sec  strings/row  peak KiB')
+        for name, open_reader in READERS:
+            reader = open_reader(path)
+            started = time.time()
+            count = sum(1 for _ in reader.rows)
+            seconds = time.time() - started
+            strings = reader.strings(count)
+            reader.close()
+
+            reader = open_reader(path)
+            tracemalloc.start()
+            for _ in itertools.islice(reader.rows, args.sample_rows):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            reader.close()
+            print('%-14s %6d %10.1f %10.0f %12.1f %9.0f'
+                  % (name, count, size_mb / seconds, count / seconds, strings / count, peak / 1024))
+    finally:
+        if args.csv is None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Encode/decode time and payload size of the bundle encodings
+
+Converts the rows of a CSV file (or synthetic rows) into bundles and encodes them as one array, the way
+POST /entity/fhirjson answers, and as a stream of separately encoded bundles, the way the batch endpoint answers, in
+JSON, MessagePack, CBOR and CBOR with string references. Prints the payload size and the encode and decode times.
+
+    python benchmark_encodings.py --rows 5000
+    python benchmark_encodings.py --csv data.csv
+"""
+import argparse
+import json
+import time
+from collections import defaultdict
+from io import BytesIO
+import cbor2
+import msgpack
+from bundleencoding import encode_cbor, encode_msgpack
+from bundlebuilder import generate_bundle, RecordIds
+from conversion import convert_csv
+from dateparsing import DateParser
+
+
+def synthetic_bundles(rows):
+    """
+    This function builds the bundles of synthetic rows
+    :param rows: number of rows
+    :return: returns the list of bundles
+    """
+    record_ids = RecordIds()
+    dates = DateParser()
+    bundles = []
+    for number in range(rows):
+        row = defaultdict(str)
+        row['PATIENTS_GIVENNAME'] = 'Given%d' % number
+        row['PATIENTS_FAMILYNAME'] = 'Family%d' % (number % 997)
+        row['PATIENT_AGE'] = str(number % 100)
+        row['PATIENT_GENDER_ATTIMEOFDEATH'] = 'female' if number % 2 else 'male'
+        row['PATIENTS_ADDRESS_CITY'] = 'City%d' % (number % 50)
+        row['PATIENTS_ADDRESS_STATE'] = 'MA'
+        row['MANNER_OF_DEATH'] = 'Natural'
+        for column in ['ACTUAL_OR_PRESUMERD_DATE_OF_DEATH', 'DATE_PRONOUNCED_DEAD']:
+            row[column] = '%02d-Jan-20' % (number % 28 + 1)
+        for column in ['ACTUAL_OR_PRESUMERD_TIME_OF_DEATH', 'TIME_PRONOUNCED_DEAD']:
+            row[column] = '%02d:00:00' % (number % 24)
+        bundles.append(generate_bundle(row, record_id=record_ids(row), dates=dates))
+    return bundles
+
+
+def decode_stream(data, decoder):
+    """
+    This function decodes a stream of concatenated items
+    :param data: encoded stream
+    :param decoder: 'msgpack' or 'cbor'
+    :return: returns the list of items
+    """
+    if decoder == 'msgpack':
+        return list(msgpack.Unpacker(BytesIO(data), raw=False))
+    stream = BytesIO(data)
+    items = []
+    while stream.tell() < len(data):
+        items.append(cbor2.load(stream))
+    return items
+
+
+ENCODINGS = (
+    ('json array', lambda bundles: json.dumps(bundles).encode('utf-8'), json.loads),
+    ('msgpack array', encode_msgpack, msgpack.unpackb),
+    ('cbor array', cbor2.dumps, cbor2.loads),
+    ('cbor stringref', encode_cbor, cbor2.loads),
+    ('ndjson', lambda bundles: b''.join((json.dumps(bundle) + '\n').encode('utf-8') for bundle in bundles),
+     lambda data: [json.loads(line) for line in data.splitlines()]),
+    ('msgpack stream', lambda bundles: b''.join(encode_msgpack(bundle) for bundle in bundles),
+     lambda data: decode_stream(data, 'msgpack')),
+    ('cbor-seq', lambda bundles: b''.join(encode_cbor(bundle) for bundle in bundles),
+     lambda data: decode_stream(data, 'cbor')),
+)
+
+
+def main():
+    """
+    This function runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description='bundle encodings size and speed')
+    parser.add_argument('--csv', help='CSV file, synthetic rows by default')
+    parser.add_argument('--rows', type=int, default=5000, help='synthetic rows')
+    args = parser.parse_args()
+
+    if args.csv:
+        with open(args.csv, newline='') as csvfile:
+            bundles = [bundle for _, bundle in convert_csv(csvfile, record_ids=RecordIds())]
+    else:
+        bundles = synthetic_bundles(args.rows)
+
+    print('%d bundles' % len(bundles))
+    print('encoding              bytes   vs json   encode ms   decode ms')
+    json_size = None
+    for name, encode, decode in ENCODINGS:
+        started = time.time()
+        data = encode(bundles)
+        encoded = time.time()
+        decoded = decode(data)
+        finished = time.time()
+        if decoded != bundles:
+            raise AssertionError('%s does not round trip' % name)
+        json_size = json_size or len(data)
+        print('%-15s %11d %8.2fx %11.0f %11.0f'
+              % (name, len(data), json_size / len(data), (encoded - started) * 1000, (finished - encoded) * 1000))
+
+
+if __name__ == '__main__':
+    main()
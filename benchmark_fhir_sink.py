@@ -0,0 +1,75 @@
+"""
+Throughput of the FHIR server sink against a local stand-in server
+
+The stand-in accepts transaction Bundles and answers with a transaction-response after an optional delay, standing
+in for the server latency. Prints bundles/sec for each batch size and concurrency.
+
+    python benchmark_fhir_sink.py tests/multiple_patient_data.csv --bundles 5000 --latency 0.02
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import time
+from conversion import convert_csv
+from fhirserversink import FhirServerSink
+
+
+class StandInFhirHandler(BaseHTTPRequestHandler):
+    """
+    Accepts transaction Bundles, answers 200 with one response entry per entry
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def do_POST(self):  # pylint: disable=C0103
+        """
+        handle a transaction
+        """
+        transaction = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.latency)
+        body = json.dumps({"resourceType": "Bundle", "type": "transaction-response",
+                           "entry": [{"response": {"status": "201 Created"}} for _ in transaction['entry']]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/fhir+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+def main():
+    """
+    This function runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description='FHIR server sink throughput')
+    parser.add_argument('csv', help='CSV file, its bundles are repeated up to --bundles')
+    parser.add_argument('--bundles', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the stand-in server takes per request')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    with open(args.csv) as csvfile:
+        bundles = [bundle for _, bundle in convert_csv(csvfile)]
+    bundles = (bundles * (args.bundles // len(bundles) + 1))[:args.bundles]
+
+    StandInFhirHandler.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInFhirHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d/fhir' % server.server_address[1]
+
+    print('batch size  concurrency  bundles/sec')
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrency:
+            sink = FhirServerSink(url, batch_size=batch_size, concurrency=concurrency)
+            report = sink.send(iter(bundles))
+            sink.close()
+            print('%10d  %11d  %11.1f' % (batch_size, concurrency, report['bundles_per_sec']))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Binary encodings of the converted bundles
+
+Besides JSON the bundles are served as MessagePack or CBOR, chosen by the Accept header. CBOR responses use string
+references (stringref, tags 256 and 25): the first occurrence of a string is written once and every repeat - the
+object keys, the profile URLs of OBSERVATION_SD and PATIENT_DECEDENT_SD, code systems and the subject references -
+becomes a reference of a few bytes, which any stringref aware decoder (cbor2 included) expands transparently.
+MessagePack has no string references, its fixstr/str8 forms are already the most compact for the short keys.
+Streamed results are a sequence of independently encoded items: concatenated MessagePack objects or a CBOR sequence
+(RFC 8742).
+"""
+import cbor2
+import msgpack
+
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+CBOR_SEQUENCE = 'application/cbor-seq'
+
+
+def encode_msgpack(data):
+    """
+    This function encodes a json object as MessagePack
+    :param data: json object
+    :return: returns the encoded bytes
+    """
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def encode_cbor(data):
+    """
+    This function encodes a json object as CBOR with string references
+    :param data: json object
+    :return: returns the encoded bytes
+    """
+    return cbor2.dumps(data, string_referencing=True)
+
+
+ENCODERS = {MSGPACK: encode_msgpack, 'application/x-msgpack': encode_msgpack, CBOR: encode_cbor}
+# media type of the streamed sequence for each media type a client may ask for
+SEQUENCE_MEDIA_TYPES = {MSGPACK: MSGPACK, 'application/x-msgpack': MSGPACK, CBOR: CBOR_SEQUENCE,
+                        CBOR_SEQUENCE: CBOR_SEQUENCE}
+SEQUENCE_ENCODERS = {MSGPACK: encode_msgpack, CBOR_SEQUENCE: encode_cbor}
@@ -0,0 +1,71 @@
+"""
+Bundle store endpoints
+
+GET /entity/bundles looks the bundles of the configured BUNDLE_STORE up by the fields BundleStore indexes, GET
+/entity/bundles/<id> returns one of them. A store is opened per request. The resources are registered on the entity
+namespace by csvtofhirjsonparser, which also writes the bundles of an upload with store=true into the store.
+"""
+from flask import current_app
+from flask_restplus import Resource, abort, inputs, reqparse
+from bundlestore import BundleStore, BUNDLE_CONDITIONS, MAX_LIMIT
+
+# bundle store query
+BUNDLE_QUERY = reqparse.RequestParser()
+for query_name in BUNDLE_CONDITIONS:
+    BUNDLE_QUERY.add_argument(query_name, location='args')
+BUNDLE_QUERY.add_argument('code', location='args', help='observation code, e.g. 69449-7 for the manner of death')
+BUNDLE_QUERY.add_argument('value', location='args',
+                          help='value code, or true/false, of the observation with that code')
+BUNDLE_QUERY.add_argument('limit', type=inputs.int_range(1, MAX_LIMIT), location='args', default=100)
+BUNDLE_QUERY.add_argument('offset', type=inputs.natural, location='args', default=0)
+
+
+def bundle_store():
+    """
+    This function opens the configured bundle store, aborting with 400 when there is none.
+    A store is opened per request, SQLite connections aren't shared between the server threads.
+    :return: returns the BundleStore
+    """
+    if not current_app.config['BUNDLE_STORE']:
+        abort(400, 'BUNDLE_STORE is not configured')
+    return BundleStore(current_app.config['BUNDLE_STORE'])
+
+
+class StoredBundles(Resource):
+    """
+    Query the bundle store
+    """
+    def get(self):  # pylint: disable=R0201
+        """
+        find the stored bundles by patient name, SSN, address, date of death and observation code
+        :return: the bundles matching every given parameter, in bundle id order
+        """
+        args = BUNDLE_QUERY.parse_args()
+        criteria = {name: value for name, value in args.items()
+                    if name not in ('limit', 'offset') and value is not None}
+        store = bundle_store()
+        try:
+            return store.query(criteria, args['limit'], args['offset'])
+        except ValueError as error:
+            abort(400, str(error))
+        finally:
+            store.close()
+
+
+class StoredBundle(Resource):
+    """
+    Look a stored bundle up
+    """
+    def get(self, bundle_id):  # pylint: disable=R0201
+        """
+        stored bundle
+        :return: the bundle, 404 when it is not stored
+        """
+        store = bundle_store()
+        try:
+            bundle = store.get(bundle_id)
+        finally:
+            store.close()
+        if bundle is None:
+            abort(404, 'bundle %s is not stored' % bundle_id)
+        return bundle
@@ -0,0 +1,191 @@
+"""
+Local SQLite store of converted bundles
+
+Every bundle is stored as JSON together with the fields it is looked up by: the patient's name, SSN identifier and
+address, the date of death, and the code and value of every observation (see load_cod_data). Those fields have
+secondary indexes, so a lookup reads a few index pages instead of scanning JSON dumps. Bundles are inserted in
+chunks, one transaction per chunk. Bundles are keyed on their id, which must be the record uuid of deterministic ids
+(see record_uuid): two bundles get the same id only when they are the same record, so a bundle stored again replaces
+the previous one and converting a file again doesn't duplicate it. Any other id (the random ones of a conversion
+without deterministic ids would collide after a few thousand bundles) is refused instead of replacing a different
+decedent.
+"""
+import json
+import sqlite3
+import uuid
+from columnaroutput import observation_row, patient_row, resource_type
+
+# bundles inserted per transaction
+CHUNK_SIZE = 1000
+# most bundles a query returns
+MAX_LIMIT = 1000
+DEATH_DATE_CODE = '81956-5'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bundles (
+    bundle_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    given_name TEXT COLLATE NOCASE,
+    family_name TEXT COLLATE NOCASE,
+    ssn TEXT,
+    address_city TEXT COLLATE NOCASE,
+    address_state TEXT COLLATE NOCASE,
+    death_date TEXT,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS observations (
+    bundle_id TEXT NOT NULL,
+    code TEXT,
+    value_code TEXT,
+    value_boolean INTEGER
+);
+CREATE INDEX IF NOT EXISTS bundles_name ON bundles (family_name, given_name);
+CREATE INDEX IF NOT EXISTS bundles_ssn ON bundles (ssn);
+CREATE INDEX IF NOT EXISTS bundles_address ON bundles (address_state, address_city);
+CREATE INDEX IF NOT EXISTS bundles_death_date ON bundles (death_date);
+CREATE INDEX IF NOT EXISTS observations_code ON observations (code, value_code, value_boolean);
+CREATE INDEX IF NOT EXISTS observations_bundle ON observations (bundle_id);
+'''
+
+# query parameter: condition on the bundles table
+BUNDLE_CONDITIONS = {
+    'given': 'given_name = ?',
+    'family': 'family_name = ?',
+    'ssn': 'ssn = ?',
+    'state': 'address_state = ?',
+    'city': 'address_city = ?',
+    'date': 'death_date = ?',
+    'date_from': 'death_date >= ?',
+    'date_to': 'death_date <= ?',
+}
+
+
+def record_key(bundle):
+    """
+    This function returns the key of a bundle in the store
+    :param bundle: bundle json object
+    :return: returns the record uuid of the bundle, its id; raises ValueError when the id is not a uuid
+    """
+    try:
+        return str(uuid.UUID(str(bundle.get('id'))))
+    except ValueError:
+        raise ValueError('bundle id %s is not a record uuid, only bundles converted with deterministic ids can be '
+                         'stored' % bundle.get('id'))
+
+
+class BundleStore:
+    """
+    Indexed SQLite store of bundles
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.count = 0
+
+    def add(self, bundle):
+        """
+        This function stores a bundle, the bundles are written a chunk at a time
+        :param bundle: bundle json object, its id the record uuid; raises ValueError for any other id
+        """
+        record_key(bundle)
+        self.pending.append(bundle)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        This function writes the pending bundles in one transaction
+        """
+        if not self.pending:
+            return
+        bundle_rows = []
+        observation_rows = []
+        for bundle in self.pending:
+            bundle_id = record_key(bundle)
+            patient = None
+            death_date = None
+            for entry in bundle.get('entry') or []:
+                resource = entry.get('resource', entry)
+                kind = resource_type(resource)
+                if kind == 'Patient':
+                    patient = patient_row(None, bundle_id, resource)
+                elif kind == 'Observation':
+                    row = observation_row(None, bundle_id, resource)
+                    observation_rows.append((bundle_id, row.code, row.value_code, row.value_boolean))
+                    if row.code == DEATH_DATE_CODE and row.value_date_time:
+                        death_date = row.value_date_time[:10]
+            # a bundle without a Patient is stored with empty patient fields
+            patient = patient or patient_row(None, bundle_id, {})
+            bundle_rows.append((bundle_id, patient.patient_id, patient.given_name, patient.family_name, patient.ssn,
+                                patient.address_city, patient.address_state, death_date,
+                                json.dumps(bundle, separators=(',', ':'))))
+        with self.connection:
+            self.connection.executemany('DELETE FROM observations WHERE bundle_id = ?',
+                                        [(row[0],) for row in bundle_rows])
+            self.connection.executemany('INSERT OR REPLACE INTO bundles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        bundle_rows)
+            self.connection.executemany('INSERT INTO observations VALUES (?, ?, ?, ?)', observation_rows)
+        self.count += len(bundle_rows)
+        self.pending = []
+
+    def get(self, bundle_id):
+        """
+        This function looks a bundle up by id
+        :param bundle_id: bundle id
+        :return: returns the bundle json object, None when it is not stored
+        """
+        row = self.connection.execute('SELECT body FROM bundles WHERE bundle_id = ?', (bundle_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, criteria, limit=100, offset=0):
+        """
+        This function finds the bundles matching every criterion
+        :param criteria: dictionary of the criteria, keys of BUNDLE_CONDITIONS and code with an optional value
+                         (the value code, or true/false, of an observation with that code)
+        :param limit: most bundles returned, at most MAX_LIMIT
+        :param offset: bundles skipped
+        :return: returns the list of bundle json objects, in bundle id order
+        """
+        unknown = set(criteria) - set(BUNDLE_CONDITIONS) - {'code', 'value'}
+        if unknown:
+            raise ValueError('unknown query parameter %s, expected some of %s'
+                             % (', '.join(sorted(unknown)), ', '.join(list(BUNDLE_CONDITIONS) + ['code', 'value'])))
+        if 'value' in criteria and 'code' not in criteria:
+            raise ValueError('value needs a code')
+        conditions = []
+        parameters = []
+        for name, condition in BUNDLE_CONDITIONS.items():
+            if criteria.get(name) is not None:
+                conditions.append(condition)
+                parameters.append(criteria[name])
+        if criteria.get('code') is not None:
+            observation = 'code = ?'
+            parameters.append(criteria['code'])
+            value = criteria.get('value')
+            if value is not None and value.lower() in ('true', 'false'):
+                observation += ' AND value_boolean = ?'
+                parameters.append(int(value.lower() == 'true'))
+            elif value is not None:
+                observation += ' AND value_code = ?'
+                parameters.append(value)
+            conditions.append('bundle_id IN (SELECT bundle_id FROM observations WHERE %s)' % observation)
+        sql = 'SELECT body FROM bundles'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY bundle_id LIMIT ? OFFSET ?'
+        parameters.extend([min(int(limit), MAX_LIMIT), int(offset)])
+        return [json.loads(body) for body, in self.connection.execute(sql, parameters)]
+
+    def close(self):
+        """
+        This function writes the pending bundles and closes the store
+        :return: returns the number of bundles stored
+        """
+        self.flush()
+        self.connection.close()
+        return self.count
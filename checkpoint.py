@@ -0,0 +1,88 @@
+"""
+Checkpoints of long running conversions
+
+A checkpoint records the byte offset of the next CSV record in the input, the last row converted and the output
+position, so an interrupted conversion continues from it without losing or repeating bundles.
+"""
+import json
+import os
+
+CHECKPOINT = 'checkpoint.json'
+
+
+class ByteOffsetReader:
+    """
+    Iterates the lines of a binary file as text, keeping the byte offset of the end of the last line read. The csv
+    module reads no further than the record it returns, so after a row the offset is where the next record starts.
+    """
+
+    def __init__(self, binary_file, offset=0):
+        self.file = binary_file
+        self.seek(offset)
+
+    def seek(self, offset):
+        """
+        This function moves to a byte offset, which must be the start of a line
+        :param offset: byte offset
+        """
+        self.file.seek(offset)
+        self.offset = offset
+
+    def close(self):
+        """
+        This function closes the file
+        """
+        self.file.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode('utf-8')
+
+
+def save_checkpoint(directory, checkpoint):
+    """
+    This function writes the checkpoint durably, replacing the previous one atomically
+    :param directory: output directory
+    :param checkpoint: checkpoint json object
+    """
+    path = os.path.join(directory, CHECKPOINT)
+    with open(path + '.tmp', 'w') as tmp:
+        json.dump(checkpoint, tmp)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(path + '.tmp', path)
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+def load_checkpoint(directory):
+    """
+    This function reads the checkpoint of an output directory
+    :param directory: output directory
+    :return: returns the checkpoint json object, None when there is no checkpoint
+    """
+    try:
+        with open(os.path.join(directory, CHECKPOINT)) as checkpoint:
+            return json.load(checkpoint)
+    except FileNotFoundError:
+        return None
+
+
+def remove_checkpoint(directory):
+    """
+    This function removes the checkpoint once the conversion is complete
+    :param directory: output directory
+    """
+    try:
+        os.remove(os.path.join(directory, CHECKPOINT))
+    except FileNotFoundError:
+        pass
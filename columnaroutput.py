@@ -0,0 +1,207 @@
+"""
+Columnar Parquet/Arrow output
+
+The Patient and Observation data of the bundles is flattened into two tables with a fixed schema, one row per
+decedent and one row per observation, and written in batches, one Parquet row group or Arrow record batch per batch.
+Analytics consumers load the tables directly instead of parsing and flattening the nested JSON.
+"""
+import os
+from collections import namedtuple
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PATIENT_SCHEMA = pa.schema([
+    ('row', pa.int64()),
+    ('bundle_id', pa.string()),
+    ('patient_id', pa.string()),
+    ('ssn', pa.string()),
+    ('given_name', pa.string()),
+    ('family_name', pa.string()),
+    ('gender', pa.string()),
+    ('age', pa.int64()),
+    ('birth_date', pa.string()),
+    ('deceased_date_time', pa.string()),
+    ('address_line', pa.string()),
+    ('address_city', pa.string()),
+    ('address_district', pa.string()),
+    ('address_state', pa.string()),
+    ('address_country', pa.string()),
+])
+
+OBSERVATION_SCHEMA = pa.schema([
+    ('row', pa.int64()),
+    ('bundle_id', pa.string()),
+    ('patient_id', pa.string()),
+    ('observation_id', pa.string()),
+    ('profile', pa.string()),
+    ('code', pa.string()),
+    ('display', pa.string()),
+    ('value_code', pa.string()),
+    ('value_display', pa.string()),
+    ('value_system', pa.string()),
+    ('value_boolean', pa.bool_()),
+    ('value_date_time', pa.string()),
+])
+
+# rows of the tables, their fields named after the columns
+PatientRow = namedtuple('PatientRow', PATIENT_SCHEMA.names)
+ObservationRow = namedtuple('ObservationRow', OBSERVATION_SCHEMA.names)
+
+TABLES = (('patients', PATIENT_SCHEMA), ('observations', OBSERVATION_SCHEMA))
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+# rows per row group or record batch
+BATCH_SIZE = 10000
+AGE_EXTENSION = 'http://nightingaleproject.github.io/fhirDeathRecord/StructureDefinition/sdr-decedent-Age-extension'
+
+
+def resource_type(resource):
+    """
+    :return: returns the resource type of a resource json object
+    """
+    return resource.get('resourceType') or resource.get('resource_type')
+
+
+def first(value):
+    """
+    This function returns the first item of a list, FHIR elements are lists or single items depending on the builder
+    :param value: list, single item or None
+    :return: returns the item, None for an empty list
+    """
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def coding(concept):
+    """
+    This function returns the coding of a codeable concept
+    :param concept: CodeableConcept or Coding json object
+    :return: returns the Coding json object, empty when missing
+    """
+    if not concept:
+        return {}
+    if 'coding' in concept:
+        return first(concept['coding']) or {}
+    return concept
+
+
+def patient_row(row_number, bundle_id, patient):
+    """
+    This function flattens a Patient resource
+    :return: returns the PatientRow of the patients table
+    """
+    name = first(patient.get('name')) or {}
+    address = first(patient.get('address')) or {}
+    identifier = first(patient.get('identifier')) or {}
+    age = None
+    for extension in patient.get('extension') or []:
+        if extension.get('url') == AGE_EXTENSION:
+            age = extension.get('valueDecimal')
+    return PatientRow(row_number, bundle_id, patient.get('id'),
+                      None if identifier.get('value') is None else str(identifier['value']),
+                      first(name.get('given')), name.get('family'), patient.get('gender'),
+                      None if age is None else int(age), patient.get('birthDate'), patient.get('deceasedDateTime'),
+                      first(address.get('line')), address.get('city'), address.get('district'),
+                      address.get('state'), address.get('country'))
+
+
+def observation_row(row_number, bundle_id, observation):
+    """
+    This function flattens an Observation resource
+    :return: returns the ObservationRow of the observations table
+    """
+    code = coding(observation.get('code'))
+    value = coding(observation.get('valueCodeableConcept'))
+    profile = first((observation.get('meta') or {}).get('profile'))
+    return ObservationRow(row_number, bundle_id, (observation.get('subject') or {}).get('reference'),
+                          observation.get('id'), profile.rpartition('/')[2] if profile else None, code.get('code'),
+                          code.get('display'), value.get('code'), value.get('display'), value.get('system'),
+                          observation.get('valueBoolean'), observation.get('valueDateTime'))
+
+
+class ColumnarWriter:
+    """
+    Writes the patients and observations tables of the bundles in Parquet or Arrow IPC format
+    """
+
+    def __init__(self, outputs, file_format='parquet', batch_size=BATCH_SIZE):
+        """
+        :param outputs: path or writable file of each table, keyed on the table name
+        :param file_format: 'parquet' or 'arrow'
+        :param batch_size: rows per row group or record batch
+        """
+        if file_format not in FORMATS:
+            raise ValueError('unknown table format %s, expected one of %s' % (file_format, ', '.join(FORMATS)))
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.writers = {}
+        self.rows = {}
+        self.counts = {}
+        for name, schema in TABLES:
+            if file_format == 'parquet':
+                self.writers[name] = pq.ParquetWriter(outputs[name], schema)
+            else:
+                self.writers[name] = pa.ipc.new_file(outputs[name], schema)
+            self.rows[name] = []
+            self.counts[name] = 0
+
+    def write(self, row_number, bundle):
+        """
+        This function adds the patient and the observations of a bundle to the tables
+        :param row_number: CSV row number of the bundle
+        :param bundle: bundle json object
+        """
+        bundle_id = None if bundle.get('id') is None else str(bundle['id'])
+        for entry in bundle.get('entry') or []:
+            resource = entry.get('resource', entry)
+            kind = resource_type(resource)
+            if kind == 'Patient':
+                self.add('patients', patient_row(row_number, bundle_id, resource))
+            elif kind == 'Observation':
+                self.add('observations', observation_row(row_number, bundle_id, resource))
+
+    def add(self, name, row):
+        """
+        This function adds a row to a table, writing a batch when it is full
+        """
+        rows = self.rows[name]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(name)
+
+    def flush(self, name):
+        """
+        This function writes the pending rows of a table as one row group or record batch
+        """
+        rows = self.rows[name]
+        if not rows:
+            return
+        schema = dict(TABLES)[name]
+        columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        batch = pa.RecordBatch.from_arrays(columns, schema=schema)
+        if self.file_format == 'parquet':
+            self.writers[name].write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writers[name].write_batch(batch)
+        self.counts[name] += len(rows)
+        self.rows[name] = []
+
+    def close(self):
+        """
+        This function writes the last batches and closes the tables
+        :return: returns the number of rows of each table
+        """
+        for name, writer in self.writers.items():
+            self.flush(name)
+            writer.close()
+        return dict(self.counts)
+
+
+def table_outputs(directory, file_format):
+    """
+    This function returns the paths of the tables in an output directory
+    :param directory: output directory
+    :param file_format: 'parquet' or 'arrow'
+    :return: returns the path of each table keyed on the table name
+    """
+    return {name: os.path.join(directory, name + FORMATS[file_format]) for name, _ in TABLES}
@@ -0,0 +1,388 @@
+"""
+Conversion of whole files
+
+A CSV file is read into rows (read_csv_rows, or BytesCsvReader and MappedCsvReader, which decode only the mapped
+columns), the rows a RowFilter doesn't keep are skipped before any resource is built, and every other row is built
+into a bundle with generate_bundle, on the calling thread (convert_rows) or on the build and serialize threads of a
+conversion pipeline (conversion_pipeline). ConversionStats counts the codes and ages of the converted rows as they
+go. The web API, the command line and the worker processes of the batch endpoint convert with these functions.
+"""
+import csv
+import json
+import time
+from collections import Counter, defaultdict
+from bundlebuilder import (dispositiontype, generate_bundle, mannerofdeath, mapped_columns, patientseducation,
+                           PractitionerIndex, PREGNANCY_STATUS_CODE, RESOURCE_TYPES)
+from dateparsing import DateParser
+from mmapcsvreader import BytesCsvReader, MappedCsvReader
+from pipeline import Pipeline, SKIP
+from rowtracing import RowTracer
+
+# filter columns computed from a raw field - name: (source column, function of the field value)
+DERIVED_FILTER_COLUMNS = {
+    'MANNER_OF_DEATH_CODE': ('MANNER_OF_DEATH', mannerofdeath)
+}
+
+
+class RowFilter:
+    """
+    Row predicates evaluated on the raw CSV fields, before any resource of the row is built. A condition
+    COLUMN=VALUE[,VALUE...] holds when the field has one of the values, ignoring case and surrounding blanks; a row
+    is kept when every condition holds. An empty filter keeps every row.
+    """
+
+    def __init__(self, expressions=()):
+        self.expressions = list(expressions or ())
+        self.conditions = []
+        for expression in self.expressions:
+            column, separator, values = expression.partition('=')
+            if not separator or not column.strip():
+                raise ValueError('row filter %r is not COLUMN=VALUE[,VALUE...]' % expression)
+            column = column.strip()
+            source, derive = DERIVED_FILTER_COLUMNS.get(column, (column, None))
+            self.conditions.append((source, derive, frozenset(value.strip().upper() for value in values.split(','))))
+
+    def columns(self):
+        """
+        This function returns the raw columns the conditions read
+        :return: returns a tuple of column names
+        """
+        return tuple(source for source, _, _ in self.conditions)
+
+    def matches(self, csvjsondata):
+        """
+        This function evaluates the conditions on a row
+        :param csvjsondata: holds json data from csv
+        :return: returns True if the row is kept
+        """
+        for source, derive, values in self.conditions:
+            value = csvjsondata.get(source) or ''
+            if derive is not None:
+                value = derive(value)
+            if value.strip().upper() not in values:
+                return False
+        return True
+
+
+# upper bound of the last age bucket, older ages are counted in it
+AGE_BUCKETS_UNTIL = 100
+
+
+class ConversionStats:
+    """
+    Summary counts of a conversion kept as the rows are converted, so a batch needs no second pass over its output:
+    the manner of death codes of load_cod_data, the disposition type and education codes and the ages of
+    loadpatientextensions, the genders and the pregnancy status observations of the female decedents. Only the
+    resources emitted are counted. Counts of separate conversions (files, byte ranges) are merged with merge.
+    """
+
+    COUNTERS = ('manner_of_death', 'disposition_type', 'education', 'gender', 'age', 'pregnancy_status')
+
+    def __init__(self, counts=None):
+        """
+        :param counts: optional counts of as_counts, to continue a checkpointed conversion
+        """
+        self.rows = (counts or {}).get('rows', 0)
+        self.counters = {name: Counter((counts or {}).get(name, {})) for name in self.COUNTERS}
+
+    def add(self, csvjsondata, resources=None):
+        """
+        This function counts a converted row
+        :param csvjsondata: holds json data from csv
+        :param resources: resource types emitted, all of them by default
+        """
+        resources = resources or RESOURCE_TYPES
+        self.rows += 1
+        if 'Patient' in resources:
+            self.counters['disposition_type'][dispositiontype(csvjsondata['PATIENTS_DISPOSITION_TYPE'])] += 1
+            self.counters['education'][patientseducation(csvjsondata['PATIENTS_EDUCATION'])] += 1
+            self.counters['age'][csvjsondata['PATIENT_AGE'].strip()] += 1
+        if 'Patient' in resources or 'Observation' in resources:
+            self.counters['gender'][csvjsondata['PATIENT_GENDER_ATTIMEOFDEATH'].lower()] += 1
+        if 'Observation' in resources:
+            self.counters['manner_of_death'][mannerofdeath(csvjsondata['MANNER_OF_DEATH'])] += 1
+            if csvjsondata['PATIENT_GENDER_ATTIMEOFDEATH'].upper() == "FEMALE":
+                self.counters['pregnancy_status'][PREGNANCY_STATUS_CODE] += 1
+
+    def merge(self, other):
+        """
+        This function adds the counts of another conversion
+        :param other: ConversionStats, or its counts
+        """
+        if not isinstance(other, ConversionStats):
+            other = ConversionStats(other)
+        self.rows += other.rows
+        for name in self.COUNTERS:
+            self.counters[name].update(other.counters[name])
+
+    def as_counts(self):
+        """
+        :return: returns the raw counts, json serializable
+        """
+        counts = {name: dict(counter) for name, counter in self.counters.items()}
+        counts['rows'] = self.rows
+        return counts
+
+    def summary(self):
+        """
+        This function summarizes the counts, the ages as a distribution in ten year buckets
+        :return: returns the summary json object
+        """
+        summary = {'rows': self.rows}
+        for name in self.COUNTERS:
+            if name != 'age':
+                summary[name] = dict(self.counters[name].most_common())
+        ages = Counter()
+        histogram = Counter()
+        for value, count in self.counters['age'].items():
+            try:
+                ages[int(value)] += count
+            except ValueError:
+                histogram['unknown'] += count
+        for age, count in ages.items():
+            low = min(max(age, 0) // 10 * 10, AGE_BUCKETS_UNTIL)
+            histogram['%d+' % low if low == AGE_BUCKETS_UNTIL else '%d-%d' % (low, low + 9)] += count
+        total = sum(ages.values())
+        summary['age'] = {
+            'count': total,
+            'min': min(ages) if ages else None,
+            'max': max(ages) if ages else None,
+            'mean': round(sum(age * count for age, count in ages.items()) / total, 2) if total else None,
+            'histogram': {bucket: histogram[bucket] for bucket in sorted(histogram, key=age_bucket_order)},
+        }
+        return summary
+
+
+def age_bucket_order(bucket):
+    """
+    :return: returns the sort key of an age bucket, unknown last
+    """
+    return int(bucket.rstrip('+').partition('-')[0]) if bucket != 'unknown' else AGE_BUCKETS_UNTIL + 1
+
+
+def traced_bundle(tracer, line_number, json_object, practitioner_index=None, resources=None, record_id=None,
+                  dates=None):
+    """
+    This function creates the bundle of a row and records its conversion time in a tracer
+    :param tracer: RowTracer of the job
+    :param line_number: row number of the row
+    :return: returns bundle json object, see generate_bundle for the other parameters
+    """
+    timings = {}
+    start = time.perf_counter()
+    bundle = generate_bundle(json_object, practitioner_index, resources, record_id, timings, dates)
+    tracer.record(line_number, json_object, time.perf_counter() - start, timings)
+    return bundle
+
+
+def read_csv_rows(csvfile, column_name=None, line_number=0, columns=None):
+    """
+    This function reads the data rows of a CSV file. The csv module makes a string of every field, only the json
+    objects are projected on the columns; BytesCsvReader decodes only the fields of the columns kept.
+    :param csvfile: file object (or any iterable of lines) holding the CSV data, the first row holds the column names
+    :param column_name: column names when reading from the middle of the file, all the rows are data rows then
+    :param line_number: row number of the first row read
+    :param columns: optional set of the columns to keep, see mapped_columns
+    :return: yields the row number and the csv json object for every data row
+    """
+    reader1 = csv.reader(csvfile, delimiter=',')
+    fields = None
+    for row in reader1:
+        if column_name is None:
+            # read all the column names
+            column_name = list(row)
+        else:
+            if fields is None:
+                # indexes of the columns kept
+                fields = [(i, name) for i, name in enumerate(column_name) if columns is None or name in columns]
+            # create a json object with the variables values in it
+            json_object = {}
+            for i, name in fields:
+                if i < len(row):
+                    json_object[name] = row[i]
+            yield line_number, json_object
+        line_number = line_number + 1
+
+
+def convert_rows(rows, practitioner_index=None, resources=None, row_filter=None, record_ids=None, stats=None,
+                 tracer=None):
+    """
+    This function converts rows into bundles
+    :param rows: iterable of (row number, csv json object)
+    :param practitioner_index: optional PractitionerIndex shared by all the rows
+    :param resources: resource types to emit, all of them by default
+    :param row_filter: optional RowFilter, the rows it doesn't keep are skipped without building anything
+    :param record_ids: optional RecordIds, the ids of every bundle are then derived from the natural key of its row
+    :param stats: optional ConversionStats, every converted row is counted in it
+    :param tracer: optional RowTracer, the conversion time of every row is recorded in it
+    :return: yields the row number and the bundle json object for every row kept
+    """
+    # the rows are those of one file, the formats of its date columns are detected once
+    dates = DateParser()
+    for line_number, json_object in rows:
+        if row_filter is None or row_filter.matches(json_object):
+            record_id = record_ids(json_object) if record_ids is not None else None
+            if tracer is None:
+                bundle = generate_bundle(json_object, practitioner_index, resources, record_id, dates=dates)
+            else:
+                bundle = traced_bundle(tracer, line_number, json_object, practitioner_index, resources, record_id,
+                                       dates)
+            if stats is not None:
+                stats.add(json_object, resources)
+            yield line_number, bundle
+
+
+def convert_csv(csvfile, practitioner_index=None, resources=None, row_filter=None, record_ids=None, stats=None,
+                tracer=None):
+    """
+    This function converts every data row of a CSV file into a bundle
+    :param csvfile: file object (or any iterable of lines) holding the CSV data, the first row holds the column names
+    :param practitioner_index: optional PractitionerIndex shared by all the rows
+    :param resources: resource types to emit, all of them by default
+    :param row_filter: optional RowFilter
+    :param record_ids: optional RecordIds
+    :param stats: optional ConversionStats
+    :param tracer: optional RowTracer
+    :return: yields the row number and the bundle json object for every data row kept
+    """
+    rows = read_csv_rows(csvfile, columns=mapped_columns(resources, row_filter, record_ids))
+    return convert_rows(rows, practitioner_index, resources, row_filter, record_ids, stats, tracer)
+
+
+def convert_csv_bytes(data, practitioner_index=None, resources=None, row_filter=None, record_ids=None,
+                      stats=None, tracer=None):
+    """
+    This function converts every data row of raw CSV bytes into a bundle, only the mapped columns are decoded
+    :param data: raw bytes of the CSV file, the first row holds the column names
+    :param practitioner_index: optional PractitionerIndex shared by all the rows
+    :param resources: resource types to emit, all of them by default
+    :param row_filter: optional RowFilter
+    :param record_ids: optional RecordIds
+    :param stats: optional ConversionStats
+    :param tracer: optional RowTracer
+    :return: yields the row number and the bundle json object for every data row kept
+    """
+    rows = BytesCsvReader(data, mapped_columns(resources, row_filter, record_ids))
+    return convert_rows(rows, practitioner_index, resources, row_filter, record_ids, stats, tracer)
+
+
+def conversion_pipeline(serialize, practitioner_index=None, resources=None, row_filter=None, record_ids=None,
+                        build_workers=1, serialize_workers=1, depth=64, tracer=None):
+    """
+    This function returns the pipeline of a conversion: the rows are built into bundles on build_workers threads and
+    serialized on serialize_workers threads while the source thread reads the next rows, see pipeline
+    :param serialize: function serializing a bundle
+    :param practitioner_index: optional PractitionerIndex shared by all the rows
+    :param resources: resource types to emit, all of them by default
+    :param row_filter: optional RowFilter, the rows it doesn't keep are dropped by the build stage
+    :param record_ids: optional RecordIds, unused for rows that carry their record id
+    :param build_workers: threads of the build stage
+    :param serialize_workers: threads of the serialize stage
+    :param depth: items per queue
+    :param tracer: optional RowTracer, the build time of every row is recorded in it (GIL waits of the build
+                   threads included)
+    :return: returns the Pipeline, run on (row number, csv json object) rows, or (row number, csv json object,
+             record id) rows, it yields (row number, csv json object, bundle, serialized bundle) in row order
+    """
+    # a pipeline converts the rows of one file, the formats of its date columns are detected once
+    dates = DateParser()
+
+    def build(row):
+        line_number, json_object = row[:2]
+        if row_filter is not None and not row_filter.matches(json_object):
+            return SKIP
+        record_id = row[2] if len(row) > 2 else record_ids(json_object) if record_ids is not None else None
+        if tracer is not None:
+            return line_number, json_object, traced_bundle(tracer, line_number, json_object, practitioner_index,
+                                                           resources, record_id, dates)
+        return line_number, json_object, generate_bundle(json_object, practitioner_index, resources, record_id,
+                                                         dates=dates)
+
+    def serialized(built):
+        return built + (serialize(built[2]),)
+
+    return Pipeline([('build', build, build_workers), ('serialize', serialized, serialize_workers)], depth,
+                    source='parse')
+
+
+def practitioner_index_for(dedupe_practitioners, record_ids=None):
+    """
+    This function returns the practitioner index of a conversion
+    :param dedupe_practitioners: emit each distinct practitioner once
+    :param record_ids: optional RecordIds, the practitioner references are then derived in its namespace
+    :return: returns a PractitionerIndex, None without deduplication
+    """
+    if not dedupe_practitioners:
+        return None
+    return PractitionerIndex(record_ids.namespace if record_ids is not None else None)
+
+
+def warm_up():
+    """
+    This function builds one bundle from a synthetic row so every module and code path the conversion needs is loaded.
+    Called in the server's master process before forking, so the workers share the loaded tables copy-on-write, and
+    as the initializer of the spawned worker processes. The servers set their readiness after it.
+    """
+    row = defaultdict(str)
+    row['PATIENT_AGE'] = '0'
+    row['PATIENT_GENDER_ATTIMEOFDEATH'] = 'female'
+    for column in ['ACTUAL_OR_PRESUMERD_DATE_OF_DEATH', 'DATE_PRONOUNCED_DEAD']:
+        row[column] = '01-Jan-20'
+    for column in ['ACTUAL_OR_PRESUMERD_TIME_OF_DEATH', 'TIME_PRONOUNCED_DEAD']:
+        row[column] = '00:00:00'
+    json.dumps(generate_bundle(row, PractitionerIndex()))
+
+
+def convert_named_csv(filename, path, output_path, dedupe_practitioners=False, resources=None, row_filter=None,
+                      record_ids=None, stats=False, trace=None):
+    """
+    This function converts one uploaded CSV file, it runs in the worker pool of the batch endpoint. The results are
+    written to a file as they are converted, so a worker holds one row at a time whatever the size of the upload.
+    :param filename: name of the uploaded file, every result is tagged with it
+    :param path: path of the CSV file
+    :param output_path: path of the file the results are written to, one JSON object per line
+    :param dedupe_practitioners: emit each distinct practitioner of the file once
+    :param resources: resource types to emit, all of them by default
+    :param row_filter: optional RowFilter
+    :param record_ids: optional RecordIds
+    :param stats: end the results with the counts of the file, see ConversionStats
+    :param trace: end the results with the trace of this many slowest rows of the file, see RowTracer
+    :return: returns the trailing results of the file: its counts and trace when asked for; a failing row ends the
+             row results with an error result, tagged with the number of the row
+    """
+    practitioner_index = practitioner_index_for(dedupe_practitioners, record_ids)
+    file_stats = ConversionStats() if stats else None
+    tracer = RowTracer(trace) if trace else None
+    # number of the last row read, and whether it was read whole: a row failing to build is the last one read, a
+    # record failing to parse the one after it
+    position = {"row": 0, "read": False}
+
+    def tracked(rows):
+        iterator = iter(rows)
+        while True:
+            position["read"] = False
+            try:
+                line_number, json_object = next(iterator)
+            except StopIteration:
+                return
+            position.update(row=line_number, read=True)
+            yield line_number, json_object
+
+    reader = MappedCsvReader(path, mapped_columns(resources, row_filter, record_ids))
+    try:
+        with open(output_path, 'w', encoding='utf-8') as output:
+            try:
+                for row_number, bundle in convert_rows(tracked(reader), practitioner_index, resources, row_filter,
+                                                       record_ids, file_stats, tracer):
+                    output.write(json.dumps({"file": filename, "row": row_number, "bundle": bundle}) + "\n")
+            except Exception as error:  # pylint: disable=W0703
+                row_number = position["row"] if position["read"] else position["row"] + 1
+                output.write(json.dumps({"file": filename, "row": row_number, "error": repr(error)}) + "\n")
+    finally:
+        reader.close()
+    trailer = []
+    if file_stats is not None:
+        trailer.append({"file": filename, "counts": file_stats.as_counts()})
+    if tracer is not None:
+        trailer.append({"file": filename, "trace": tracer.report()})
+    return trailer
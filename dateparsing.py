@@ -0,0 +1,102 @@
+"""
+Date and time parsing of the certificate columns
+
+Every date or time column of a file is parsed with one format: the first value of a column is tried against the
+candidate formats and the format that parses it is kept for the column, the following values are parsed with it
+directly. A value the kept format doesn't parse (a file mixing formats) detects the format of the column again. A
+conversion creates one DateParser per file (see convert_rows), so the formats detected for a file don't carry over to
+the next upload, batch file or range. Dates repeat heavily across the rows of a file, so the parsed values are memoized
+in a bounded LRU cache keyed on the column and the value. A two-digit year that would put the date in the future is
+taken in the previous century (strptime puts 00-68 in the 2000s), a birth date of 06-Jun-50 is in 1950.
+"""
+import functools
+from datetime import datetime, timezone
+
+# the format of the CSV exports first, see load_cod_data; ISO dates with or without time (and offset) are parsed
+# by datetime.fromisoformat
+ISO = 'ISO'
+DATE_FORMATS = ('%d-%b-%y', ISO, '%m/%d/%Y', '%m/%d/%y', '%d-%b-%Y', '%Y%m%d', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M',
+                '%m/%d/%y %H:%M', '%Y-%m-%d %H:%M:%S.%f')
+TIME_FORMATS = ('%H:%M:%S', '%H:%M', '%I:%M %p', '%I:%M:%S %p', '%H%M')
+# parsed values kept
+CACHE_SIZE = 65536
+
+
+def parse_format(value, date_format):
+    """
+    This function parses a value with a format
+    :param value: stripped value
+    :param date_format: strptime format or ISO
+    :return: returns the naive datetime, in UTC when the value had an offset; raises ValueError when it doesn't parse
+    """
+    if date_format == ISO:
+        parsed = datetime.fromisoformat(value)
+    else:
+        parsed = datetime.strptime(value, date_format)
+        if '%y' in date_format and parsed > datetime.now():
+            # a birth or death date is never in the future
+            parsed = parsed.replace(year=parsed.year - 100)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class DateParser:
+    """
+    Parses the date and time columns, each with the format detected for the column
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        # column: format
+        self.formats = {}
+        # one cache per instance
+        self.parse = functools.lru_cache(maxsize=cache_size)(self.parse)
+
+    def parse(self, column, value, formats):
+        """
+        This function parses a value of a column with the format of the column, detecting it when needed
+        :param column: column name
+        :param value: field value
+        :param formats: candidate formats, DATE_FORMATS or TIME_FORMATS
+        :return: returns the datetime, None for an empty value; raises ValueError when no format parses it
+        """
+        value = (value or '').strip()
+        if not value:
+            return None
+        kept = self.formats.get(column)
+        if kept is not None:
+            try:
+                return parse_format(value, kept)
+            except ValueError:
+                pass
+        for date_format in formats:
+            try:
+                parsed = parse_format(value, date_format)
+            except ValueError:
+                continue
+            self.formats[column] = date_format
+            return parsed
+        raise ValueError('%s %r is not a date or time in a known format' % (column, value))
+
+    def date(self, csvjsondata, column):
+        """
+        This function parses a date column
+        :param csvjsondata: holds json data from csv
+        :param column: column name
+        :return: returns the datetime, with the time of the value if it has one, None for an empty value
+        """
+        return self.parse(column, csvjsondata.get(column), DATE_FORMATS)
+
+    def datetime(self, csvjsondata, date_column, time_column):
+        """
+        This function parses a date column and the time column that goes with it
+        :param csvjsondata: holds json data from csv
+        :param date_column: date column name
+        :param time_column: time column name, an empty time keeps the time of the date value
+        :return: returns the datetime, None for an empty date
+        """
+        date = self.date(csvjsondata, date_column)
+        time = self.parse(time_column, csvjsondata.get(time_column), TIME_FORMATS)
+        if date is None or time is None:
+            return date
+        return datetime.combine(date.date(), time.time())
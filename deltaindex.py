@@ -0,0 +1,181 @@
+"""
+Fingerprint index for delta conversions
+
+The index holds one fixed-width record per converted row of the last run: the digest of the row's natural key, the
+digest of its mapped fields and the stable record id its resource ids are derived from. Records are sorted on the
+key digest, so the previous index is memory-mapped and searched in place instead of being loaded. A run classifies
+every row as new, changed or unchanged against the previous index, the keys it no longer has are the deleted
+records, and the new index replaces the previous one atomically once the run completes. The fingerprints are only
+comparable between runs mapping the same columns, an index built with other columns is refused.
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import uuid
+
+MAGIC = b'FHIRDELTA1\n'
+# key digest, fingerprint, record id
+DIGEST_SIZE = 16
+RECORD_SIZE = 3 * DIGEST_SIZE
+
+
+def digest(values):
+    """
+    This function returns the 16 byte digest of a list of field values
+    :param values: field values, as strings
+    :return: returns the digest bytes
+    """
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+class RecordKeys:
+    """
+    Sequence view of the key digests of an index, for bisect
+    """
+
+    def __init__(self, data, start, count):
+        self.data = data
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        offset = self.start + index * RECORD_SIZE
+        return self.data[offset:offset + DIGEST_SIZE]
+
+
+class DeltaIndex:
+    """
+    Classifies the rows of a conversion against the index of the previous run and writes the index of this run
+    """
+
+    def __init__(self, path, key_columns, fingerprint_columns):
+        self.path = path
+        self.key_columns = list(key_columns)
+        self.fingerprint_columns = sorted(fingerprint_columns)
+        self.file = None
+        self.data = b''
+        self.start = 0
+        count = 0
+        if os.path.exists(path) and os.path.getsize(path):
+            self.file = open(path, 'rb')
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.data[:len(MAGIC)] != MAGIC:
+                self.close()
+                raise ValueError('%s is not a delta index' % path)
+            header_end = self.data.find(b'\n', len(MAGIC)) + 1
+            header = json.loads(self.data[len(MAGIC):header_end].decode('utf-8'))
+            if header['key_columns'] != self.key_columns:
+                self.close()
+                raise ValueError('%s was built with the natural key %s' % (path, ','.join(header['key_columns'])))
+            if header['fingerprint_columns'] != self.fingerprint_columns:
+                # every record would be changed, the resources or filters are not those of the previous run
+                self.close()
+                raise ValueError('%s was built with the mapped columns %s, not %s; run with the resources and filters '
+                                 'of the previous run, or remove the index to start a new baseline'
+                                 % (path, ','.join(header['fingerprint_columns']),
+                                    ','.join(self.fingerprint_columns)))
+            self.start = header_end
+            count = (len(self.data) - header_end) // RECORD_SIZE
+        self.keys = RecordKeys(self.data, self.start, count)
+        self.records = []
+        self.stats = {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0, "duplicate_keys": 0}
+
+    def close(self):
+        """
+        This function unmaps the previous index
+        """
+        if self.file is not None:
+            self.data.close()
+            self.file.close()
+            self.file = None
+
+    def find(self, key):
+        """
+        This function looks a key digest up in the previous index
+        :param key: key digest
+        :return: returns the fingerprint and record id bytes, None for a new key
+        """
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            offset = self.start + index * RECORD_SIZE + DIGEST_SIZE
+            return self.data[offset:offset + DIGEST_SIZE], self.data[offset + DIGEST_SIZE:offset + 2 * DIGEST_SIZE]
+        return None
+
+    def classify(self, csvjsondata, new_record_id=None):
+        """
+        This function classifies a row against the previous run and records it for this run
+        :param csvjsondata: holds json data from csv
+        :param new_record_id: function returning the record id of a new key from the row, uuid4 by default
+        :return: returns 'new', 'changed' or 'unchanged' and the record id, reused for a key seen before
+        """
+        key = digest([csvjsondata.get(column) or '' for column in self.key_columns])
+        fingerprint = digest([csvjsondata.get(column) or '' for column in self.fingerprint_columns])
+        found = self.find(key)
+        if found is None:
+            status = 'new'
+            record_id = new_record_id(csvjsondata) if new_record_id else uuid.uuid4()
+        else:
+            status = 'unchanged' if found[0] == fingerprint else 'changed'
+            record_id = uuid.UUID(bytes=found[1])
+        self.stats[status] += 1
+        self.records.append(key + fingerprint + record_id.bytes)
+        return status, record_id
+
+    def finish(self):
+        """
+        This function ends the run
+        :return: returns the record ids of the keys of the previous run missing from this run
+        """
+        # stable, so the first row of a duplicated key comes first
+        self.records.sort(key=lambda record: record[:DIGEST_SIZE])
+        deleted = []
+        previous = 0
+        last_key = None
+        for record in self.records:
+            key = record[:DIGEST_SIZE]
+            if key == last_key:
+                self.stats['duplicate_keys'] += 1
+                continue
+            last_key = key
+            while previous < len(self.keys) and self.keys[previous] < key:
+                deleted.append(self.record_id(previous))
+                previous += 1
+            if previous < len(self.keys) and self.keys[previous] == key:
+                previous += 1
+        while previous < len(self.keys):
+            deleted.append(self.record_id(previous))
+            previous += 1
+        self.stats['deleted'] = len(deleted)
+        return deleted
+
+    def save(self):
+        """
+        This function writes the index of the finished run in place of the previous one
+        """
+        header = {"key_columns": self.key_columns, "fingerprint_columns": self.fingerprint_columns}
+        with open(self.path + '.tmp', 'wb') as index_file:
+            index_file.write(MAGIC + json.dumps(header).encode('utf-8') + b'\n')
+            last_key = None
+            for record in self.records:
+                # the first row of a duplicated key keeps it
+                if record[:DIGEST_SIZE] != last_key:
+                    index_file.write(record)
+                    last_key = record[:DIGEST_SIZE]
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        self.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def record_id(self, index):
+        """
+        This function returns the record id of a record of the previous index
+        :param index: record number
+        :return: returns the record id
+        """
+        offset = self.start + index * RECORD_SIZE + 2 * DIGEST_SIZE
+        return uuid.UUID(bytes=self.data[offset:offset + DIGEST_SIZE])
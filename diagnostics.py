@@ -0,0 +1,179 @@
+"""
+Diagnostic endpoints
+
+The stage metrics of the latest pipelined conversions (GET /entity/pipeline), the slowest rows of the latest traced
+conversions (GET /entity/traces) and the stored request profiles (GET /entity/profiles/<id>, admin only), with the
+helpers the conversion endpoints use to start a trace or a profile: row_tracer for a request with trace, profiled
+for a request with profile and the X-Admin-Token header. The metrics and traces are kept in memory per process. The
+resources are registered on the entity namespace by csvtofhirjsonparser.
+"""
+import functools
+import hmac
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+import pytz
+from flask import Response, after_this_request, current_app, request, send_file
+from flask_restplus import Resource, abort
+from requestprofiler import FORMATS as PROFILE_FORMATS, ProfileStore, profile_call
+from rowtracing import RowTracer
+
+# stage metrics of the latest pipelined conversions of the process, see GET /entity/pipeline
+PIPELINE_METRICS = deque(maxlen=20)
+# row tracers of the latest traced conversions of the process, see GET /entity/traces
+ROW_TRACES = deque(maxlen=20)
+
+
+def require_admin():
+    """
+    This function aborts with 403 unless the X-Admin-Token header of the request is the configured ADMIN_TOKEN
+    """
+    token = current_app.config['ADMIN_TOKEN']
+    if not token:
+        abort(403, 'ADMIN_TOKEN is not configured')
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+        abort(403, 'admin token required')
+
+
+def requested_profile():
+    """
+    This function returns the profile format a request asks for with the profile query parameter or the X-Profile
+    header, aborting when the request is not an admin one or the format is unknown
+    :return: returns pstats, speedscope or None when no profile is asked for
+    """
+    profile_format = request.args.get('profile') or request.headers.get('X-Profile')
+    if not profile_format:
+        return None
+    require_admin()
+    if profile_format not in PROFILE_FORMATS:
+        abort(400, 'profile must be one of %s' % ', '.join(PROFILE_FORMATS))
+    return profile_format
+
+
+def profiled(method):
+    """
+    This function wraps an endpoint method so an admin request can run it under a profiler, see requestprofiler.
+    A request not asking for a profile calls the method directly.
+    :param method: endpoint method
+    :return: returns the wrapped method, its response gets the id of the stored profile in the X-Profile-Id header
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        profile_format = requested_profile()
+        if profile_format is None:
+            return method(*args, **kwargs)
+        result, breakdown, profile = profile_call(profile_format, method, *args, **kwargs)
+        profile_id = ProfileStore(current_app.config['PROFILE_DIR']).save(profile_format, breakdown, profile,
+                                                                          request.path)
+        if isinstance(result, Response):
+            result.headers['X-Profile-Id'] = profile_id
+            return result
+        return result, 200, {'X-Profile-Id': profile_id}
+    return wrapper
+
+
+def row_tracer(args, filename):
+    """
+    This function starts the row tracer of a request asking for one, the X-Trace-Id response header names it
+    :param args: parsed request arguments
+    :param filename: name of the converted file
+    :return: returns the RowTracer, None when the request doesn't ask for a trace
+    """
+    if not args['trace']:
+        return None
+    tracer = RowTracer(args['trace'])
+    trace_id = uuid.uuid4().hex
+    ROW_TRACES.append({"id": trace_id, "file": filename, "started": datetime.now(tz=pytz.utc).isoformat(),
+                       "tracer": tracer})
+
+    @after_this_request
+    def trace_header(response):
+        response.headers['X-Trace-Id'] = trace_id
+        return response
+
+    return tracer
+
+
+def trace_report(trace):
+    """
+    :return: returns the report json object of a ROW_TRACES entry, up to date for a conversion still running
+    """
+    return dict({key: value for key, value in trace.items() if key != 'tracer'}, **trace['tracer'].report())
+
+
+class PipelineReport(Resource):
+    """
+    Stage metrics of the pipelined conversions
+    """
+    def get(self):  # pylint: disable=R0201
+        """
+        stage metrics of the latest pipelined conversions of this process, see PIPELINE
+        :return: one list per conversion, oldest first, of the parse, build, serialize and write stages: items, busy
+                 time, mean and max latency, input queue depth, and time starved of input or blocked on output
+        """
+        return list(PIPELINE_METRICS)
+
+
+class RowTraces(Resource):
+    """
+    Slowest rows of the traced conversions
+    """
+    def get(self):  # pylint: disable=R0201
+        """
+        slowest rows of the latest traced conversions of this process, see trace
+        :return: one report per conversion, oldest first: rows, mean time, the slowest rows with their row number,
+                 builder times and redacted fingerprint, and the latency histogram of the last rows
+        """
+        return [trace_report(trace) for trace in list(ROW_TRACES)]
+
+
+class RowTrace(Resource):
+    """
+    Slowest rows of a traced conversion
+    """
+    def get(self, trace_id):  # pylint: disable=R0201
+        """
+        slowest rows of a traced conversion, the X-Trace-Id header of its response
+        :return: the trace report, 404 when the conversion is not one of the latest ones
+        """
+        for trace in list(ROW_TRACES):
+            if trace['id'] == trace_id:
+                return trace_report(trace)
+        abort(404, 'no trace %s' % trace_id)
+
+
+class RequestProfile(Resource):
+    """
+    Breakdown of a request profile, admin only
+    """
+    def get(self, profile_id):  # pylint: disable=R0201
+        """
+        breakdown of a stored profile
+        :return: the time in load_patient_data, loadpatientextensions, load_cod_data, del_none and the fhir.resources
+                 constructors, and the functions taking the most time; 404 when there is no such profile
+        """
+        require_admin()
+        breakdown = ProfileStore(current_app.config['PROFILE_DIR']).breakdown(profile_id)
+        if breakdown is None:
+            abort(404, 'no profile %s' % profile_id)
+        return breakdown
+
+
+class RequestProfileFile(Resource):
+    """
+    Stored request profile, admin only
+    """
+    def get(self, profile_id):  # pylint: disable=R0201
+        """
+        stored profile
+        :return: the pstats file, for python -m pstats or snakeviz, or the speedscope file, for speedscope.app
+        """
+        require_admin()
+        found = ProfileStore(current_app.config['PROFILE_DIR']).profile_path(profile_id)
+        if found is None:
+            abort(404, 'no profile %s' % profile_id)
+        path, profile_format = found
+        return send_file(path, mimetype='application/json' if profile_format == 'speedscope' else
+                         'application/octet-stream', as_attachment=True,
+                         attachment_filename=os.path.basename(path))
@@ -0,0 +1,215 @@
+"""
+Duplicate decedent detection across uploads
+
+Every converted row is reduced to a normalized decedent key - family and given name in upper case without accents,
+blanks or punctuation, the ISO date of death, the age and the gender - and the 16 byte digest of the key is kept in a
+persistent SQLite key store together with the file and row it was first seen in. In front of the store a Bloom filter
+of the digests answers "never seen" for almost every new record without reading the disk; only a filter hit (a
+duplicate, or a false positive at about the configured error rate) looks the digest up in the store. Lookups therefore
+take constant time and memory whatever the number of historic records. The filter is saved in the store with the
+number of keys it covers, keys committed after it (a run that crashed) are added back when the index is opened, and
+the filter is rebuilt twice as large from the store whenever the keys outgrow it. New keys are inserted one
+transaction per chunk.
+"""
+import functools
+import math
+import re
+import sqlite3
+import unicodedata
+from datetime import datetime
+from deltaindex import digest
+
+DECEDENT_KEY_COLUMNS = ('PATIENTS_FAMILYNAME', 'PATIENTS_GIVENNAME', 'ACTUAL_OR_PRESUMERD_DATE_OF_DEATH',
+                        'PATIENT_AGE', 'PATIENT_GENDER_ATTIMEOFDEATH')
+# date formats of the exports, the first one is that of the CSV exports (see load_cod_data)
+DATE_FORMATS = ('%d-%b-%y', '%d-%b-%Y', '%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%m/%d/%Y', '%m/%d/%y')
+# keys the first filter is sized for, it doubles when they are outgrown
+CAPACITY = 1000000
+ERROR_RATE = 0.01
+# new keys inserted per transaction
+CHUNK_SIZE = 10000
+NOT_NAME_CHARACTERS = re.compile('[^A-Z0-9]')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS keys (
+    seq INTEGER PRIMARY KEY,
+    digest BLOB NOT NULL UNIQUE,
+    source TEXT,
+    row INTEGER
+);
+CREATE TABLE IF NOT EXISTS filter (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    capacity INTEGER NOT NULL,
+    hashes INTEGER NOT NULL,
+    covered INTEGER NOT NULL,
+    bits BLOB NOT NULL
+);
+'''
+
+
+def normalize_name(value):
+    """
+    This function normalizes a name: accents, blanks and punctuation removed, upper case
+    :param value: name
+    :return: returns the normalized name
+    """
+    value = value or ''
+    if not value.isascii():
+        decomposed = unicodedata.normalize('NFKD', value)
+        value = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return NOT_NAME_CHARACTERS.sub('', value.upper())
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_date(value):
+    """
+    This function normalizes a date to its ISO form, the dates of a file repeat so they are parsed once
+    :param value: date in one of DATE_FORMATS
+    :return: returns the ISO date, the stripped value when it is in none of the formats
+    """
+    value = (value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return value.upper()
+
+
+def decedent_key(csvjsondata):
+    """
+    This function returns the normalized decedent key of a row
+    :param csvjsondata: holds json data from csv
+    :return: returns the list of the normalized key fields
+    """
+    age = (csvjsondata.get('PATIENT_AGE') or '').strip()
+    return [normalize_name(csvjsondata.get('PATIENTS_FAMILYNAME')),
+            normalize_name(csvjsondata.get('PATIENTS_GIVENNAME')),
+            normalize_date(csvjsondata.get('ACTUAL_OR_PRESUMERD_DATE_OF_DEATH')),
+            str(int(age)) if age.isdigit() else age,
+            (csvjsondata.get('PATIENT_GENDER_ATTIMEOFDEATH') or '').strip()[:1].upper()]
+
+
+class BloomFilter:
+    """
+    Bloom filter of key digests, the bit positions are derived from the digest by double hashing
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE, bits=None, hashes=None):
+        self.capacity = capacity
+        size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2 / 8))
+        self.bits = bytearray(size) if bits is None else bytearray(bits)
+        self.size = len(self.bits) * 8
+        self.hashes = hashes or max(1, int(round(self.size / capacity * math.log(2))))
+
+    def positions(self, key):
+        """
+        :return: returns the bit positions of a key digest
+        """
+        first = int.from_bytes(key[:8], 'little')
+        second = int.from_bytes(key[8:16], 'little') | 1
+        return [(first + number * second) % self.size for number in range(self.hashes)]
+
+    def add(self, key):
+        """
+        This function adds a key digest
+        """
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        for position in self.positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class DuplicateIndex:
+    """
+    Persistent index of the decedents converted so far, see check
+    """
+
+    def __init__(self, path, capacity=CAPACITY, error_rate=ERROR_RATE, chunk_size=CHUNK_SIZE):
+        # used by one thread at a time, but not always the one that opened it (the source stage of a pipeline)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        # new keys not committed yet: digest -> (source, row)
+        self.pending = {}
+        self.stats = {"checked": 0, "duplicates": 0, "filter_hits": 0}
+        self.count = self.connection.execute('SELECT COALESCE(MAX(seq), 0) FROM keys').fetchone()[0]
+        saved = self.connection.execute('SELECT capacity, hashes, covered, bits FROM filter').fetchone()
+        if saved is None:
+            self.filter = BloomFilter(max(capacity, self.count * 2), error_rate)
+            covered = 0
+        else:
+            self.filter = BloomFilter(saved[0], error_rate, saved[3], saved[1])
+            covered = saved[2]
+        # keys committed after the filter was saved
+        for key, in self.connection.execute('SELECT digest FROM keys WHERE seq > ?', (covered,)):
+            self.filter.add(key)
+        if self.count > self.filter.capacity:
+            self.rebuild()
+
+    def check(self, csvjsondata, source, row):
+        """
+        This function checks a row against every decedent converted before, and records it when it is new
+        :param csvjsondata: holds json data from csv
+        :param source: name of the converted file
+        :param row: row number in the file
+        :return: returns the source and row the decedent was first converted from, None for a new decedent or for
+                 the same row converted again
+        """
+        self.stats['checked'] += 1
+        key = digest(decedent_key(csvjsondata))
+        if key in self.filter:
+            self.stats['filter_hits'] += 1
+            first = self.pending.get(key)
+            if first is None:
+                first = self.connection.execute('SELECT source, row FROM keys WHERE digest = ?', (key,)).fetchone()
+            if first is not None:
+                first = tuple(first)
+                if first == (source, row):
+                    return None
+                self.stats['duplicates'] += 1
+                return first
+        self.pending[key] = (source, row)
+        self.filter.add(key)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+        return None
+
+    def flush(self):
+        """
+        This function commits the new keys in one transaction, growing the filter when they outgrow it
+        """
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO keys (digest, source, row) VALUES (?, ?, ?)',
+                                        [(key, source, row) for key, (source, row) in self.pending.items()])
+        self.count = self.connection.execute('SELECT COALESCE(MAX(seq), 0) FROM keys').fetchone()[0]
+        self.pending = {}
+        if self.count > self.filter.capacity:
+            self.rebuild()
+
+    def rebuild(self):
+        """
+        This function builds a filter twice as large as needed from the key store
+        """
+        self.filter = BloomFilter(self.count * 2, self.error_rate)
+        for key, in self.connection.execute('SELECT digest FROM keys'):
+            self.filter.add(key)
+
+    def close(self):
+        """
+        This function commits the new keys, saves the filter and closes the index
+        """
+        self.flush()
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO filter VALUES (0, ?, ?, ?, ?)',
+                                    (self.filter.capacity, self.filter.hashes, self.count, bytes(self.filter.bits)))
+        self.connection.close()
@@ -0,0 +1,517 @@
+"""
+Command line conversion of CSV files to FHIR JSON
+
+Writes the bundles as newline delimited JSON shards with a manifest, see outputshards. With --checkpoint-every the
+progress is checkpointed, and --resume continues an interrupted conversion from its last checkpoint. With
+--delta-index only the rows new or changed since the previous run are converted, keeping the ids of the changed
+ones, and the records gone since are listed in deleted.ndjson, see deltaindex. With --deterministic-ids the bundle
+and resource ids are derived from the natural key of every row, so converting a file again gives the same ids.
+A PDF file, or a directory of PDF files, is converted one certificate per file, see pdfextractor. Parquet and Arrow
+files are streamed in record batches, see parquetreader. With --tables the patients and observations are also written
+as Parquet or Arrow tables, see columnaroutput, and with --store the bundles are also written into an indexed SQLite
+store the web app answers queries from, see bundlestore. With --stats the summary counts of the converted rows (manner
+of death, disposition type, education, age distribution, pregnancy status) are kept during the conversion and written
+to stats.json, see ConversionStats. With --duplicate-index every row is checked against the decedents converted from
+any earlier file, the duplicates are listed in duplicates.ndjson and skipped with --skip-duplicates, see
+duplicateindex. With --pipeline the rows are read, built and serialized by concurrent stages on bounded queues while
+the shards are written, and the stage metrics go to pipeline.json, see pipeline. With --trace-rows the slowest rows,
+with their builder times and a redacted fingerprint, and the latency histogram go to trace.json, see rowtracing.
+
+    python fhirjsoncli.py data.csv -o out/ --shard-bundles 100000 --compress --checkpoint-every 50000
+    python fhirjsoncli.py data.csv -o out/ --shard-bundles 100000 --compress --checkpoint-every 50000 --resume
+    python fhirjsoncli.py data.csv -o out/ --processes 16
+    python fhirjsoncli.py data.csv -o out/ --resources Patient,Observation --filter PATIENTS_ADDRESS_STATE=MA
+    python fhirjsoncli.py data.csv -o out/ --delta-index certificates.idx
+    python fhirjsoncli.py data.csv -o out/ --deterministic-ids --id-namespace https://registry.example.org
+    python fhirjsoncli.py certificates/ -o out/ --processes 8 --pdf-cache pdf-cache/
+    python fhirjsoncli.py deaths.parquet -o out/
+    python fhirjsoncli.py data.csv -o out/ --tables parquet --no-json
+    python fhirjsoncli.py data.csv -o out/ --store bundles.db --deterministic-ids
+    python fhirjsoncli.py data.csv -o out/ --processes 16 --stats
+    python fhirjsoncli.py data.csv -o out/ --duplicate-index decedents.db --skip-duplicates
+    python fhirjsoncli.py data.csv -o out/ --compress --pipeline --serialize-workers 2
+    python fhirjsoncli.py data.csv -o out/ --trace-rows 20
+    python fhirjsoncli.py data.csv -o out/ --verify
+    python fhirjsoncli.py data.csv -o out/ --regenerate-shard 7
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from bundlebuilder import (deleted_record, generate_bundle, mapped_columns, parse_resources, NATURAL_KEY_COLUMNS,
+                           RecordIds)
+from bundlestore import BundleStore
+from checkpoint import ByteOffsetReader, load_checkpoint, remove_checkpoint, save_checkpoint
+from columnaroutput import ColumnarWriter, FORMATS as TABLE_FORMATS, table_outputs
+from dateparsing import DateParser
+from conversion import (conversion_pipeline, practitioner_index_for, read_csv_rows, traced_bundle, ConversionStats,
+                        RowFilter)
+from deltaindex import DeltaIndex
+from duplicateindex import DECEDENT_KEY_COLUMNS, DuplicateIndex
+from mmapcsvreader import MappedCsvReader
+from outputshards import ShardWriter, read_manifest, regenerate_shard, verify_shards
+from parquetreader import column_names, is_columnar_file, read_columnar_rows
+from pdfextractor import read_pdf_rows
+from pipeline import QUEUE_DEPTH, SKIP
+from rowtracing import RowTracer
+from shardedcsvreader import convert_parallel
+
+
+def parse_args(argv=None):
+    """
+    This function parses the command line
+    :param argv: command line arguments
+    :return: returns the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Convert a CSV file to FHIR JSON bundles')
+    parser.add_argument('input', help='CSV file, Parquet or Arrow file, PDF file or directory of PDF files')
+    parser.add_argument('-o', '--output-dir', required=True, help='directory of the shards and manifest.json')
+    parser.add_argument('--shard-bundles', type=int, help='bundles per shard')
+    parser.add_argument('--shard-bytes', type=int, help='bytes of JSON per shard')
+    parser.add_argument('--compress', action='store_true', help='gzip the shards')
+    parser.add_argument('--prefix', default='bundles', help='shard file name prefix')
+    parser.add_argument('--dedupe-practitioners', action='store_true',
+                        help='emit each distinct practitioner once for the whole conversion')
+    parser.add_argument('--resources', type=lambda value: value.split(','),
+                        help='comma separated resource types to emit: Composition, Patient, Practitioner, '
+                             'Observation (default all)')
+    parser.add_argument('--filter', action='append', default=[], metavar='COLUMN=VALUE[,VALUE...]',
+                        help='only convert the rows whose column has one of the values, e.g. '
+                             'PATIENTS_ADDRESS_STATE=MA or MANNER_OF_DEATH_CODE=7878000; repeat for more conditions')
+    parser.add_argument('--delta-index', metavar='PATH',
+                        help='fingerprint index of the previous run, only new and changed rows are converted and the '
+                             'index is replaced with the one of this run')
+    parser.add_argument('--duplicate-index', metavar='PATH',
+                        help='index of the decedents converted so far, the rows already in it are listed in '
+                             'duplicates.ndjson')
+    parser.add_argument('--skip-duplicates', action='store_true',
+                        help='do not convert the rows listed in duplicates.ndjson')
+    parser.add_argument('--natural-key', type=lambda value: value.split(','), default=list(NATURAL_KEY_COLUMNS),
+                        metavar='COLUMN[,COLUMN...]',
+                        help='columns identifying a record across runs (default %s)' % ','.join(NATURAL_KEY_COLUMNS))
+    parser.add_argument('--deterministic-ids', action='store_true',
+                        help='derive the bundle and resource ids from the natural key of every row')
+    parser.add_argument('--id-namespace', metavar='UUID|NAME',
+                        help='namespace of the deterministic ids, implies --deterministic-ids')
+    parser.add_argument('--regenerate-shard', type=int, metavar='N',
+                        help='convert the rows of shard N again, with the options recorded in the manifest, and '
+                             'rewrite only that shard; requires a conversion with deterministic ids')
+    parser.add_argument('--verify', action='store_true', help='check the shards against the manifest checksums')
+    parser.add_argument('--checkpoint-every', type=int, metavar='ROWS',
+                        help='checkpoint the progress every ROWS rows')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the checkpoint in the output directory, if there is one')
+    parser.add_argument('--reader', choices=['csv', 'mmap'], default='mmap',
+                        help='mmap (default) decodes only the mapped columns of the file; csv reads a file mmap '
+                             "can't map, such as a pipe, and makes a string of every field")
+    parser.add_argument('--processes', type=int,
+                        help='parse and convert byte ranges of the file on this many processes, '
+                             'practitioners are deduplicated per range; for PDF input, extract on this many '
+                             'processes')
+    parser.add_argument('--pdf-cache', metavar='DIR',
+                        help='cache of the fields extracted from PDF files, keyed on the file contents')
+    parser.add_argument('--tables', choices=tuple(TABLE_FORMATS),
+                        help='also write the patients and observations tables in this format')
+    parser.add_argument('--store', metavar='PATH',
+                        help='also write the bundles into this SQLite bundle store, requires --deterministic-ids')
+    parser.add_argument('--stats', action='store_true',
+                        help='write the summary statistics of the converted rows to stats.json')
+    parser.add_argument('--no-json', action='store_true',
+                        help='write only the tables or the bundle store, no bundle shards')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='read, build and serialize the rows on concurrent stages while the output is written')
+    parser.add_argument('--build-workers', type=int, default=1, metavar='N',
+                        help='threads building the bundles with --pipeline')
+    parser.add_argument('--serialize-workers', type=int, default=1, metavar='N',
+                        help='threads serializing the bundles with --pipeline')
+    parser.add_argument('--queue-depth', type=int, default=QUEUE_DEPTH, metavar='N',
+                        help='rows queued between two stages with --pipeline')
+    parser.add_argument('--trace-rows', type=int, metavar='N',
+                        help='write the N slowest rows, with their builder times and a redacted fingerprint, and '
+                             'the latency histogram to trace.json')
+    args = parser.parse_args(argv)
+    args.pdf = os.path.isdir(args.input) or args.input.lower().endswith('.pdf')
+    args.columnar = is_columnar_file(args.input)
+    if (args.pdf or args.columnar) and (args.checkpoint_every or args.resume or args.regenerate_shard):
+        parser.error('PDF, Parquet and Arrow input cannot be combined with --checkpoint-every, --resume or '
+                     '--regenerate-shard')
+    if args.columnar and args.processes:
+        parser.error('--processes cannot be combined with Parquet or Arrow input')
+    if args.store and not (args.deterministic_ids or args.id_namespace):
+        # random bundle ids collide, a stored bundle would replace another decedent
+        parser.error('--store requires --deterministic-ids or --id-namespace')
+    if args.no_json and not (args.tables or args.store):
+        parser.error('--no-json requires --tables or --store')
+    if (args.tables or args.store) and ((args.processes and not args.pdf) or args.checkpoint_every or args.resume or
+                                        args.regenerate_shard):
+        parser.error('--tables and --store cannot be combined with --processes, --checkpoint-every, --resume or '
+                     '--regenerate-shard')
+    if args.processes and not args.pdf and (args.checkpoint_every or args.resume):
+        parser.error('--processes cannot be combined with --checkpoint-every or --resume')
+    if args.delta_index and ((args.processes and not args.pdf) or args.checkpoint_every or args.resume or
+                             args.regenerate_shard):
+        parser.error('--delta-index cannot be combined with --processes, --checkpoint-every, --resume or '
+                     '--regenerate-shard')
+    if args.pipeline and ((args.processes and not args.pdf) or args.checkpoint_every or args.resume or
+                          args.regenerate_shard):
+        parser.error('--pipeline cannot be combined with --processes, --checkpoint-every, --resume or '
+                     '--regenerate-shard')
+    if args.trace_rows and args.processes and not args.pdf:
+        parser.error('--trace-rows cannot be combined with --processes')
+    if args.skip_duplicates and not args.duplicate_index:
+        parser.error('--skip-duplicates requires --duplicate-index')
+    if args.duplicate_index and ((args.processes and not args.pdf) or args.checkpoint_every or args.resume or
+                                 args.regenerate_shard):
+        parser.error('--duplicate-index cannot be combined with --processes, --checkpoint-every, --resume or '
+                     '--regenerate-shard')
+    try:
+        args.resources = parse_resources(args.resources)
+        RowFilter(args.filter)
+    except ValueError as error:
+        parser.error(str(error))
+    return args
+
+
+def main(argv=None):
+    """
+    This function runs the conversion
+    :param argv: command line arguments
+    :return: returns the exit status
+    """
+    args = parse_args(argv)
+    if args.verify:
+        failed = verify_shards(args.output_dir)
+        for number in failed:
+            print('shard %d does not match the manifest' % number, file=sys.stderr)
+        return 1 if failed else 0
+    if args.regenerate_shard:
+        return regenerate(args.input, args.output_dir, args.regenerate_shard)
+
+    resources = args.resources
+    row_filter = RowFilter(args.filter)
+    id_namespace = args.id_namespace
+    deterministic_ids = args.deterministic_ids or id_namespace is not None
+    checkpoint = load_checkpoint(args.output_dir) if args.resume else None
+    if checkpoint is not None:
+        # the conversion continues with the options it was started with
+        resources = parse_resources(checkpoint['resources'])
+        row_filter = RowFilter(checkpoint['filters'])
+        deterministic_ids = checkpoint.get('deterministic_ids', False)
+        id_namespace = checkpoint.get('id_namespace')
+    record_ids = RecordIds(id_namespace, args.natural_key) if deterministic_ids else None
+    # the index lasts for the whole job, so a practitioner is emitted once across all the shards
+    practitioner_index = practitioner_index_for(args.dedupe_practitioners, record_ids)
+    stats = ConversionStats() if args.stats else None
+    tracer = RowTracer(args.trace_rows) if args.trace_rows else None
+    # the formats of the date columns are detected once for the input
+    dates = DateParser()
+    if checkpoint is not None:
+        # counted only when the interrupted run counted its rows too
+        stats = ConversionStats(checkpoint['stats']) if checkpoint.get('stats') is not None else None
+
+    # recorded in the manifest, the ids of a shard are derived from them again by regenerate
+    options = {"resources": resources, "filters": row_filter.expressions, "deterministic_ids": deterministic_ids,
+               "id_namespace": id_namespace, "natural_key": args.natural_key,
+               "dedupe_practitioners": args.dedupe_practitioners,
+               "processes": args.processes if not args.pdf else None,
+               "delta_index": bool(args.delta_index), "skip_duplicates": args.skip_duplicates}
+    shard_options = {"prefix": args.prefix, "max_bundles": args.shard_bundles, "max_bytes": args.shard_bytes,
+                     "compress": args.compress}
+    if args.processes and not args.pdf:
+        writer = ShardWriter(args.output_dir, **shard_options)
+        for line_number, line in convert_parallel(args.input, args.output_dir, args.processes,
+                                                  args.dedupe_practitioners, resources, args.filter, record_ids,
+                                                  stats):
+            writer.write_line(line_number, line)
+        writer.close(source=args.input, options=options)
+        if stats is not None:
+            write_stats(args.output_dir, stats)
+        return 0
+
+    if checkpoint is not None:
+        shard_options = checkpoint['shard_options']
+
+    columns = mapped_columns(resources, row_filter, record_ids)
+    delta = None
+    if args.delta_index:
+        try:
+            delta = DeltaIndex(args.delta_index, args.natural_key, columns)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 2
+        columns = columns.union(args.natural_key)
+    duplicates = None
+    duplicates_file = None
+    if args.duplicate_index:
+        duplicates = DuplicateIndex(args.duplicate_index)
+        columns = columns.union(DECEDENT_KEY_COLUMNS)
+
+    if args.pdf:
+        reader = None
+        # every column is in the rows of a PDF, empty when the certificate doesn't have it
+        column_name = columns
+    elif args.columnar:
+        reader = None
+        column_name = column_names(args.input)
+    elif args.reader == 'mmap':
+        reader = MappedCsvReader(args.input, columns)
+        column_name = reader.column_name
+    else:
+        reader = ByteOffsetReader(open(args.input, 'rb'))
+        column_name = next(csv.reader(reader))
+
+    def read_rows(line_number):
+        # rows from the current offset of the reader
+        if args.pdf:
+            return read_pdf_rows([args.input], columns, args.processes, args.pdf_cache)
+        if args.columnar:
+            return read_columnar_rows(args.input, columns)
+        if args.reader == 'mmap':
+            reader.line_number = line_number
+            return reader.rows()
+        return read_csv_rows(reader, column_name, line_number, columns)
+
+    try:
+        if delta is not None and not set(args.natural_key).issubset(column_name):
+            print('the natural key %s is not in %s' % (','.join(args.natural_key), args.input), file=sys.stderr)
+            delta.close()
+            return 2
+        if duplicates is not None and not set(DECEDENT_KEY_COLUMNS).issubset(column_name):
+            print('the decedent key %s is not in %s' % (','.join(DECEDENT_KEY_COLUMNS), args.input), file=sys.stderr)
+            return 2
+        if args.no_json:
+            writer = None
+            rows = read_rows(1)
+        elif checkpoint is None:
+            writer = ShardWriter(args.output_dir, **shard_options)
+            rows = read_rows(1)
+        else:
+            writer = ShardWriter.resume(args.output_dir, checkpoint['output'], **shard_options)
+            if practitioner_index is not None:
+                for key, reference in checkpoint['practitioners']:
+                    practitioner_index.references[tuple(key)] = reference
+            reader.seek(checkpoint['offset'])
+            rows = read_rows(checkpoint['row'] + 1)
+
+        tables = None
+        if args.tables:
+            os.makedirs(args.output_dir, exist_ok=True)
+            tables = ColumnarWriter(table_outputs(args.output_dir, args.tables), args.tables)
+        store = BundleStore(args.store) if args.store else None
+        if duplicates is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+            duplicates_file = open(os.path.join(args.output_dir, 'duplicates.ndjson'), 'w')
+        source = os.path.abspath(args.input)
+
+        def select(line_number, json_object):
+            # record id of a row to convert, SKIP for a row left out
+            if not row_filter.matches(json_object):
+                return SKIP
+            record_id = record_ids(json_object) if record_ids is not None and delta is None else None
+            if delta is not None:
+                # a new record gets the deterministic id, a changed one keeps the id it was emitted with
+                status, record_id = delta.classify(json_object, record_ids)
+                if status == 'unchanged':
+                    return SKIP
+            # a changed record is an update of a record converted before, not a duplicate
+            if duplicates is not None and (delta is None or status == 'new'):
+                first = duplicates.check(json_object, source, line_number)
+                if first is not None:
+                    duplicates_file.write(json.dumps({"row": line_number, "skipped": args.skip_duplicates,
+                                                      "duplicate_of": {"source": first[0], "row": first[1]}})
+                                          + '\n')
+                    if args.skip_duplicates:
+                        return SKIP
+            return record_id
+
+        def emit(line_number, json_object, bundle, line=None):
+            if writer is not None:
+                if line is None:
+                    writer.write(line_number, bundle)
+                else:
+                    writer.write_line(line_number, line)
+            if tables is not None:
+                tables.write(line_number, bundle)
+            if store is not None:
+                store.add(bundle)
+            if stats is not None:
+                stats.add(json_object, resources)
+
+        if args.pipeline:
+            def selected_rows():
+                # runs on the source thread of the pipeline
+                for line_number, json_object in rows:
+                    record_id = select(line_number, json_object)
+                    if record_id is not SKIP:
+                        yield line_number, json_object, record_id
+
+            conversion = conversion_pipeline(bundle_line if writer is not None else lambda bundle: None,
+                                             practitioner_index, resources, build_workers=args.build_workers,
+                                             serialize_workers=args.serialize_workers, depth=args.queue_depth,
+                                             tracer=tracer)
+            for line_number, json_object, bundle, line in conversion.run(selected_rows()):
+                emit(line_number, json_object, bundle, line)
+            write_pipeline(args.output_dir, conversion.report())
+
+        else:
+            for line_number, json_object in rows:
+                record_id = select(line_number, json_object)
+                if record_id is not SKIP and tracer is not None:
+                    emit(line_number, json_object,
+                         traced_bundle(tracer, line_number, json_object, practitioner_index, resources, record_id,
+                                       dates))
+                elif record_id is not SKIP:
+                    emit(line_number, json_object,
+                         generate_bundle(json_object, practitioner_index, resources, record_id, dates=dates))
+                if args.checkpoint_every and line_number % args.checkpoint_every == 0:
+                    save_checkpoint(args.output_dir, {
+                        "input": args.input,
+                        "offset": reader.offset,
+                        "row": line_number,
+                        "output": writer.checkpoint(),
+                        "shard_options": shard_options,
+                        "resources": resources,
+                        "filters": row_filter.expressions,
+                        "deterministic_ids": deterministic_ids,
+                        "id_namespace": id_namespace,
+                        "stats": stats.as_counts() if stats is not None else None,
+                        "practitioners": [[list(key), reference] for key, reference in
+                                          (practitioner_index.references.items() if practitioner_index else [])]
+                    })
+        if writer is not None:
+            writer.close(source=args.input, options=options)
+        if tables is not None:
+            tables.close()
+        if store is not None:
+            store.close()
+    finally:
+        if reader is not None:
+            reader.close()
+        if duplicates is not None:
+            duplicates.close()
+            if duplicates_file is not None:
+                duplicates_file.close()
+    if delta is not None:
+        write_delta(args.output_dir, delta, resources, args.dedupe_practitioners)
+    if stats is not None:
+        write_stats(args.output_dir, stats)
+    if tracer is not None:
+        write_trace(args.output_dir, tracer)
+    remove_checkpoint(args.output_dir)
+    return 0
+
+
+def regenerate(path, directory, number):
+    """
+    This function converts the rows of a shard again with the options recorded in the manifest and rewrites the
+    shard. Only a conversion with deterministic ids is regenerated: the bundle, resource and practitioner ids are then
+    those of the first run. The practitioners of the rows before the shard are looked up first, so a deduplicated
+    practitioner is emitted in the shard only if it was there in the first run.
+    :param path: CSV file of the conversion
+    :param directory: output directory
+    :param number: shard number, starting at 1
+    :return: returns the exit status
+    """
+    manifest = read_manifest(directory)
+    options = manifest.get('options') or {}
+    if not options.get('deterministic_ids'):
+        refusal = 'the conversion did not use deterministic ids, a regenerated shard would get other ids'
+    elif options['delta_index'] or options['skip_duplicates']:
+        refusal = 'the conversion skipped rows with --delta-index or --skip-duplicates'
+    elif options['dedupe_practitioners'] and options['processes']:
+        refusal = 'the practitioners were deduplicated per range of --processes'
+    else:
+        refusal = None
+    if refusal is not None:
+        print('shard %d cannot be regenerated: %s' % (number, refusal), file=sys.stderr)
+        return 2
+    shard = manifest['shards'][number - 1]
+    resources = parse_resources(options['resources'])
+    row_filter = RowFilter(options['filters'])
+    record_ids = RecordIds(options['id_namespace'], options['natural_key'])
+    practitioner_index = practitioner_index_for(options['dedupe_practitioners'] and
+                                                (resources is None or 'Practitioner' in resources), record_ids)
+    dates = DateParser()
+
+    def bundles(rows):
+        for line_number, json_object in rows:
+            if line_number > shard['last_row']:
+                break
+            if not row_filter.matches(json_object):
+                continue
+            if line_number >= shard['first_row']:
+                yield line_number, generate_bundle(json_object, practitioner_index, resources,
+                                                   record_ids(json_object), dates=dates)
+            elif practitioner_index is not None:
+                practitioner_index.lookup(json_object)
+
+    reader = MappedCsvReader(path, mapped_columns(resources, row_filter, record_ids))
+    try:
+        regenerate_shard(directory, number, bundles(reader.rows()))
+    finally:
+        reader.close()
+    return 0
+
+
+def write_delta(directory, delta, resources=None, dedupe_practitioners=False):
+    """
+    This function lists the deleted records and the counts of the run, then replaces the delta index. The index is
+    replaced last, so a run failing before that can simply be run again.
+    :param directory: output directory
+    :param delta: DeltaIndex of the run
+    :param resources: resource types emitted, see deleted_record
+    :param dedupe_practitioners: True when the practitioners are shared
+    """
+    with open(os.path.join(directory, 'deleted.ndjson'), 'w') as deleted_file:
+        for record_id in delta.finish():
+            deleted_file.write(json.dumps(deleted_record(record_id, resources, dedupe_practitioners)) + '\n')
+    with open(os.path.join(directory, 'delta.json'), 'w') as report_file:
+        json.dump(delta.stats, report_file, indent=2)
+    delta.save()
+
+
+def bundle_line(bundle):
+    """
+    This function serializes a bundle into a shard line
+    :param bundle: bundle json object
+    :return: returns the bundle json followed by a newline, as bytes
+    """
+    return (json.dumps(bundle) + '\n').encode('utf-8')
+
+
+def write_pipeline(directory, report):
+    """
+    This function writes the stage metrics of a pipelined conversion
+    :param directory: output directory
+    :param report: stage metrics, see Pipeline.report
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'pipeline.json'), 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+def write_trace(directory, tracer):
+    """
+    This function writes the slowest rows and the latency histogram of the conversion
+    :param directory: output directory
+    :param tracer: RowTracer of the run
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'trace.json'), 'w') as trace_file:
+        json.dump(tracer.report(), trace_file, indent=2)
+
+
+def write_stats(directory, stats):
+    """
+    This function writes the summary statistics of the conversion
+    :param directory: output directory
+    :param stats: ConversionStats of the run
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'stats.json'), 'w') as stats_file:
+        json.dump(stats.summary(), stats_file, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
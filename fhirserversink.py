@@ -0,0 +1,126 @@
+"""
+Delivery of converted bundles to a FHIR server
+
+Bundles are grouped into transaction Bundles and POSTed to the server base URL over a pooled set of keep-alive
+connections, with a bounded number of transactions in flight. Failed transactions are retried with exponential
+backoff and every transaction gets an entry in the returned report.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# status codes worth retrying, the server is overloaded or temporarily unavailable
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+def transaction_bundle(bundles):
+    """
+    This function wraps document bundles into a transaction bundle
+    :param bundles: list of bundle json objects
+    :return: returns the transaction bundle json object
+    """
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [{"resource": bundle, "request": {"method": "POST", "url": "Bundle"}} for bundle in bundles]
+    }
+
+
+class FhirServerSink:
+    """
+    Sends bundles to a FHIR server in transaction Bundles of batch_size bundles, at most concurrency at a time
+    """
+
+    def __init__(self, base_url, batch_size=50, concurrency=4, retries=3, backoff=0.5, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Content-Type'] = 'application/fhir+json'
+        self.session.headers['Accept'] = 'application/fhir+json'
+
+    def close(self):
+        """
+        This function closes the pooled connections
+        """
+        self.session.close()
+
+    def post_batch(self, number, bundles):
+        """
+        This function POSTs one transaction, retrying with exponential backoff
+        :param number: batch number, starting at 1
+        :param bundles: list of bundle json objects of the batch
+        :return: returns the report of the batch
+        """
+        started = time.time()
+        body = transaction_bundle(bundles)
+        result = {"batch": number, "bundles": len(bundles), "status": None, "attempts": 0, "error": None}
+        for attempt in range(self.retries + 1):
+            result['attempts'] = attempt + 1
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = self.session.post(self.base_url, json=body, timeout=self.timeout)
+                result['status'] = response.status_code
+                if response.status_code < 300:
+                    result['error'] = None
+                    break
+                result['error'] = response.text[:500]
+                if response.status_code not in RETRY_STATUS:
+                    break
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            except requests.RequestException as error:
+                result['error'] = repr(error)
+            if attempt < self.retries:
+                time.sleep(delay)
+        result['seconds'] = round(time.time() - started, 3)
+        return result
+
+    def send(self, bundles):
+        """
+        This function sends the bundles, reading them lazily so only the batches in flight are held in memory
+        :param bundles: iterable of bundle json objects
+        :return: returns the delivery report with one entry per batch
+        """
+        started = time.time()
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+        futures = []
+
+        def post(number, batch):
+            try:
+                return self.post_batch(number, batch)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            batch = []
+            for bundle in bundles:
+                batch.append(bundle)
+                if len(batch) == self.batch_size:
+                    slots.acquire()
+                    futures.append(executor.submit(post, len(futures) + 1, batch))
+                    batch = []
+            if batch:
+                slots.acquire()
+                futures.append(executor.submit(post, len(futures) + 1, batch))
+            batches = [future.result() for future in futures]
+
+        seconds = time.time() - started
+        sent = sum(batch['bundles'] for batch in batches if batch['error'] is None)
+        return {
+            "server": self.base_url,
+            "batches": batches,
+            "bundles_sent": sent,
+            "bundles_failed": sum(batch['bundles'] for batch in batches) - sent,
+            "seconds": round(seconds, 3),
+            "bundles_per_sec": round(sent / seconds, 1) if seconds else None
+        }
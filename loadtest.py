@@ -0,0 +1,113 @@
+"""
+Load test for the production server
+
+Starts server.py once per worker count, waits for the readiness endpoint and posts the CSV file from concurrent
+clients for a fixed time, printing the throughput for every worker count.
+
+    python loadtest.py tests/multiple_patient_data.csv --workers 1 2 4 --clients 16 --duration 20
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.client import HTTPConnection
+
+
+def multipart_body(path):
+    """
+    This function encodes the CSV file as a multipart form upload
+    :param path: path of the CSV file
+    :return: returns the content type and the body
+    """
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as csvfile:
+        data = csvfile.read()
+    body = (('--%s\r\nContent-Disposition: form-data; name="file"; filename="data.csv"\r\n'
+             'Content-Type: text/csv\r\n\r\n' % boundary).encode() + data + ('\r\n--%s--\r\n' % boundary).encode())
+    return 'multipart/form-data; boundary=%s' % boundary, body
+
+
+def wait_ready(port, timeout=60):
+    """
+    This function polls the readiness endpoint until the server reports ready
+    :param port: server port
+    :param timeout: seconds to wait
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/health/ready')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('server did not become ready')
+
+
+def run_clients(port, content_type, body, clients, duration):
+    """
+    This function posts the body from concurrent clients over keep-alive connections
+    :return: returns the number of successful and failed requests
+    """
+    counts = {'ok': 0, 'failed': 0}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        connection = HTTPConnection('127.0.0.1', port, timeout=120)
+        while time.time() < deadline:
+            try:
+                connection.request('POST', '/entity/fhirjson', body, {'Content-Type': content_type})
+                response = connection.getresponse()
+                response.read()
+                key = 'ok' if response.status == 200 else 'failed'
+            except OSError:
+                connection.close()
+                connection = HTTPConnection('127.0.0.1', port, timeout=120)
+                key = 'failed'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['ok'], counts['failed']
+
+
+def main():
+    """
+    This function runs the load test for every worker count
+    """
+    parser = argparse.ArgumentParser(description='Throughput of server.py by worker count')
+    parser.add_argument('csv', help='CSV file posted by every request')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    content_type, body = multipart_body(args.csv)
+    print('workers  threads  requests/s  failed')
+    for workers in args.workers:
+        server = subprocess.Popen([sys.executable, 'server.py', '--bind', '127.0.0.1:%d' % args.port,
+                                   '--workers', str(workers), '--threads', str(args.threads)])
+        try:
+            wait_ready(args.port)
+            started = time.time()
+            succeeded, failed = run_clients(args.port, content_type, body, args.clients, args.duration)
+            elapsed = time.time() - started
+            print('%7d  %7d  %10.1f  %6d' % (workers, args.threads, succeeded / elapsed, failed))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
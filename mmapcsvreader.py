@@ -0,0 +1,149 @@
+"""
+Memory-mapped CSV reader for local files
+
+Records are found on the raw bytes of the memory-mapped file (or of any bytes buffer, such as an upload) and only
+the fields of the requested columns are decoded, the other fields never become Python strings. Records without a
+quote character are split directly on the delimiter, only up to the last requested column; the others (and every
+record of a dialect other than plain comma separated, double quoted CSV in an ASCII compatible encoding) go through
+the csv module.
+"""
+import csv
+import mmap
+import os
+from io import StringIO
+
+# encodings in which the delimiter, quote and newline bytes can't appear inside another character
+ASCII_COMPATIBLE = ('utf-8', 'utf8', 'ascii', 'latin-1', 'latin1', 'iso-8859-1', 'cp1252')
+
+
+def next_record_start(mapped, position, quotes, end=None, quotechar=b'"'):
+    """
+    This function finds the first record start at or after position
+    :param mapped: memory-mapped CSV file
+    :param position: byte offset to start from
+    :param quotes: number of quote characters between a known record start and position
+    :param end: byte offset to stop at, the end of the file by default
+    :param quotechar: quote character as bytes
+    :return: returns the byte offset of the record start, end at the end of the data
+    """
+    end = len(mapped) if end is None else end
+    while True:
+        newline = mapped.find(b'\n', position, end)
+        if newline < 0:
+            return end
+        quotes += mapped[position:newline].count(quotechar)
+        position = newline + 1
+        # a newline outside of quotes ends the record
+        if quotes % 2 == 0:
+            return position
+
+
+class BytesCsvReader:
+    """
+    Reads the data rows of CSV data held in a bytes buffer. Iterating yields the row number and the json object of
+    the requested columns for every row; offset is the byte offset where the next record starts, so a reader can
+    seek back to it. parsed_records counts the records that went through the csv module.
+    """
+
+    def __init__(self, data, columns=None, dialect='excel', encoding='utf-8'):
+        self.data = data
+        self.size = len(data)
+        self.dialect = csv.get_dialect(dialect) if isinstance(dialect, str) else dialect
+        self.encoding = encoding
+        self.quotechar = (self.dialect.quotechar or '"').encode(encoding)
+        self.fast = (encoding.lower() in ASCII_COMPATIBLE and self.dialect.delimiter == ',' and
+                     self.dialect.quotechar == '"' and self.dialect.doublequote and
+                     not self.dialect.escapechar and not self.dialect.skipinitialspace)
+        self.offset = 0
+        self.line_number = 0
+        self.parsed_records = 0
+        header = self.read_record(self.size) if self.size else None
+        self.column_name = header or []
+        self.fields = [(index, name) for index, name in enumerate(self.column_name)
+                       if columns is None or name in columns]
+        # the fast path splits a line only up to the last requested field
+        self.max_split = self.fields[-1][0] + 1 if self.fields else 0
+        self.line_number = 1
+
+    def close(self):
+        """
+        This function releases the buffer
+        """
+
+    def seek(self, offset, line_number=None):
+        """
+        This function moves to a record start
+        :param offset: byte offset of the record
+        :param line_number: row number of the record
+        """
+        self.offset = offset
+        if line_number is not None:
+            self.line_number = line_number
+
+    def read_record(self, end):
+        """
+        This function parses the record at offset with the csv module
+        :param end: byte offset the record must end before
+        :return: returns the list of fields
+        """
+        record_end = next_record_start(self.data, self.offset, 0, end, self.quotechar)
+        text = self.data[self.offset:record_end].decode(self.encoding)
+        self.offset = record_end
+        self.parsed_records += 1
+        return next(csv.reader(StringIO(text), dialect=self.dialect), [])
+
+    def rows(self, end=None):
+        """
+        This function reads the rows up to a byte offset
+        :param end: byte offset after the last record to read, the end of the data by default
+        :return: yields the row number and the json object for every row
+        """
+        end = self.size if end is None else end
+        data = self.data
+        fields = self.fields
+        max_split = self.max_split
+        encoding = self.encoding
+        while self.offset < end:
+            start = self.offset
+            newline = data.find(b'\n', start, end)
+            line_end = end if newline < 0 else newline
+            if self.fast and data.find(b'"', start, line_end) < 0:
+                self.offset = line_end + 1
+                if line_end > start and data[line_end - 1] == 13:
+                    line_end -= 1
+                values = data[start:line_end].split(b',', max_split) if line_end > start else []
+                json_object = {}
+                for index, name in fields:
+                    if index < len(values):
+                        json_object[name] = values[index].decode(encoding)
+            else:
+                row = self.read_record(end)
+                json_object = {}
+                for index, name in fields:
+                    if index < len(row):
+                        json_object[name] = row[index]
+            yield self.line_number, json_object
+            self.line_number += 1
+
+    def __iter__(self):
+        return self.rows()
+
+
+class MappedCsvReader(BytesCsvReader):
+    """
+    Reads the data rows of a local CSV file through mmap
+    """
+
+    def __init__(self, path, columns=None, dialect='excel', encoding='utf-8'):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        super().__init__(mapped, columns, dialect, encoding)
+
+    def close(self):
+        """
+        This function unmaps and closes the file
+        """
+        if self.size:
+            self.data.close()
+        self.file.close()
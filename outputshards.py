@@ -0,0 +1,255 @@
+"""
+Size-bounded output shards
+
+Bundles are written as newline delimited JSON to numbered shard files, rolling over to the next shard after a
+number of bundles or bytes. Shards are optionally gzip compressed. manifest.json lists every shard with the range
+of CSV rows it holds and the sha256 of the file, so shards can be loaded in parallel and a single shard can be
+verified or regenerated. The manifest also records the conversion options the ids depend on, a shard is regenerated
+with them.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+MANIFEST = 'manifest.json'
+
+
+class HashingFile:
+    """
+    Binary file wrapper computing the sha256 and size of the bytes written. In append mode the bytes already in the
+    file are hashed first.
+    """
+
+    def __init__(self, path, mode='wb'):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        if mode == 'ab':
+            with open(path, 'rb') as existing:
+                for block in iter(lambda: existing.read(1 << 20), b''):  # pylint: disable=W0640
+                    self.sha256.update(block)
+                    self.size += len(block)
+        self.file = open(path, mode)
+
+    def write(self, data):
+        """
+        This function writes the data to the file and the hash
+        """
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        """
+        This function flushes the file
+        """
+        self.file.flush()
+
+    def close(self):
+        """
+        This function closes the file
+        """
+        self.file.close()
+
+
+def shard_name(prefix, number, compress):
+    """
+    This function returns the file name of a shard
+    :param prefix: shard file name prefix
+    :param number: shard number, starting at 1
+    :param compress: True for gzip compressed shards
+    :return: returns the file name
+    """
+    return '%s-%05d.ndjson%s' % (prefix, number, '.gz' if compress else '')
+
+
+def read_manifest(directory):
+    """
+    This function reads the manifest of an output directory
+    :param directory: output directory
+    :return: returns the manifest json object
+    """
+    with open(os.path.join(directory, MANIFEST)) as manifest:
+        return json.load(manifest)
+
+
+def write_manifest(directory, manifest):
+    """
+    This function writes the manifest, replacing the previous one atomically
+    :param directory: output directory
+    :param manifest: manifest json object
+    """
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as tmp:
+        json.dump(manifest, tmp, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class ShardWriter:
+    """
+    Writes bundles to numbered shard files, rolling over after max_bundles bundles or max_bytes bytes of JSON
+    """
+
+    def __init__(self, directory, prefix='bundles', max_bundles=None, max_bytes=None, compress=False):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bundles = max_bundles
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.shards = []
+        self.raw = None
+        self.output = None
+        self.current = None
+        os.makedirs(directory, exist_ok=True)
+
+    def open_shard(self, number):
+        """
+        This function starts a shard
+        :param number: shard number, starting at 1
+        """
+        name = shard_name(self.prefix, number, self.compress)
+        self.raw = HashingFile(os.path.join(self.directory, name))
+        self.output = None
+        self.current = {"file": name, "bundles": 0, "first_row": None, "last_row": None, "json_bytes": 0}
+
+    def close_shard(self):
+        """
+        This function finishes the current shard and records it in the manifest
+        """
+        if self.current is None:
+            return
+        if self.compress and self.output is not None:
+            self.output.close()
+        self.output = None
+        self.raw.flush()
+        os.fsync(self.raw.file.fileno())
+        self.raw.close()
+        self.current['bytes'] = self.raw.size
+        self.current['sha256'] = self.raw.sha256.hexdigest()
+        self.shards.append(self.current)
+        self.current = None
+
+    def write(self, row_number, bundle):
+        """
+        This function writes a bundle, rolling over to a new shard when the current one is full
+        :param row_number: CSV row number of the bundle
+        :param bundle: bundle json object
+        """
+        self.write_line(row_number, (json.dumps(bundle) + '\n').encode('utf-8'))
+
+    def write_line(self, row_number, line):
+        """
+        This function writes an already serialized bundle
+        :param row_number: CSV row number of the bundle
+        :param line: bundle json followed by a newline, as bytes
+        """
+        if self.current is not None and (
+                (self.max_bundles and self.current['bundles'] >= self.max_bundles) or
+                (self.max_bytes and self.current['json_bytes'] + len(line) > self.max_bytes)):
+            self.close_shard()
+        if self.current is None:
+            self.open_shard(len(self.shards) + 1)
+        if self.output is None:
+            # a gzip member is started per shard and after every checkpoint
+            self.output = gzip.GzipFile(fileobj=self.raw, mode='wb', mtime=0) if self.compress else self.raw
+        self.output.write(line)
+        self.current['bundles'] += 1
+        self.current['json_bytes'] += len(line)
+        if self.current['first_row'] is None:
+            self.current['first_row'] = row_number
+        self.current['last_row'] = row_number
+
+    def checkpoint(self):
+        """
+        This function makes everything written so far durable. A compressed shard ends its gzip member, a gzip file
+        of several members reads back as their concatenation.
+        :return: returns the output position, ShardWriter.resume continues from it
+        """
+        current = None
+        if self.current is not None:
+            if self.compress and self.output is not None:
+                self.output.close()
+                self.output = None
+            self.raw.flush()
+            os.fsync(self.raw.file.fileno())
+            current = dict(self.current, bytes=self.raw.size)
+        return {"shards": list(self.shards), "current": current}
+
+    @classmethod
+    def resume(cls, directory, position, **options):
+        """
+        This function returns a writer continuing from a checkpointed output position. The current shard is
+        truncated to its checkpointed size and the shards started after the checkpoint are removed.
+        :param directory: output directory
+        :param position: output position returned by checkpoint
+        :param options: ShardWriter options, the same as for the checkpointed writer
+        :return: returns the shard writer
+        """
+        writer = cls(directory, **options)
+        writer.shards = list(position['shards'])
+        number = len(writer.shards) + 1
+        current = position['current']
+        if current is not None:
+            path = os.path.join(directory, current['file'])
+            with open(path, 'r+b') as shard_file:
+                shard_file.truncate(current['bytes'])
+            writer.raw = HashingFile(path, 'ab')
+            writer.current = {key: value for key, value in current.items() if key != 'bytes'}
+            number += 1
+        while os.path.exists(os.path.join(directory, shard_name(writer.prefix, number, writer.compress))):
+            os.remove(os.path.join(directory, shard_name(writer.prefix, number, writer.compress)))
+            number += 1
+        return writer
+
+    def close(self, source=None, options=None):
+        """
+        This function finishes the last shard and writes the manifest
+        :param source: input file name recorded in the manifest
+        :param options: conversion options recorded in the manifest, see regenerate_shard
+        :return: returns the manifest json object
+        """
+        self.close_shard()
+        manifest = {"source": source, "prefix": self.prefix, "compress": self.compress, "options": options,
+                    "shards": self.shards}
+        write_manifest(self.directory, manifest)
+        return manifest
+
+
+def verify_shards(directory):
+    """
+    This function checks every shard of an output directory against the manifest checksums
+    :param directory: output directory
+    :return: returns the list of shard numbers that are missing or don't match
+    """
+    failed = []
+    for number, shard in enumerate(read_manifest(directory)['shards'], 1):
+        sha256 = hashlib.sha256()
+        try:
+            with open(os.path.join(directory, shard['file']), 'rb') as shard_file:
+                for block in iter(lambda: shard_file.read(1 << 20), b''):  # pylint: disable=W0640
+                    sha256.update(block)
+        except FileNotFoundError:
+            failed.append(number)
+            continue
+        if sha256.hexdigest() != shard['sha256']:
+            failed.append(number)
+    return failed
+
+
+def regenerate_shard(directory, number, bundles):
+    """
+    This function writes one shard again and updates its manifest entry
+    :param directory: output directory
+    :param number: shard number, starting at 1
+    :param bundles: iterable of (row number, bundle json object) for the rows of the shard
+    :return: returns the new manifest entry of the shard
+    """
+    manifest = read_manifest(directory)
+    writer = ShardWriter(directory, prefix=manifest['prefix'], compress=manifest['compress'])
+    writer.open_shard(number)
+    for row_number, bundle in bundles:
+        writer.write(row_number, bundle)
+    writer.close_shard()
+    manifest['shards'][number - 1] = writer.shards[0]
+    write_manifest(directory, manifest)
+    return writer.shards[0]
@@ -0,0 +1,118 @@
+"""
+Parquet and Arrow input
+
+Death record exports held as Parquet or Arrow IPC files are read in record batches, only the columns of the conversion
+are read (for Parquet, only their column chunks are loaded), and one row group or batch is in memory at a time, so
+files larger than the memory are streamed. Every column of a batch is rendered as a whole with Arrow compute in the
+text form the builders read: dates as ISO 2019-01-12 (the two digit years of the CSV exports would move a 1950 date to
+2050), timestamps as ISO 2019-01-12T10:11:12, times as 10:11:12, booleans as TRUE/FALSE and null values empty. The
+json objects of the rows are then zipped from the columns, no CSV text is written or parsed.
+"""
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+# text forms of the typed values, see DateParser; dates keep their century
+DATE_FORMAT = '%Y-%m-%d'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+TIME_FORMAT = '%H:%M:%S'
+# rows per record batch
+BATCH_SIZE = 8192
+
+
+def is_columnar_file(path):
+    """
+    This function tells Parquet and Arrow files from CSV files by their extension
+    :param path: input path
+    :return: returns True for a Parquet or Arrow file
+    """
+    return path.lower().endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS)
+
+
+def column_strings(name, array):
+    """
+    This function renders a column of a record batch as the strings of a CSV export
+    :param name: column name, timestamps of the time columns are rendered as times
+    :param array: Arrow array
+    :return: returns the list of strings
+    """
+    data_type = array.type
+    if pa.types.is_dictionary(data_type):
+        array = array.dictionary_decode()
+        data_type = array.type
+    if pa.types.is_boolean(data_type):
+        array = pc.if_else(array, 'TRUE', 'FALSE')
+    elif pa.types.is_date(data_type):
+        array = pc.strftime(pc.cast(array, pa.timestamp('s')), format=DATE_FORMAT)
+    elif pa.types.is_timestamp(data_type):
+        array = pc.strftime(pc.cast(array, pa.timestamp('s', data_type.tz), safe=False),
+                            format=TIME_FORMAT if 'TIME' in name else TIMESTAMP_FORMAT)
+    elif pa.types.is_time(data_type):
+        array = pc.cast(pc.cast(array, pa.time32('s'), safe=False), pa.string())
+    elif not pa.types.is_string(data_type):
+        array = pc.cast(array, pa.string())
+    # much faster than to_pylist for strings
+    return pc.fill_null(array, '').to_numpy(zero_copy_only=False).tolist()
+
+
+def column_names(path):
+    """
+    This function returns the column names of a Parquet or Arrow IPC file
+    :param path: path of the file
+    :return: returns the list of column names
+    """
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        return pq.read_schema(path).names
+    with pa.memory_map(path) as source:
+        try:
+            return pa.ipc.open_file(source).schema.names
+        except pa.ArrowInvalid:
+            source.seek(0)
+            return pa.ipc.open_stream(source).schema.names
+
+
+def record_batches(path, columns=None, batch_size=BATCH_SIZE):
+    """
+    This function reads the record batches of a Parquet or Arrow IPC file
+    :param path: path of the file
+    :param columns: optional set of the columns to read
+    :param batch_size: rows per batch of a Parquet file, Arrow files keep their own batches
+    :return: yields the record batches, holding the requested columns the file has
+    """
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        parquet_file = pq.ParquetFile(path)
+        names = [name for name in parquet_file.schema_arrow.names if columns is None or name in columns]
+        # one row group is decoded at a time
+        yield from parquet_file.iter_batches(batch_size=batch_size, columns=names)
+        return
+    with pa.memory_map(path) as source:
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            # streaming format
+            source.seek(0)
+            reader = pa.ipc.open_stream(source)
+            batches = iter(reader)
+        names = [name for name in reader.schema.names if columns is None or name in columns]
+        for batch in batches:
+            yield batch.select(names)
+
+
+def read_columnar_rows(path, columns=None, batch_size=BATCH_SIZE):
+    """
+    This function reads the rows of a Parquet or Arrow IPC file
+    :param path: path of the file
+    :param columns: optional set of the columns to keep, see mapped_columns
+    :param batch_size: rows per batch of a Parquet file
+    :return: yields the row number and the csv json object for every row
+    """
+    line_number = 1
+    for batch in record_batches(path, columns, batch_size):
+        names = batch.schema.names
+        values = [column_strings(name, column) for name, column in zip(names, batch.columns)]
+        for row in zip(*values) if values else [()] * batch.num_rows:
+            yield line_number, dict(zip(names, row))
+            line_number += 1
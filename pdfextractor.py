@@ -0,0 +1,217 @@
+"""
+PDF death certificate extraction
+
+The fields of a certificate are read straight from the PDF into the row model of the CSV conversion, a json object
+keyed on the CSV column names, so the load_* functions consume PDF and CSV records alike. Every PDF file holds one
+certificate. Fields come from the form widgets of the pages (fillable certificates) and from the "Label: value" lines
+of the text layer (printed ones). A field name or label matches a column when both normalise to the same key, e.g.
+"Patients Address City" and PATIENTS_ADDRESS_CITY. Form values win over text values, an earlier page over a later one.
+
+Documents, and chunks of pages of the long ones, are extracted on a process pool. The extracted fields are cached on
+the sha256 of the PDF bytes, so a PDF seen before is not parsed again.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pypdf import PdfReader
+
+# bumped when the extraction changes, the fields cached by an older version are not used
+EXTRACTOR_VERSION = 1
+# pages extracted by one task, longer documents are split across the workers
+PAGES_PER_TASK = 4
+# "Label: value" line of the text layer
+LABEL_LINE = re.compile(r'^\s*([A-Za-z][^:]{0,80}?)\s*:\s*(.*?)\s*$')
+# radio button flag of a button field
+RADIO_FLAG = 1 << 15
+
+
+def field_key(name):
+    """
+    This function normalises a column name, form field name or label
+    :param name: name
+    :return: returns the upper case words of the name joined with underscores
+    """
+    return re.sub(r'[^A-Z0-9]+', '_', name.upper()).strip('_')
+
+
+def widget_field(widget):
+    """
+    This function returns the name and value of a form widget, looking them up on its parent fields when the widget
+    doesn't hold them
+    :param widget: widget annotation dictionary
+    :return: returns the field name and the value as a string, None for an unnamed widget
+    """
+    name, value, field_type, flags = (widget.get('/T'), widget.get('/V'), widget.get('/FT'), widget.get('/Ff'))
+    parent = widget.get('/Parent')
+    while parent is not None and None in (name, value, field_type, flags):
+        parent = parent.get_object()
+        name = parent.get('/T') if name is None else name
+        value = parent.get('/V') if value is None else value
+        field_type = parent.get('/FT') if field_type is None else field_type
+        flags = parent.get('/Ff') if flags is None else flags
+        parent = parent.get('/Parent')
+    if name is None:
+        return None, None
+    if field_type == '/Btn' and not int(flags or 0) & RADIO_FLAG:
+        # check box, TRUE/FALSE like the CSV exports
+        return str(name), 'FALSE' if value in (None, '/Off') else 'TRUE'
+    if value is None:
+        return str(name), ''
+    if isinstance(value, list):
+        value = ','.join(str(item).lstrip('/') for item in value)
+    return str(name), str(value).lstrip('/') if field_type == '/Btn' else str(value)
+
+
+def extract_pages(path, first_page, last_page):
+    """
+    This function extracts the fields of a range of pages, it runs in the process pool
+    :param path: path of the PDF file
+    :param first_page: number of the first page, from 0
+    :param last_page: number of the page after the last one
+    :return: returns the form fields and the text fields of the pages, dictionaries keyed on field_key
+    """
+    reader = PdfReader(path)
+    form = {}
+    text = {}
+    for page in reader.pages[first_page:last_page]:
+        for annotation in page.get('/Annots') or []:
+            widget = annotation.get_object()
+            if widget.get('/Subtype') != '/Widget':
+                continue
+            name, value = widget_field(widget)
+            if name is not None:
+                form.setdefault(field_key(name), value)
+        for line in (page.extract_text() or '').splitlines():
+            match = LABEL_LINE.match(line)
+            if match:
+                text.setdefault(field_key(match.group(1)), match.group(2))
+    return form, text
+
+
+def merge_fields(chunks):
+    """
+    This function merges the fields of the page chunks of a document
+    :param chunks: list of the (form fields, text fields) of the chunks, in page order
+    :return: returns the fields of the document keyed on field_key
+    """
+    fields = {}
+    for _, text in reversed(chunks):
+        fields.update(text)
+    for form, _ in reversed(chunks):
+        fields.update({key: value for key, value in form.items() if value != ''})
+    return fields
+
+
+class FieldCache:
+    """
+    Extracted fields of the PDFs already seen, one JSON file per document named after the sha256 of its bytes
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.join(directory, 'v%d' % EXTRACTOR_VERSION)
+
+    def path(self, digest):
+        """
+        :return: returns the path of the cache file of a document
+        """
+        return os.path.join(self.directory, digest[:2], digest + '.json')
+
+    def get(self, digest):
+        """
+        This function looks a document up in the cache
+        :param digest: sha256 of the PDF bytes, hex
+        :return: returns the fields, None for a document not seen before
+        """
+        try:
+            with open(self.path(digest)) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, digest, fields):
+        """
+        This function stores the fields of a document
+        :param digest: sha256 of the PDF bytes, hex
+        :param fields: fields keyed on field_key
+        """
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as cache_file:
+            json.dump(fields, cache_file)
+        os.replace(path + '.tmp', path)
+
+
+def pdf_files(paths):
+    """
+    This function lists the PDF files to convert
+    :param paths: PDF files and directories, a directory stands for the PDF files in it
+    :return: returns the sorted list of PDF paths
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith('.pdf')))
+        else:
+            files.append(path)
+    return files
+
+
+def extract_documents(paths, processes=None, cache_directory=None):
+    """
+    This function extracts the fields of PDF documents on a pool of processes
+    :param paths: PDF paths
+    :param processes: number of worker processes, all the cores by default
+    :param cache_directory: optional directory of the field cache
+    :return: yields the path and the fields keyed on field_key of every document, in the order of paths
+    """
+    cache = FieldCache(cache_directory) if cache_directory else None
+    processes = processes or os.cpu_count()
+    # documents in flight, bounds the memory of the results waiting for an earlier document
+    window = processes * 4
+    paths = iter(paths)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        while True:
+            while len(pending) < window:
+                path = next(paths, None)
+                if path is None:
+                    break
+                with open(path, 'rb') as pdf_file:
+                    data = pdf_file.read()
+                digest = hashlib.sha256(data).hexdigest()
+                fields = cache.get(digest) if cache is not None else None
+                if fields is not None:
+                    pending.append((path, digest, fields))
+                    continue
+                page_count = len(PdfReader(BytesIO(data)).pages)
+                chunks = [pool.submit(extract_pages, path, first_page, first_page + PAGES_PER_TASK)
+                          for first_page in range(0, max(page_count, 1), PAGES_PER_TASK)]
+                pending.append((path, digest, chunks))
+            if not pending:
+                return
+            path, digest, fields = pending.popleft()
+            if isinstance(fields, list):
+                fields = merge_fields([chunk.result() for chunk in fields])
+                if cache is not None:
+                    cache.put(digest, fields)
+            yield path, fields
+
+
+def read_pdf_rows(paths, columns, processes=None, cache_directory=None):
+    """
+    This function reads the certificates of PDF files as csv json objects
+    :param paths: PDF files and directories of PDF files
+    :param columns: columns of the json objects, the fields missing from a document are empty
+    :param processes: number of extraction processes, all the cores by default
+    :param cache_directory: optional directory of the field cache
+    :return: yields the document number and the csv json object for every document
+    """
+    keys = [(column, field_key(column)) for column in columns]
+    for number, (_, fields) in enumerate(extract_documents(pdf_files(paths), processes, cache_directory), 1):
+        yield number, {column: fields.get(key, '') for column, key in keys}
@@ -0,0 +1,251 @@
+"""
+Pipelined conversion stages
+
+A conversion is split into stages connected by bounded queues: the source (reading and decoding the rows) runs on its
+own thread, every stage (building the bundles, serializing them) on its own pool of worker threads, and the consumer
+(writing the output) on the calling thread. Reading, encoding and writing overlap with the CPU work instead of running
+in sequence per row; file and socket I/O and zlib release the GIL while they wait. A full queue blocks the stage
+feeding it. Items carry their sequence number and the consumer gets them back in input order, a stage with one worker
+also sees them in input order. Results coming out of order wait for the earlier ones, so the source only reads an item
+while fewer than the sum of the queue depths are in flight: one slow item stops the reading instead of letting the
+later results pile up, and memory stays bounded by the queue depths whatever the input size. A stage returns
+SKIP to drop an item; an exception raised by the source or a stage is raised to the consumer at the position of its
+item. Every stage keeps metrics: items, busy time, item latency, depth of its input queue, and the time spent waiting
+for input (starved) or for room in the next queue or the window (blocked).
+"""
+import queue
+import threading
+import time
+
+# items a queue holds before the stage feeding it blocks
+QUEUE_DEPTH = 64
+# seconds between checks for a cancelled pipeline while waiting on a queue
+POLL_INTERVAL = 0.1
+# returned by a stage to drop an item
+SKIP = object()
+# sequence number of the end of the items
+DONE = -1
+
+
+class Failure:
+    """
+    Exception raised for an item, raised to the consumer at the position of the item
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+class StageMetrics:
+    """
+    Counters of a stage, updated by its workers
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.max_latency = 0.0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency, depth, starved, blocked):
+        """
+        This function counts one item
+        :param latency: seconds spent on the item
+        :param depth: items in the input queue when the item was taken
+        :param starved: seconds waited for the item
+        :param blocked: seconds waited for room in the next queue
+        """
+        with self.lock:
+            self.items += 1
+            self.busy += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+            self.starved += starved
+            self.blocked += blocked
+
+    def as_dict(self):
+        """
+        :return: returns the metrics json object
+        """
+        items = self.items or 1
+        return {"stage": self.name, "workers": self.workers, "items": self.items,
+                "busy_seconds": round(self.busy, 6),
+                "mean_latency_ms": round(self.busy / items * 1000, 4),
+                "max_latency_ms": round(self.max_latency * 1000, 4),
+                "mean_queue_depth": round(self.depth_total / items, 2), "max_queue_depth": self.max_depth,
+                "starved_seconds": round(self.starved, 6), "blocked_seconds": round(self.blocked, 6)}
+
+
+class Pipeline:
+    """
+    Source, stages and consumer of a conversion, see run
+    """
+
+    def __init__(self, stages, depth=QUEUE_DEPTH, source='read', consumer='write'):
+        """
+        :param stages: list of (name, function, workers), a function takes an item and returns the next one or SKIP
+        :param depth: items per queue
+        :param source: name of the stage reading the items
+        :param consumer: name of the stage taking the results
+        """
+        self.stages = [(name, function, max(1, workers or 1)) for name, function, workers in stages]
+        self.depth = depth
+        self.metrics = ([StageMetrics(source, 1)] + [StageMetrics(name, workers) for name, _, workers in self.stages]
+                        + [StageMetrics(consumer, 1)])
+        self.cancelled = threading.Event()
+
+    def put(self, outbox, item):
+        """
+        This function puts an item on a queue, giving up when the pipeline is cancelled
+        :return: returns the seconds waited for room
+        """
+        start = time.perf_counter()
+        while not self.cancelled.is_set():
+            try:
+                outbox.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - start
+
+    def acquire(self, window):
+        """
+        This function takes a place in the window of the items in flight, giving up when the pipeline is cancelled
+        :return: returns the seconds waited for it
+        """
+        start = time.perf_counter()
+        while not self.cancelled.is_set():
+            if window.acquire(timeout=POLL_INTERVAL):
+                break
+        return time.perf_counter() - start
+
+    def get(self, inbox):
+        """
+        This function takes an item from a queue
+        :return: returns the item, the queue depth before it was taken and the seconds waited for it, None for
+                 the item when the pipeline is cancelled
+        """
+        start = time.perf_counter()
+        depth = inbox.qsize()
+        while not self.cancelled.is_set():
+            try:
+                return inbox.get(timeout=POLL_INTERVAL), depth, time.perf_counter() - start
+            except queue.Empty:
+                continue
+        return None, depth, time.perf_counter() - start
+
+    def read(self, items, outbox, next_workers, window):
+        """
+        This function numbers the items of the source and feeds them to the first stage, an item is read once it
+        has a place in the window of the items in flight
+        """
+        metrics = self.metrics[0]
+        sequence = 0
+        iterator = iter(items)
+        while not self.cancelled.is_set():
+            waited = self.acquire(window)
+            if self.cancelled.is_set():
+                break
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            except Exception as error:  # pylint: disable=W0703
+                self.put(outbox, (sequence, Failure(error)))
+                break
+            latency = time.perf_counter() - start
+            metrics.record(latency, 0, 0.0, waited + self.put(outbox, (sequence, item)))
+            sequence += 1
+        for _ in range(next_workers):
+            self.put(outbox, (DONE, None))
+
+    def work(self, index, inbox, outbox, running, next_workers):
+        """
+        This function runs the function of a stage on the items of its input queue until the end of the items
+        """
+        _, function, _ = self.stages[index]
+        metrics = self.metrics[index + 1]
+        while True:
+            taken, depth, starved = self.get(inbox)
+            if taken is None:
+                return
+            sequence, item = taken
+            if sequence == DONE:
+                break
+            start = time.perf_counter()
+            if item is not SKIP and not isinstance(item, Failure):
+                try:
+                    item = function(item)
+                except Exception as error:  # pylint: disable=W0703
+                    item = Failure(error)
+            latency = time.perf_counter() - start
+            metrics.record(latency, depth, starved, self.put(outbox, (sequence, item)))
+        with running[1]:
+            running[0] -= 1
+            last = running[0] == 0
+        if last:
+            # the last worker of the stage ends the items of the next one
+            for _ in range(next_workers):
+                self.put(outbox, (DONE, None))
+
+    def run(self, items):
+        """
+        This function runs the pipeline
+        :param items: iterable of the source items, iterated on the source thread
+        :return: yields the results of the last stage in input order; the time the consumer takes between two results
+                 is measured as the consumer stage. Closing the generator cancels the pipeline.
+        """
+        queues = [queue.Queue(self.depth) for _ in range(len(self.stages) + 1)]
+        # items read and not yet taken by the consumer
+        window = threading.Semaphore(self.depth * len(queues))
+        workers = [stage[2] for stage in self.stages] + [1]
+        threads = [threading.Thread(target=self.read, args=(items, queues[0], workers[0], window), daemon=True)]
+        for index in range(len(self.stages)):
+            running = [workers[index], threading.Lock()]
+            threads.extend(threading.Thread(target=self.work,
+                                            args=(index, queues[index], queues[index + 1], running, workers[index + 1]),
+                                            daemon=True)
+                           for _ in range(workers[index]))
+        for thread in threads:
+            thread.start()
+        consumer = self.metrics[-1]
+        pending = {}
+        expected = 0
+        try:
+            while True:
+                taken, depth, starved = self.get(queues[-1])
+                sequence, item = taken
+                if sequence == DONE:
+                    break
+                pending[sequence] = item
+                # results are released in input order
+                while expected in pending:
+                    item = pending.pop(expected)
+                    expected += 1
+                    window.release()
+                    if isinstance(item, Failure):
+                        raise item.error
+                    if item is SKIP:
+                        continue
+                    start = time.perf_counter()
+                    yield item
+                    consumer.record(time.perf_counter() - start, depth, starved, 0.0)
+                    starved = 0.0
+        finally:
+            self.cancelled.set()
+            for thread in threads:
+                thread.join()
+
+    def report(self):
+        """
+        :return: returns the metrics of every stage, source first and consumer last
+        """
+        return [metrics.as_dict() for metrics in self.metrics]
@@ -0,0 +1,281 @@
+"""
+Per-request profiling
+
+A request asking for a profile runs under one of two profilers: pstats runs it under cProfile (exact call counts and
+times of every function, the overhead inflates the times of small functions), speedscope samples the stack of the
+request thread about every millisecond (no call counts, times at the resolution of the sampling) and writes a
+speedscope sampled profile. Both are summed up into the same breakdown: the time in the
+builders (load_patient_data, loadpatientextensions, load_cod_data), del_none and the fhir.resources constructors, and
+the functions taking the most time. Profiles are stored in a directory with their breakdown, the oldest ones are
+removed past MAX_PROFILES. Nothing is installed for a request that doesn't ask, so profiling costs nothing when off.
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+# profile formats: suffix of the stored file
+FORMATS = {'pstats': '.prof', 'speedscope': '.speedscope.json'}
+FOCUS_FUNCTIONS = ('load_patient_data', 'loadpatientextensions', 'load_cod_data', 'del_none')
+CONSTRUCTORS = 'fhir.resources constructors'
+CONSTRUCTOR_PATH = os.path.join('fhir', 'resources', '')
+# seconds between two samples
+SAMPLE_INTERVAL = 0.001
+# functions listed in the breakdown
+TOP_FUNCTIONS = 25
+# profiles kept in the directory
+MAX_PROFILES = 100
+
+
+def is_constructor(filename, name):
+    """
+    :return: returns True for the constructor of a fhir.resources class
+    """
+    return name == '__init__' and CONSTRUCTOR_PATH in filename
+
+
+def function_times():
+    """
+    :return: returns the counters of a function in a breakdown
+    """
+    return {"calls": 0, "self_seconds": 0.0, "cumulative_seconds": 0.0}
+
+
+def rounded(times):
+    """
+    :return: returns the counters with their seconds rounded to the microsecond
+    """
+    return {key: round(value, 6) if isinstance(value, float) else value for key, value in times.items()}
+
+
+def pstats_breakdown(profile, seconds):
+    """
+    This function sums up a cProfile profile
+    :param profile: cProfile.Profile, disabled
+    :param seconds: wall time of the request
+    :return: returns the breakdown json object
+    """
+    stats = pstats.Stats(profile).stats
+    functions = {name: function_times() for name in FOCUS_FUNCTIONS}
+    constructors = function_times()
+    top = []
+    for (filename, line, name), (_, calls, own, cumulative, callers) in stats.items():
+        if name in functions:
+            functions[name]['calls'] += calls
+            functions[name]['self_seconds'] += own
+            functions[name]['cumulative_seconds'] += cumulative
+        if is_constructor(filename, name):
+            constructors['calls'] += calls
+            constructors['self_seconds'] += own
+            # the constructors calling each other are counted once, from the outermost call
+            constructors['cumulative_seconds'] += sum(
+                caller_stats[3] for caller, caller_stats in callers.items() if not is_constructor(caller[0], caller[2]))
+        top.append({"function": name, "file": filename, "line": line, "calls": calls, "self_seconds": own,
+                    "cumulative_seconds": cumulative})
+    top.sort(key=lambda times: times['self_seconds'], reverse=True)
+    return {"profiler": "cProfile", "seconds": round(seconds, 6),
+            "functions": {name: rounded(times) for name, times in functions.items()},
+            CONSTRUCTORS: rounded(constructors),
+            "top": [rounded(times) for times in top[:TOP_FUNCTIONS]]}
+
+
+class StackSampler:
+    """
+    Samples the stack of the thread it is installed in: at the first call or return after every interval, the stack is
+    recorded with the time since the previous sample. The samples are taken in the profiled thread itself, a sampling
+    thread would only get the GIL when the profiled code releases it, and would see mostly I/O.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        # (filename, line, name): frame index
+        self.frames = {}
+        self.samples = []
+        self.weights = []
+        self.last = None
+
+    def start(self):
+        """
+        This function starts sampling the calling thread
+        """
+        self.last = time.perf_counter()
+        sys.setprofile(self.event)
+
+    def stop(self):
+        """
+        This function stops sampling
+        """
+        sys.setprofile(None)
+
+    def event(self, frame, event, arg):
+        """
+        This function is the profile function of the thread, see sys.setprofile
+        """
+        now = time.perf_counter()
+        if now - self.last < self.interval:
+            return
+        stack = []
+        if event in ('c_call', 'c_return', 'c_exception'):
+            # the builtin being called or returning
+            stack.append(self.frames.setdefault(('<built-in>', 0, getattr(arg, '__qualname__', str(arg))),
+                                                len(self.frames)))
+        while frame is not None:
+            code = frame.f_code
+            stack.append(self.frames.setdefault((code.co_filename, code.co_firstlineno, code.co_name),
+                                                len(self.frames)))
+            frame = frame.f_back
+        stack.reverse()
+        self.samples.append(stack)
+        # a sample stands for the time since the previous one
+        self.weights.append(now - self.last)
+        self.last = now
+
+    def speedscope(self, name):
+        """
+        This function returns the samples as a speedscope file
+        :param name: name of the profile
+        :return: returns the speedscope json object
+        """
+        frames = sorted(self.frames.items(), key=lambda item: item[1])
+        return {"$schema": "https://www.speedscope.app/file-format-schema.json",
+                "shared": {"frames": [{"name": function, "file": filename, "line": line}
+                                      for (filename, line, function), _ in frames]},
+                "profiles": [{"type": "sampled", "name": name, "unit": "seconds", "startValue": 0,
+                              "endValue": sum(self.weights), "samples": self.samples, "weights": self.weights}],
+                "name": name, "exporter": "pdfcsvparse"}
+
+    def breakdown(self, seconds):
+        """
+        This function sums up the samples
+        :param seconds: wall time of the request
+        :return: returns the breakdown json object, without call counts
+        """
+        keys = {index: key for key, index in self.frames.items()}
+        own = defaultdict(float)
+        cumulative = defaultdict(float)
+        constructors = 0.0
+        for stack, weight in zip(self.samples, self.weights):
+            own[stack[-1]] += weight
+            for index in set(stack):
+                cumulative[index] += weight
+            # time spent inside a constructor, once per stack whatever the nesting
+            if any(is_constructor(keys[index][0], keys[index][2]) for index in stack):
+                constructors += weight
+        functions = {name: {"self_seconds": 0.0, "cumulative_seconds": 0.0} for name in FOCUS_FUNCTIONS}
+        for index, (_, _, name) in keys.items():
+            if name in functions:
+                functions[name]['self_seconds'] += own[index]
+                functions[name]['cumulative_seconds'] += cumulative[index]
+        constructor_own = sum(own[index] for index, key in keys.items() if is_constructor(key[0], key[2]))
+        top = sorted(keys, key=lambda index: own[index], reverse=True)[:TOP_FUNCTIONS]
+        return {"profiler": "sampling", "seconds": round(seconds, 6), "samples": len(self.samples),
+                "functions": {name: rounded(times) for name, times in functions.items()},
+                CONSTRUCTORS: rounded({"self_seconds": constructor_own, "cumulative_seconds": constructors}),
+                "top": [rounded({"function": keys[index][2], "file": keys[index][0], "line": keys[index][1],
+                                 "self_seconds": own[index], "cumulative_seconds": cumulative[index]})
+                        for index in top]}
+
+
+def profile_call(profile_format, function, *args, **kwargs):
+    """
+    This function calls a function under the profiler of a format
+    :param profile_format: pstats or speedscope
+    :param function: function called
+    :return: returns the result of the function, the breakdown json object and the profile data to store
+    """
+    start = time.perf_counter()
+    if profile_format == 'pstats':
+        profile = cProfile.Profile()
+        try:
+            result = profile.runcall(function, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+        return result, pstats_breakdown(profile, seconds), profile
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        sampler.stop()
+        seconds = time.perf_counter() - start
+    return result, sampler.breakdown(seconds), sampler
+
+
+class ProfileStore:
+    """
+    Directory of the stored profiles, <id>.json holds the breakdown and <id>.prof or <id>.speedscope.json the
+    profile
+    """
+
+    def __init__(self, directory, max_profiles=MAX_PROFILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def save(self, profile_format, breakdown, profile, name):
+        """
+        This function stores a profile and removes the oldest ones
+        :param profile_format: pstats or speedscope
+        :param breakdown: breakdown json object
+        :param profile: cProfile.Profile or StackSampler, see profile_call
+        :param name: name of the profile, e.g. the request path
+        :return: returns the profile id
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, profile_id)
+        if profile_format == 'pstats':
+            profile.dump_stats(path + FORMATS['pstats'] + '.tmp')
+        else:
+            with open(path + FORMATS['speedscope'] + '.tmp', 'w') as profile_file:
+                json.dump(profile.speedscope(name), profile_file)
+        os.replace(path + FORMATS[profile_format] + '.tmp', path + FORMATS[profile_format])
+        with open(path + '.json.tmp', 'w') as breakdown_file:
+            json.dump(dict(breakdown, id=profile_id, name=name, format=profile_format, time=time.time()),
+                      breakdown_file, indent=2)
+        os.replace(path + '.json.tmp', path + '.json')
+        self.prune()
+        return profile_id
+
+    def prune(self):
+        """
+        This function removes the oldest profiles past max_profiles
+        """
+        breakdowns = [entry for entry in os.scandir(self.directory)
+                      if entry.name.endswith('.json') and not entry.name.endswith(FORMATS['speedscope'])]
+        breakdowns.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in breakdowns[:max(0, len(breakdowns) - self.max_profiles)]:
+            profile_id = entry.name[:-len('.json')]
+            for suffix in ['.json'] + list(FORMATS.values()):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def breakdown(self, profile_id):
+        """
+        This function loads the breakdown of a profile
+        :param profile_id: profile id
+        :return: returns the breakdown json object, None when there is no such profile
+        """
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + '.json')) as breakdown_file:
+                return json.load(breakdown_file)
+        except FileNotFoundError:
+            return None
+
+    def profile_path(self, profile_id):
+        """
+        This function returns the file of a profile
+        :param profile_id: profile id
+        :return: returns the path and the format of the profile, None when there is no such profile
+        """
+        breakdown = self.breakdown(profile_id)
+        if breakdown is None:
+            return None
+        return os.path.join(self.directory, profile_id + FORMATS[breakdown['format']]), breakdown['format']
@@ -3,3 +3,10 @@ flask-restplus
 fhir.resources
 werkzeug
 pytz
+gunicorn
+uvicorn
+requests
+pypdf
+pyarrow
+msgpack
+cbor2
@@ -0,0 +1,114 @@
+"""
+Slow row tracing
+
+The conversion time of every row is recorded with the time of each builder, see generate_bundle. The slowest rows of
+a job are kept in a min-heap of fixed size, so a row slower than the fastest of them replaces it in O(log N) and the
+others cost one comparison. Rows are kept with their row number and a redacted fingerprint of their fields: the
+length and the character shape of every non-empty field (upper and lower case letters, digits and blanks collapsed
+to A, a, 9 and one blank, punctuation kept), which shows a pathological string or a giant address line without
+showing any value. A histogram of the latencies of the last rows (power of two buckets) shows how rare the outliers
+are. A tracer is shared by the threads of a pipeline.
+"""
+import heapq
+import re
+import threading
+from collections import Counter, deque
+
+# slowest rows kept
+SLOWEST = 10
+# rows of the rolling histogram
+WINDOW = 10000
+# characters of a field shape
+SHAPE_LENGTH = 40
+SHAPE_CLASSES = ((re.compile('[A-Z]+'), 'A'), (re.compile('[a-z]+'), 'a'), (re.compile('[0-9]+'), '9'),
+                 (re.compile(r'\s+'), ' '))
+NOT_ASCII = re.compile('[^\x00-\x7f]+')
+
+
+def field_shape(value):
+    """
+    This function returns the shape of a field value, without any of its characters
+    :param value: field value
+    :return: returns the shape, e.g. 9 Aa-a for 12 Main-st
+    """
+    shape = NOT_ASCII.sub('~', value[:SHAPE_LENGTH * 4])
+    for pattern, symbol in SHAPE_CLASSES:
+        shape = pattern.sub(symbol, shape)
+    return shape[:SHAPE_LENGTH] + ('...' if len(shape) > SHAPE_LENGTH else '')
+
+
+def fingerprint(csvjsondata):
+    """
+    This function returns the redacted fingerprint of a row
+    :param csvjsondata: holds json data from csv
+    :return: returns the length and shape of every non-empty field, keyed on the column
+    """
+    return {column: {"length": len(value), "shape": field_shape(value)}
+            for column, value in sorted(csvjsondata.items()) if value}
+
+
+def latency_bucket(seconds):
+    """
+    :return: returns the histogram bucket of a latency: the power of two of microseconds it is under
+    """
+    return int(seconds * 1000000).bit_length()
+
+
+class RowTracer:
+    """
+    Latencies of the rows of a job, see record
+    """
+
+    def __init__(self, slowest=SLOWEST, window=WINDOW):
+        self.slowest = slowest
+        # (seconds, order, row entry), the fastest of the slowest rows first
+        self.heap = []
+        self.window = deque(maxlen=window)
+        self.histogram = Counter()
+        self.rows = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, row_number, csvjsondata, seconds, timings=None):
+        """
+        This function records the conversion of a row
+        :param row_number: row number in the file
+        :param csvjsondata: holds json data from csv
+        :param seconds: conversion time of the row
+        :param timings: optional seconds per builder, see generate_bundle
+        """
+        bucket = latency_bucket(seconds)
+        with self.lock:
+            self.rows += 1
+            self.total += seconds
+            if len(self.window) == self.window.maxlen:
+                self.histogram[self.window[0]] -= 1
+            self.window.append(bucket)
+            self.histogram[bucket] += 1
+            if len(self.heap) >= self.slowest and seconds <= self.heap[0][0]:
+                return
+        # the fingerprint of the few slow rows only, out of the lock
+        entry = {"row": row_number, "seconds": round(seconds, 6),
+                 "stages": {stage: round(value, 6) for stage, value in (timings or {}).items()},
+                 "fingerprint": fingerprint(csvjsondata)}
+        with self.lock:
+            if len(self.heap) < self.slowest:
+                heapq.heappush(self.heap, (seconds, self.rows, entry))
+            elif seconds > self.heap[0][0]:
+                heapq.heapreplace(self.heap, (seconds, self.rows, entry))
+
+    def report(self):
+        """
+        This function reports the traced rows
+        :return: returns the report json object: rows, mean, slowest rows (slowest first) and the histogram of the
+                 last rows, one bucket per power of two of microseconds
+        """
+        with self.lock:
+            slowest = [entry for _, _, entry in sorted(self.heap, key=lambda item: item[0], reverse=True)]
+            buckets = sorted((bucket, count) for bucket, count in self.histogram.items() if count)
+            return {"rows": self.rows,
+                    "mean_seconds": round(self.total / self.rows, 6) if self.rows else None,
+                    "slowest": slowest,
+                    "histogram": {"rows": len(self.window),
+                                  "buckets": [{"under_ms": (1 << bucket) / 1000, "rows": count}
+                                              for bucket, count in buckets]}}
@@ -0,0 +1,84 @@
+"""
+Production server for the CSV to FHIR JSON API
+
+Runs the app under gunicorn's pre-fork server. The app, its tables and a warm-up conversion are loaded once in
+the master process, the forked workers share them copy-on-write.
+
+    python server.py --bind 0.0.0.0:8000 --workers 4 --threads 2
+
+Send SIGHUP to the master for a graceful reload of the workers, SIGTERM for a graceful shutdown.
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+from gunicorn.app.base import BaseApplication
+
+
+class FhirJsonServer(BaseApplication):  # pylint: disable=W0223
+    """
+    gunicorn application serving csvtofhirjsonparser.APP
+    """
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        # imported here so the app loads in the master when preload_app is set
+        from conversion import warm_up  # pylint: disable=C0415
+        from csvtofhirjsonparser import APP  # pylint: disable=C0415
+        warm_up()
+        APP.config['WARMED_UP'] = True
+        # keep the warmed up objects out of the collector so workers don't touch (and copy) their pages
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        return APP
+
+
+def parse_args(argv=None):
+    """
+    This function parses the server command line, the defaults can be set from the environment
+    :param argv: command line arguments
+    :return: returns the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Production server for the CSV to FHIR JSON API')
+    parser.add_argument('--bind', default=os.environ.get('FHIRJSON_BIND', '0.0.0.0:8000'))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('FHIRJSON_WORKERS', multiprocessing.cpu_count())))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('FHIRJSON_THREADS', 1)))
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('FHIRJSON_TIMEOUT', 120)),
+                        help='seconds before a silent worker is killed and restarted')
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.environ.get('FHIRJSON_GRACEFUL_TIMEOUT', 30)),
+                        help='seconds workers get to finish their requests on reload or shutdown')
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('FHIRJSON_MAX_REQUESTS', 0)),
+                        help='recycle a worker after this many requests, 0 disables')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    This function starts the production server
+    :param argv: command line arguments
+    """
+    args = parse_args(argv)
+    FhirJsonServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10 if args.max_requests else None,
+        'preload_app': True,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Parallel conversion of a single local CSV file
+
+The file is split into byte ranges that start and end on record boundaries, quoted fields with embedded newlines
+included. Every worker process memory-maps the file, parses and converts its own range and writes the bundles to a
+range file, the range files are merged in order afterwards. No rows go through the parent process. Ranges are read
+with mmapcsvreader, so only the mapped columns are decoded.
+"""
+import json
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from bundlebuilder import generate_bundle, mapped_columns
+from conversion import practitioner_index_for, ConversionStats, RowFilter
+from dateparsing import DateParser
+from mmapcsvreader import MappedCsvReader, next_record_start
+
+# bytes counted at a time when looking for the quote state at the split points
+SCAN_BLOCK = 1 << 26
+
+
+def header_end(mapped):
+    """
+    This function returns the offset just after the header record
+    :param mapped: memory-mapped CSV file
+    :return: returns the byte offset of the first data record
+    """
+    return next_record_start(mapped, 0, 0)
+
+
+def split_ranges(path, parts):
+    """
+    This function splits the data records of a CSV file into byte ranges of about the same size
+    :param path: path of the CSV file
+    :param parts: number of ranges
+    :return: returns the header offset and the list of (start, end) byte ranges
+    """
+    with open(path, 'rb') as csvfile:
+        size = os.fstat(csvfile.fileno()).st_size
+        if size == 0:
+            return 0, []
+        mapped = mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = header_end(mapped)
+            boundaries = [start]
+            counted_to = start
+            quotes = 0
+            for part in range(1, parts):
+                candidate = start + (size - start) * part // parts
+                if candidate <= boundaries[-1]:
+                    continue
+                # quotes between the last record start and the candidate give the quote state at the candidate
+                while counted_to < candidate:
+                    block_end = min(candidate, counted_to + SCAN_BLOCK)
+                    quotes += mapped[counted_to:block_end].count(b'"')
+                    counted_to = block_end
+                boundary = next_record_start(mapped, candidate, quotes)
+                if boundary >= size:
+                    break
+                boundaries.append(boundary)
+                counted_to = boundary
+                quotes = 0
+            boundaries.append(size)
+        finally:
+            mapped.close()
+    return start, [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)
+                   if boundaries[i] < boundaries[i + 1]]
+
+
+def convert_range(path, start, end, output_path, dedupe_practitioners=False, resources=None, filters=(),
+                  record_ids=None):
+    """
+    This function converts the records of a byte range to newline delimited bundles, it runs in a worker process.
+    Every line starts with the row number within the range and a tab.
+    :param path: path of the CSV file
+    :param start: byte offset of the first record of the range
+    :param end: byte offset after the last record of the range
+    :param output_path: file the bundles are written to
+    :param dedupe_practitioners: emit each distinct practitioner of the range once
+    :param resources: resource types to emit, all of them by default
+    :param filters: row filter expressions, see RowFilter
+    :param record_ids: optional RecordIds, the ids are then derived from the natural key of every row
+    :return: returns the number of rows of the range, filtered out rows included, and the counts of the rows
+             converted, see ConversionStats
+    """
+    practitioner_index = practitioner_index_for(dedupe_practitioners, record_ids)
+    row_filter = RowFilter(filters)
+    stats = ConversionStats()
+    # a range is converted on its own, the formats of its date columns are detected once for it
+    dates = DateParser()
+    reader = MappedCsvReader(path, mapped_columns(resources, row_filter, record_ids))
+    try:
+        reader.seek(start, 1)
+        with open(output_path, 'wb') as output:
+            for line_number, json_object in reader.rows(end):
+                if row_filter.matches(json_object):
+                    record_id = record_ids(json_object) if record_ids is not None else None
+                    bundle = json.dumps(generate_bundle(json_object, practitioner_index, resources, record_id,
+                                                        dates=dates))
+                    output.write(('%d\t%s\n' % (line_number, bundle)).encode('utf-8'))
+                    stats.add(json_object, resources)
+    finally:
+        reader.close()
+    return reader.line_number - 1, stats.as_counts()
+
+
+def convert_parallel(path, work_directory, processes=None, dedupe_practitioners=False, resources=None, filters=(),
+                     record_ids=None, stats=None):
+    """
+    This function converts a CSV file on a pool of processes, each converting its own byte range
+    :param path: path of the CSV file
+    :param work_directory: directory for the range files
+    :param processes: number of worker processes, all the cores by default
+    :param dedupe_practitioners: emit each distinct practitioner once per range
+    :param resources: resource types to emit, all of them by default
+    :param filters: row filter expressions, see RowFilter
+    :param record_ids: optional RecordIds
+    :param stats: optional ConversionStats, the counts of every range are merged into it
+    :return: yields the row number and the serialized bundle (one line of bytes) for every row kept, in file order
+    """
+    processes = processes or os.cpu_count()
+    _, ranges = split_ranges(path, processes * 4)
+    os.makedirs(work_directory, exist_ok=True)
+    outputs = [os.path.join(work_directory, '.range-%05d.ndjson' % number) for number in range(len(ranges))]
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(convert_range, path, start, end, output, dedupe_practitioners, resources, filters,
+                               record_ids)
+                   for (start, end), output in zip(ranges, outputs)]
+        rows_before = 0
+        try:
+            for future, output in zip(futures, outputs):
+                rows, counts = future.result()
+                if stats is not None:
+                    stats.merge(counts)
+                with open(output, 'rb') as range_file:
+                    for line in range_file:
+                        row_number, _, line = line.partition(b'\t')
+                        yield rows_before + int(row_number), line
+                rows_before += rows
+                os.remove(output)
+        finally:
+            for future in futures:
+                future.cancel()
+            # the ranges already being converted are waited for, a running worker would write its file afterwards
+            pool.shutdown(wait=True)
+            for output in outputs:
+                if os.path.exists(output):
+                    os.remove(output)
@@ -0,0 +1,193 @@
+"""
+Terminology index
+
+The code systems and value sets the bundles are coded with are FHIR CodeSystem and ValueSet resources in JSON files
+(terminology/ by default, FHIRJSON_TERMINOLOGY to use another directory). They are compiled into two sorted tables,
+each one bytes blob of newline separated records with an array of record offsets: code to system and display, and
+normalized text (display, code and designations) to code. Lookups are binary searches on the blob, there is no object
+per concept, so a large code system stays compact. The gunicorn workers forked after warm_up (see server.py) share the
+loaded tables copy-on-write; the spawned worker processes of the batch endpoint, the ASGI app and --processes load
+their own copy on first use. An LRU cache in front answers the hot values without searching. Every table is keyed on
+the id of the CodeSystem or ValueSet.
+"""
+import bisect
+import functools
+import json
+import os
+import re
+from array import array
+
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'terminology')
+SEPARATOR = '\x1f'
+# ends the key of a record
+KEY_END = '\x1e'
+NOT_TEXT_CHARACTERS = re.compile('[^A-Z0-9]+')
+# lookups answered from the LRU caches
+CACHE_SIZE = 4096
+
+
+def normalize_text(value):
+    """
+    This function normalizes a text for the text to code lookups: upper case, punctuation and blanks collapsed
+    :param value: text
+    :return: returns the normalized text
+    """
+    return NOT_TEXT_CHARACTERS.sub(' ', (value or '').upper()).strip()
+
+
+def resource_concepts(resource):
+    """
+    This function lists the concepts of a CodeSystem or ValueSet resource, nested concepts included
+    :param resource: CodeSystem or ValueSet json object
+    :return: yields the system, code, display and designations of every concept
+    """
+    if resource.get('resourceType') == 'CodeSystem':
+        pending = [(resource['url'], concept) for concept in resource.get('concept', [])]
+    else:
+        pending = [(include['system'], concept) for include in resource.get('compose', {}).get('include', [])
+                   for concept in include.get('concept', [])]
+        pending.extend((contains['system'], contains)
+                       for contains in resource.get('expansion', {}).get('contains', []))
+    while pending:
+        system, concept = pending.pop(0)
+        yield (system, concept['code'], concept.get('display', ''),
+               [designation['value'] for designation in concept.get('designation', [])])
+        pending.extend((system, child) for child in concept.get('concept', []))
+
+
+class SortedTable:
+    """
+    Sorted records of a bytes blob, searched on their key
+    """
+
+    def __init__(self, records):
+        """
+        :param records: iterable of (key, value) strings, the first record of a key wins
+        """
+        unique = {}
+        for key, value in records:
+            unique.setdefault(key, value)
+        self.offsets = array('L')
+        parts = []
+        offset = 0
+        for key in sorted(unique):
+            record = (key + KEY_END + unique[key].replace('\n', ' ') + '\n').encode('utf-8')
+            self.offsets.append(offset)
+            parts.append(record)
+            offset += len(record)
+        self.offsets.append(offset)
+        self.data = b''.join(parts)
+        self.keys = TableKeys(self)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def record(self, index):
+        """
+        :return: returns the key and value bytes of a record
+        """
+        key, _, value = self.data[self.offsets[index]:self.offsets[index + 1] - 1].partition(KEY_END.encode())
+        return key, value
+
+    def get(self, key):
+        """
+        This function looks a key up
+        :param key: key string
+        :return: returns the value string, None when the key isn't in the table
+        """
+        key = key.encode('utf-8')
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self):
+            found, value = self.record(index)
+            if found == key:
+                return value.decode('utf-8')
+        return None
+
+
+class TableKeys:
+    """
+    Sequence view of the keys of a SortedTable, for bisect
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, index):
+        return self.table.record(index)[0]
+
+
+class Terminology:
+    """
+    Code and text lookups in the code systems and value sets of a directory
+    """
+
+    def __init__(self, directory=DIRECTORY):
+        codes = []
+        texts = []
+        self.names = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(directory, filename), encoding='utf-8') as resource_file:
+                resource = json.load(resource_file)
+            if resource.get('resourceType') not in ('CodeSystem', 'ValueSet'):
+                continue
+            name = resource['id']
+            self.names.append(name)
+            for system, code, display, designations in resource_concepts(resource):
+                codes.append((name + SEPARATOR + code, system + SEPARATOR + display))
+                for text in [display, code] + designations:
+                    if normalize_text(text):
+                        texts.append((name + SEPARATOR + normalize_text(text), code))
+        self.codes = SortedTable(codes)
+        self.texts = SortedTable(texts)
+        # one cache per instance
+        self.concept = functools.lru_cache(maxsize=CACHE_SIZE)(self.concept)
+        self.code = functools.lru_cache(maxsize=CACHE_SIZE)(self.code)
+
+    def concept(self, name, code):
+        """
+        This function looks a code up
+        :param name: id of the code system or value set
+        :param code: code
+        :return: returns the system and the display of the code, None when it isn't in the code system or value set
+        """
+        value = self.codes.get(name + SEPARATOR + (code or ''))
+        return None if value is None else tuple(value.split(SEPARATOR, 1))
+
+    def display(self, name, code):
+        """
+        This function returns the display of a code
+        :param name: id of the code system or value set
+        :param code: code
+        :return: returns the display, None when the code isn't in the code system or value set
+        """
+        concept = self.concept(name, code)
+        return None if concept is None else concept[1]
+
+    def code(self, name, text):
+        """
+        This function finds the code of a text: its display, one of its designations or the code itself, ignoring
+        case, blanks and punctuation
+        :param name: id of the code system or value set
+        :param text: text, e.g. a CSV field
+        :return: returns the code, None when no concept has that text
+        """
+        return self.texts.get(name + SEPARATOR + normalize_text(text))
+
+
+TERMINOLOGY = None
+
+
+def get_terminology():
+    """
+    This function returns the terminology of FHIRJSON_TERMINOLOGY, or of the terminology directory, loaded on first use
+    :return: returns the Terminology
+    """
+    global TERMINOLOGY  # pylint: disable=W0603
+    if TERMINOLOGY is None:
+        TERMINOLOGY = Terminology(os.environ.get('FHIRJSON_TERMINOLOGY') or DIRECTORY)
+    return TERMINOLOGY
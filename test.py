@@ -1,6 +1,158 @@
 '''FHIR JSON testing'''
+import asyncio
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
 import unittest
+import zipfile
+from datetime import date, datetime
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
+import cbor2
+import msgpack
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pypdf import PdfWriter
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject, TextStringObject
 from csv_to_fhir_json_parser import APP as app
+import asgiapp
+import conversion
+import fhirjsoncli
+from conversion import RowFilter, convert_named_csv
+from dateparsing import DateParser
+from duplicateindex import DuplicateIndex
+from fhirjsoncli import main as cli_main
+from parquetreader import read_columnar_rows
+from mmapcsvreader import BytesCsvReader, next_record_start
+from pdfextractor import read_pdf_rows
+from pipeline import Pipeline
+from server import FhirJsonServer
+from shardedcsvreader import convert_parallel, split_ranges
+
+
+class FlakyFhirServer(BaseHTTPRequestHandler):
+    '''stand-in FHIR server, answers 503 to the first transaction and 200 to the others'''
+    transactions = []
+
+    def do_POST(self):  # pylint: disable=C0103
+        '''handle a transaction'''
+        transaction = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        FlakyFhirServer.transactions.append(transaction)
+        self.send_response(503 if len(FlakyFhirServer.transactions) == 1 else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+class OneBrokenPool:
+    '''stand-in worker pool, the second file submitted fails as if its worker died'''
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, function, *args):
+        '''run the function, or fail its future'''
+        future = Future()
+        self.submitted += 1
+        if self.submitted == 2:
+            future.set_exception(BrokenProcessPool('worker died'))
+        else:
+            future.set_result(function(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        '''nothing to stop'''
+
+class InlineExecutor:
+    '''stand-in process pool of the ASGI app, builds a batch as it is submitted and logs it'''
+
+    def __init__(self, log):
+        self.log = log
+
+    def submit(self, function, *args):
+        '''run the function, its future completes on the next turn of the event loop'''
+        self.log.append('batch')
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def asgi_post(parts, log):
+    '''
+    post a multipart upload to the ASGI app in a single chunk
+    :param parts: list of (name, filename, bytes) tuples
+    :param log: list the response bodies are logged to
+    :return: status and body of the response
+    '''
+    body = b''.join(b'--x\r\nContent-Disposition: form-data; name="%s"%s\r\n\r\n%s\r\n'
+                    % (name.encode(), b'; filename="%s"' % filename.encode() if filename else b'', data)
+                    for name, filename, data in parts) + b'--x--\r\n'
+    scope = {'type': 'http', 'method': 'POST', 'path': '/entity/fhirjson', 'query_string': b'',
+             'headers': [(b'content-type', b'multipart/form-data; boundary=x')]}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {'status': None, 'body': b''}
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        else:
+            log.append('body')
+            response['body'] += message['body']
+
+    asyncio.run(asgiapp.app(scope, receive, send))
+    return response['status'], response['body']
+
+
+def fillable_pdf(path):
+    '''
+    write a one page certificate with form fields: a text field, a text field holding its value on its parent field,
+    an empty text field, a checked and an unchecked check box, and "Label: value" lines in the text layer
+    :param path: path of the PDF file
+    '''
+    writer = PdfWriter()
+    page = writer.add_blank_page(612, 792)
+    font = DictionaryObject({NameObject('/Type'): NameObject('/Font'), NameObject('/Subtype'): NameObject('/Type1'),
+                             NameObject('/BaseFont'): NameObject('/Helvetica')})
+    page[NameObject('/Resources')] = DictionaryObject({NameObject('/Font'): DictionaryObject(
+        {NameObject('/F1'): writer._add_object(font)})})  # pylint: disable=W0212
+    content = DecodedStreamObject()
+    content.set_data(b'BT /F1 12 Tf 72 720 Td (Patients Address State: MA) Tj 0 -20 Td '
+                     b'(Patients Address City: Boston) Tj 0 -20 Td (Patients Familyname: Printed) Tj ET')
+    page[NameObject('/Contents')] = writer._add_object(content)  # pylint: disable=W0212
+
+    def widget(**entries):
+        rect = ArrayObject([NumberObject(0), NumberObject(0), NumberObject(10), NumberObject(10)])
+        annotation = DictionaryObject({NameObject('/Type'): NameObject('/Annot'),
+                                       NameObject('/Subtype'): NameObject('/Widget'), NameObject('/Rect'): rect})
+        annotation.update({NameObject('/' + key): value for key, value in entries.items()})
+        return annotation
+
+    parent = DictionaryObject({NameObject('/T'): TextStringObject('Patients Givenname'),
+                               NameObject('/FT'): NameObject('/Tx'), NameObject('/V'): TextStringObject('Jane')})
+    parent_reference = writer._add_object(parent)  # pylint: disable=W0212
+    widgets = [writer._add_object(annotation) for annotation in [  # pylint: disable=W0212
+        widget(T=TextStringObject('Patients Familyname'), FT=NameObject('/Tx'), V=TextStringObject('Doe')),
+        widget(Parent=parent_reference),
+        widget(T=TextStringObject('Patients Address City'), FT=NameObject('/Tx'), V=TextStringObject('')),
+        widget(T=TextStringObject('Autopsy Performed'), FT=NameObject('/Btn'), V=NameObject('/Yes')),
+        widget(T=TextStringObject('Autopsy Available'), FT=NameObject('/Btn'), V=NameObject('/Off'))]]
+    parent[NameObject('/Kids')] = ArrayObject([widgets[1]])
+    page[NameObject('/Annots')] = ArrayObject(widgets)
+    writer.root_object[NameObject('/AcroForm')] = DictionaryObject({NameObject('/Fields'): ArrayObject(
+        [widgets[0], parent_reference] + widgets[2:])})
+    with open(path, 'wb') as pdf_file:
+        writer.write(pdf_file)
+
 
 class FhirJsonTesting(unittest.TestCase):
     '''tests'''
@@ -71,5 +223,864 @@ class FhirJsonTesting(unittest.TestCase):
 
         self.assertEqual(response.status_code, 500)
 
+    def test_dedupe_practitioners(self):
+        '''
+        Test each distinct practitioner is emitted once when practitioner deduplication is on
+        :return: fhir json object array
+        '''
+
+        with open('tests/multiple_patient_data.csv', 'rb') as asset:
+            response = self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                dedupe_practitioners='true'
+                        ))
+            data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(response.status_code, 200)
+        practitioners = [entry['id'] for bundle in data for entry in bundle['entry']
+                         if entry.get('resource_type') == 'Practitioner']
+        self.assertEqual(len(practitioners), len(set(practitioners)))
+        for bundle in data:
+            self.assertIn(bundle['entry'][0]['author'][0]['reference'], practitioners)
+
+    def test_batch_patient_data(self):
+        '''
+        Test a failing file does not abort the other files of a batch upload
+        :return: newline delimited fhir json results
+        '''
+
+        with open('tests/multiple_patient_data.csv', 'rb') as asset, \
+                open('tests/missing_fields_patient_data.csv', 'rb') as missing:
+            response = self.app.post('entity/fhirjson/batch', data=dict(
+                file=[(asset, 'multiple.csv'), (missing, 'missing.csv')],
+                        ))
+            results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('bundle' in result for result in results if result['file'] == 'multiple.csv'))
+        self.assertTrue(any('error' in result for result in results if result['file'] == 'missing.csv'))
+
+    def test_deliver_patient_data(self):
+        '''
+        Test bundles are delivered to the FHIR server in transactions, retrying a failed transaction
+        :return: delivery report
+        '''
+        server = HTTPServer(('127.0.0.1', 0), FlakyFhirServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        # the configuration is restored for the other tests
+        with mock.patch.dict(app.config, FHIR_SERVER_URL='http://127.0.0.1:%d/fhir' % server.server_address[1],
+                             FHIR_SERVER_BATCH_SIZE=2), \
+                open('tests/multiple_patient_data.csv', 'rb') as asset:
+            response = self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                deliver='true'
+                        ))
+            report = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(report['bundles_failed'], 0)
+        self.assertEqual(sum(batch['attempts'] for batch in report['batches']), len(report['batches']) + 1)
+        self.assertTrue(all(transaction['type'] == 'transaction' for transaction in FlakyFhirServer.transactions))
+
+    def test_resources_and_filter(self):
+        '''
+        Test only the selected resources are emitted for the rows passing the filter
+        :return: fhir json object array
+        '''
+
+        with open('tests/multiple_patient_data.csv', 'rb') as asset:
+            response = self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                resources='Patient,Observation',
+                filter='PATIENTS_ADDRESS_STATE=MA'
+                        ))
+            data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(response.status_code, 200)
+        for bundle in data:
+            resource_types = {entry.get('resourceType') or entry.get('resource_type') or
+                              entry['resource'].get('resource_type') for entry in bundle['entry']}
+            # cause of death conditions come with the observations
+            self.assertEqual(resource_types - {'Condition'}, {'Patient', 'Observation'})
+            self.assertEqual(bundle['entry'][0]['address'][0]['state'], 'MA')
+
+        with open('tests/multiple_patient_data.csv', 'rb') as asset:
+            response = self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                resources='Patient,Specimen'
+                        ))
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_deterministic_ids(self):
+        '''
+        Test converting the same file twice with deterministic ids gives the same ids
+        :return: fhir json object array
+        '''
+
+        ids = []
+        for _ in range(2):
+            with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                response = self.app.post('entity/fhirjson', data=dict(
+                    file=(asset, 'data.csv'),
+                    deterministic_ids='true'
+                            ))
+                data = json.loads(response.get_data(as_text=True))
+            self.assertEqual(response.status_code, 200)
+            ids.append([(bundle['id'], bundle['entry'][1]['identifier'][0]['value'],
+                         [entry.get('id') for entry in bundle['entry']]) for bundle in data])
+
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(len({bundle_id for bundle_id, _, _ in ids[0]}), len(ids[0]))
+
+    def test_tables(self):
+        '''
+        Test the patients and observations tables hold a row per decedent and per observation
+        :return: zip archive of parquet tables
+        '''
+
+        with open('tests/multiple_patient_data.csv', 'rb') as asset:
+            data = json.loads(self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                        )).get_data(as_text=True))
+        with open('tests/multiple_patient_data.csv', 'rb') as asset:
+            response = self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                tables='parquet'
+                        ))
+
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(BytesIO(response.get_data())) as archive:
+            patients = pq.read_table(BytesIO(archive.read('patients.parquet')))
+            observations = pq.read_table(BytesIO(archive.read('observations.parquet')))
+        self.assertEqual(patients.num_rows, len(data))
+        self.assertEqual(observations.num_rows, sum(1 for bundle in data for entry in bundle['entry']
+                                                    if entry.get('resource', {}).get('resource_type') ==
+                                                    'Observation'))
+
+    def test_binary_encodings(self):
+        '''
+        Test the bundles are encoded as MessagePack or CBOR when the Accept header asks for them
+        :return: fhir json object array
+        '''
+
+        for media_type, decode in (('application/msgpack', msgpack.unpackb), ('application/cbor', cbor2.loads)):
+            with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                response = self.app.post('entity/fhirjson', data=dict(
+                    file=(asset, 'data.csv'),
+                    deterministic_ids='true'
+                            ), headers={'Accept': media_type})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, media_type)
+            data = decode(response.get_data())
+            self.assertEqual(len(data), 5)
+            self.assertTrue(all(bundle['entry'] for bundle in data))
+
+    def test_bundle_store(self):
+        '''
+        Test the stored bundles are found by the indexed fields
+        :return: fhir json object array
+        '''
+
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['BUNDLE_STORE'] = os.path.join(directory, 'bundles.db')
+            with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                data = json.loads(self.app.post('entity/fhirjson', data=dict(
+                    file=(asset, 'data.csv'),
+                    store='true',
+                    deterministic_ids='true'
+                            )).get_data(as_text=True))
+            with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                random_ids = self.app.post('entity/fhirjson', data=dict(
+                    file=(asset, 'data.csv'),
+                    store='true'
+                            ))
+            combined = []
+            for option in [dict(tables='parquet'), dict(deliver='true')]:
+                with open('tests/multiple_patient_data.csv', 'rb') as asset, \
+                        mock.patch.dict(app.config, FHIR_SERVER_URL='http://127.0.0.1:9/fhir'):
+                    combined.append(self.app.post('entity/fhirjson', data=dict(
+                        file=(asset, 'data.csv'),
+                        store='true',
+                        deterministic_ids='true',
+                        **option
+                                )).status_code)
+            patient = [entry for entry in data[0]['entry'] if entry.get('resourceType') == 'Patient'][0]
+
+            response = self.app.get('entity/bundles?family=%s' % patient['name']['family'])
+            found = json.loads(response.get_data(as_text=True))
+            by_code = json.loads(self.app.get('entity/bundles?code=69449-7').get_data(as_text=True))
+            stored = self.app.get('entity/bundles/%s' % data[0]['id'])
+            missing = self.app.get('entity/bundles/missing')
+            invalid = self.app.get('entity/bundles?value=7878000')
+            app.config['BUNDLE_STORE'] = None
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(data[0]['id'], [bundle['id'] for bundle in found])
+        self.assertEqual(len(by_code), len(data))
+        self.assertEqual(json.loads(stored.get_data(as_text=True)), data[0])
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(random_ids.status_code, 400)
+        self.assertEqual(combined, [400, 400])
+
+    def test_batch_stats(self):
+        '''
+        Test the batch upload ends every file and the stream with summary statistics
+        :return: newline delimited fhir json results
+        '''
+
+        with open('tests/multiple_patient_data.csv', 'rb') as first, \
+                open('tests/multiple_patient_data.csv', 'rb') as second:
+            response = self.app.post('entity/fhirjson/batch', data=dict(
+                file=[(first, 'first.csv'), (second, 'second.csv')],
+                stats='true'
+                        ))
+            results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        file_stats = [result['stats'] for result in results if 'file' in result and 'stats' in result]
+        self.assertEqual([stats['rows'] for stats in file_stats], [5, 5])
+        self.assertEqual(results[-1]['stats']['rows'], 10)
+        self.assertEqual(sum(results[-1]['stats']['manner_of_death'].values()), 10)
+        self.assertEqual(results[-1]['stats']['age']['count'], 10)
+
+    def test_terminology_codings(self):
+        '''
+        Test the coded values and their displays come from the terminology
+        :return: fhir json object array
+        '''
+
+        with open('tests/multiple_patient_data.csv', 'rb') as asset:
+            data = json.loads(self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                        )).get_data(as_text=True))
+
+        self.assertEqual(len(data), 5)
+        for bundle in data:
+            values = {}
+            for entry in bundle['entry']:
+                resource = entry.get('resource', {})
+                if 'code' in resource and 'coding' in resource.get('valueCodeableConcept', {}):
+                    values[resource['code']['coding'][0]['code']] = resource['valueCodeableConcept']['coding'][0]
+            # tobacco use: No
+            self.assertEqual(values['69443-0']['code'], '373067005')
+            self.assertEqual(values['69443-0']['display'], 'No')
+            if '69442-2' in values:
+                self.assertEqual(values['69442-2']['code'], 'PHC1260')
+
+    def test_tobacco_and_pregnancy_values(self):
+        '''
+        Test tobacco use is coded from its column, unknown values as 261665006, and the pregnancy status of a female
+        decedent is the value of its own observation, not of the tobacco one
+        :return: fhir json object array
+        '''
+
+        with open('tests/multiple_patient_data.csv', newline='') as asset:
+            rows = list(csv.DictReader(asset))[:3]
+        for row, tobacco in zip(rows, ['Yes', 'not recorded', 'No']):
+            row['TOBACCO_CONTRIBUTED_TO_DEATH'] = tobacco
+            row['PATIENT_GENDER_ATTIMEOFDEATH'] = 'Female'
+        text = StringIO()
+        writer = csv.DictWriter(text, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        data = json.loads(self.app.post('entity/fhirjson', data=dict(
+            file=(BytesIO(text.getvalue().encode()), 'data.csv'),
+                    )).get_data(as_text=True))
+
+        tobacco_codes = []
+        for bundle in data:
+            values = {}
+            for entry in bundle['entry']:
+                resource = entry.get('resource', {})
+                if 'coding' in resource.get('valueCodeableConcept', {}):
+                    values[resource['code']['coding'][0]['code']] = resource['valueCodeableConcept']['coding'][0]
+            tobacco_codes.append(values['69443-0']['code'])
+            self.assertEqual(values['69442-2']['code'], 'PHC1260')
+        self.assertEqual(tobacco_codes, ['373066001', '261665006', '373067005'])
+
+    def test_dates_from_columns(self):
+        '''
+        Test the birth and death dates are parsed from the columns, whatever their format
+        :return: fhir json object array
+        '''
+
+        with open('tests/multiple_patient_data.csv', newline='') as asset:
+            rows = list(csv.DictReader(asset))
+        for number, row in enumerate(rows):
+            row['ACTUAL_OR_PRESUMERD_DATE_OF_DEATH'] = '01/2%d/2019' % number
+            row['DATE_PRONOUNCED_DEAD'] = '2019-01-2%dT09:30:00' % number
+            row['TIME_PRONOUNCED_DEAD'] = ''
+            row['PATIENT_BIRTH_DATE'] = '1950-06-0%d' % (number + 1)
+        text = StringIO()
+        writer = csv.DictWriter(text, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        data = json.loads(self.app.post('entity/fhirjson', data=dict(
+            file=(BytesIO(text.getvalue().encode()), 'data.csv'),
+                    )).get_data(as_text=True))
+
+        self.assertEqual(len(data), 5)
+        for number, bundle in enumerate(data):
+            values = {}
+            for entry in bundle['entry']:
+                resource = entry.get('resource', entry)
+                if resource.get('resourceType') == 'Patient':
+                    self.assertEqual(resource['birthDate'], '1950-06-0%d' % (number + 1))
+                    self.assertEqual(resource['deceasedDateTime'], '2019-01-2%dT10:11:12.000000+0000' % number)
+                elif 'valueDateTime' in resource:
+                    values[resource['code']['coding'][0]['code']] = resource['valueDateTime']
+            self.assertEqual(values['81956-5'], '2019-01-2%d 10:11:12.0000000+00:00' % number)
+            self.assertEqual(values['80616-6'], '2019-01-2%d 09:30:00.0000000+00:00' % number)
+
+    def test_two_digit_birth_years(self):
+        '''
+        Test a two-digit birth year before 1969 stays in the past
+        :return: fhir json object array
+        '''
+
+        with open('tests/multiple_patient_data.csv', newline='') as asset:
+            rows = list(csv.DictReader(asset))[:2]
+        rows[0]['PATIENT_BIRTH_DATE'] = '06-Jun-50'
+        rows[1]['PATIENT_BIRTH_DATE'] = '01/02/50'
+        for row in rows:
+            row['ACTUAL_OR_PRESUMERD_DATE_OF_DEATH'] = '01-Jan-19'
+        expected = ['1950-06-06', '1950-01-02']
+        for row, birth_date in zip(rows, expected):
+            text = StringIO()
+            writer = csv.DictWriter(text, fieldnames=list(row))
+            writer.writeheader()
+            writer.writerow(row)
+            data = json.loads(self.app.post('entity/fhirjson', data=dict(
+                file=(BytesIO(text.getvalue().encode()), 'data.csv'),
+                        )).get_data(as_text=True))
+            patients = [entry.get('resource', entry) for entry in data[0]['entry']
+                        if entry.get('resource', entry).get('resourceType') == 'Patient']
+            self.assertEqual(patients[0]['birthDate'], birth_date)
+            self.assertTrue(patients[0]['deceasedDateTime'].startswith('2019-01-01'))
+
+    def test_date_formats_per_file(self):
+        '''
+        Test the date formats detected for an upload don't carry over to the next one
+        :return: fhir json object array
+        '''
+
+        parsers = []
+
+        def new_parser(*args):
+            parsers.append(DateParser(*args))
+            return parsers[-1]
+
+        with mock.patch('conversion.DateParser', new_parser):
+            for _ in range(2):
+                with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                    self.assertEqual(self.app.post('entity/fhirjson', data=dict(
+                        file=(asset, 'data.csv'),
+                                )).status_code, 200)
+        self.assertEqual(len(parsers), 2)
+        self.assertIn('ACTUAL_OR_PRESUMERD_DATE_OF_DEATH', parsers[1].formats)
+        self.assertIsNot(parsers[0].formats, parsers[1].formats)
+
+    def test_pipelined_conversion(self):
+        '''
+        Test the pipelined conversion streams the same bundles, in row order, and reports its stage metrics
+        :return: fhir json object array
+        '''
+
+        ids = []
+        for pipelined in (False, True):
+            app.config['PIPELINE'] = pipelined
+            app.config['PIPELINE_BUILD_WORKERS'] = 3
+            try:
+                with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                    response = self.app.post('entity/fhirjson', data=dict(
+                        file=(asset, 'data.csv'),
+                        deterministic_ids='true'
+                                ))
+                    data = json.loads(response.get_data(as_text=True))
+            finally:
+                app.config['PIPELINE'] = False
+                app.config['PIPELINE_BUILD_WORKERS'] = 1
+            self.assertEqual(response.status_code, 200)
+            ids.append([(bundle['id'], [entry.get('id') for entry in bundle['entry']]) for bundle in data])
+
+        self.assertEqual(len(ids[0]), 5)
+        self.assertEqual(ids[0], ids[1])
+        stages = json.loads(self.app.get('entity/pipeline').get_data(as_text=True))[-1]
+        self.assertEqual([stage['stage'] for stage in stages], ['parse', 'build', 'serialize', 'write'])
+        self.assertEqual([stage['items'] for stage in stages], [5, 5, 5, 5])
+        self.assertEqual(stages[1]['workers'], 3)
+
+    def test_request_profile(self):
+        '''
+        Test an admin request stores a profile of its conversion, and other requests are refused one
+        :return: profile breakdown
+        '''
+
+        profile_dir = app.config['PROFILE_DIR']
+        with tempfile.TemporaryDirectory() as directory:
+            app.config['ADMIN_TOKEN'] = 'admin-token'
+            app.config['PROFILE_DIR'] = directory
+            try:
+                with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                    refused = self.app.post('entity/fhirjson?profile=pstats', data=dict(
+                        file=(asset, 'data.csv'),
+                                ))
+                with open('tests/multiple_patient_data.csv', 'rb') as asset:
+                    response = self.app.post('entity/fhirjson', data=dict(
+                        file=(asset, 'data.csv'),
+                                ), headers={'X-Profile': 'pstats', 'X-Admin-Token': 'admin-token'})
+                profile_id = response.headers['X-Profile-Id']
+                breakdown = json.loads(self.app.get('entity/profiles/' + profile_id, headers={
+                    'X-Admin-Token': 'admin-token'}).get_data(as_text=True))
+                profile_file = self.app.get('entity/profiles/%s/file' % profile_id, headers={
+                    'X-Admin-Token': 'admin-token'})
+            finally:
+                app.config['ADMIN_TOKEN'] = None
+                app.config['PROFILE_DIR'] = profile_dir
+
+        self.assertEqual(refused.status_code, 403)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.get_data(as_text=True))), 5)
+        self.assertEqual(breakdown['functions']['load_cod_data']['calls'], 5)
+        self.assertGreater(breakdown['fhir.resources constructors']['calls'], 0)
+        self.assertEqual(profile_file.status_code, 200)
+
+    def test_row_trace(self):
+        '''
+        Test a traced conversion keeps its slowest rows with their builder times and a fingerprint without values
+        :return: trace report
+        '''
+
+        with open('tests/multiple_patient_data.csv', 'rb') as asset:
+            response = self.app.post('entity/fhirjson', data=dict(
+                file=(asset, 'data.csv'),
+                trace='2'
+                        ))
+        with open('tests/multiple_patient_data.csv', newline='') as asset:
+            family_names = [row['PATIENTS_FAMILYNAME'] for row in csv.DictReader(asset)]
+        report = self.app.get('entity/traces/' + response.headers['X-Trace-Id']).get_data(as_text=True)
+        trace = json.loads(report)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(trace['file'], 'data.csv')
+        self.assertEqual(trace['rows'], 5)
+        self.assertEqual(len(trace['slowest']), 2)
+        self.assertGreaterEqual(trace['slowest'][0]['seconds'], trace['slowest'][1]['seconds'])
+        self.assertIn('load_cod_data', trace['slowest'][0]['stages'])
+        self.assertIn('PATIENTS_FAMILYNAME', trace['slowest'][0]['fingerprint'])
+        for family_name in family_names:
+            self.assertNotIn(family_name, report)
+        self.assertEqual(sum(bucket['rows'] for bucket in trace['histogram']['buckets']), 5)
+
+    def test_columnar_dates(self):
+        '''
+        Test the typed dates of a Parquet file keep their century
+        :return: rows of the file
+        '''
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'deaths.parquet')
+            pq.write_table(pa.table({'PATIENT_BIRTH_DATE': [date(1950, 6, 6), None],
+                                     'ACTUAL_OR_PRESUMERD_DATE_OF_DEATH': [datetime(2019, 1, 12, 10, 11, 12),
+                                                                           datetime(2020, 2, 1)]}), path)
+            rows = [row for _, row in read_columnar_rows(path)]
+
+        self.assertEqual(rows[0], {'PATIENT_BIRTH_DATE': '1950-06-06',
+                                   'ACTUAL_OR_PRESUMERD_DATE_OF_DEATH': '2019-01-12T10:11:12'})
+        self.assertEqual(rows[1]['PATIENT_BIRTH_DATE'], '')
+
+    def test_shard_regenerate(self):
+        '''
+        Test a corrupted shard is found by verify and regenerated with the ids of the first run
+        :return: shards of the conversion
+        '''
+
+        def shard_ids(path):
+            with open(path) as shard:
+                return [(bundle['id'], [entry.get('fullUrl') for entry in bundle['entry']])
+                        for bundle in map(json.loads, shard)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'out')
+            options = ['tests/multiple_patient_data.csv', '-o', output, '--shard-bundles', '2']
+            self.assertEqual(cli_main(options + ['--deterministic-ids', '--dedupe-practitioners']), 0)
+            shard = os.path.join(output, 'bundles-00002.ndjson')
+            expected = shard_ids(shard)
+            with open(shard, 'w') as corrupted:
+                corrupted.write('{}\n')
+            failed = cli_main(options + ['--verify'])
+            regenerated = cli_main(options + ['--regenerate-shard', '2'])
+            verified = cli_main(options + ['--verify'])
+            ids = shard_ids(shard)
+
+            random_output = os.path.join(directory, 'random')
+            cli_main(['tests/multiple_patient_data.csv', '-o', random_output, '--shard-bundles', '2'])
+            refused = cli_main(['tests/multiple_patient_data.csv', '-o', random_output, '--regenerate-shard', '2'])
+
+        self.assertEqual((failed, regenerated, verified), (1, 0, 0))
+        self.assertEqual(ids, expected)
+        self.assertEqual(refused, 2)
+
+    def test_delta_runs(self):
+        '''
+        Test a second delta run emits only the changed records, keeping their ids, and lists the deleted ones
+        :return: bundles and deleted records of the second run
+        '''
+
+        def read_ndjson(path):
+            with open(path) as ndjson:
+                return [json.loads(line) for line in ndjson]
+
+        with open('tests/multiple_patient_data.csv', newline='') as asset:
+            reader = csv.DictReader(asset)
+            column_name, rows = reader.fieldnames, list(reader)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.csv')
+            index = os.path.join(directory, 'certificates.idx')
+
+            def run(output, data, *options):
+                with open(path, 'w', newline='') as csvfile:
+                    writer = csv.DictWriter(csvfile, column_name)
+                    writer.writeheader()
+                    writer.writerows(data)
+                return cli_main([path, '-o', os.path.join(directory, output), '--delta-index', index,
+                                 '--dedupe-practitioners'] + list(options))
+
+            run('first', rows)
+            first = read_ndjson(os.path.join(directory, 'first', 'bundles-00001.ndjson'))
+            changed = [dict(row) for row in rows[:4]]
+            changed[1]['PATIENT_AGE'] = '99'
+            run('second', changed)
+            second = read_ndjson(os.path.join(directory, 'second', 'bundles-00001.ndjson'))
+            deleted = read_ndjson(os.path.join(directory, 'second', 'deleted.ndjson'))
+            other_columns = run('third', changed, '--resources', 'Patient')
+
+        self.assertEqual([bundle['id'] for bundle in second], [first[1]['id']])
+        self.assertEqual([record['bundle'] for record in deleted], [first[4]['id']])
+        self.assertNotIn('Practitioner', deleted[0]['resources'])
+        emitted = {entry.get('id') or entry.get('fullUrl') for entry in first[4]['entry']}
+        self.assertEqual(set(deleted[0]['resources'].values()) - emitted, set())
+        self.assertEqual(other_columns, 2)
+
+    def test_checkpoint_resume(self):
+        '''
+        Test a conversion interrupted after a checkpoint and resumed writes the shards of an uninterrupted one
+        :return: shards of both conversions
+        '''
+
+        def shard_files(output):
+            files = {}
+            for name in sorted(os.listdir(output)):
+                if name.startswith('bundles-'):
+                    with open(os.path.join(output, name), 'rb') as shard:
+                        files[name] = shard.read()
+            return files
+
+        generate_bundle = fhirjsoncli.generate_bundle
+
+        def crash_at_row_four(json_object, *args, **kwargs):
+            if crash_at_row_four.calls == 3:
+                raise RuntimeError('interrupted')
+            crash_at_row_four.calls += 1
+            return generate_bundle(json_object, *args, **kwargs)
+        crash_at_row_four.calls = 0
+
+        with tempfile.TemporaryDirectory() as directory:
+            def options(output):
+                # no Composition, its date is the time of the conversion
+                return ['tests/multiple_patient_data.csv', '-o', os.path.join(directory, output), '--compress',
+                        '--shard-bundles', '2', '--checkpoint-every', '2', '--deterministic-ids',
+                        '--dedupe-practitioners', '--resources', 'Patient,Practitioner,Observation']
+
+            cli_main(options('whole'))
+            with mock.patch('fhirjsoncli.generate_bundle', crash_at_row_four):
+                with self.assertRaises(RuntimeError):
+                    cli_main(options('resumed'))
+            interrupted = shard_files(os.path.join(directory, 'resumed'))
+            resumed = cli_main(options('resumed') + ['--resume'])
+            verified = cli_main(options('resumed') + ['--verify'])
+
+            self.assertEqual(list(interrupted), ['bundles-00001.ndjson.gz', 'bundles-00002.ndjson.gz'])
+            self.assertEqual((resumed, verified), (0, 0))
+            self.assertEqual(shard_files(os.path.join(directory, 'resumed')), shard_files(os.path.join(directory,
+                                                                                                     'whole')))
+            self.assertFalse(os.path.exists(os.path.join(directory, 'resumed', 'checkpoint.json')))
+
+    def test_split_ranges(self):
+        '''
+        Test the byte ranges of a file never start inside a quoted field, embedded newlines and quotes included
+        :return: rows of every range
+        '''
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.csv')
+            with open(path, 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['ROW', 'PATIENTS_ADDRESS_LINE', 'NOTE'])
+                for row in range(200):
+                    writer.writerow([row, '%d Main St\n"Apt %d",\nBldg\r\n' % (row, row % 7), '"' * (row % 3)])
+            with open(path, newline='') as csvfile:
+                expected = list(csv.reader(csvfile))[1:]
+            with open(path, 'rb') as csvfile:
+                data = csvfile.read()
+            for parts in range(1, 40):
+                start, ranges = split_ranges(path, parts)
+                rows = []
+                for first, last in ranges:
+                    rows.extend(csv.reader(StringIO(data[first:last].decode('utf-8'), newline='')))
+                self.assertEqual(ranges[0][0], start)
+                self.assertEqual(ranges[-1][1], len(data))
+                self.assertTrue(all(ranges[i][1] == ranges[i + 1][0] for i in range(len(ranges) - 1)))
+                self.assertEqual(rows, expected, 'split in %d parts' % parts)
+
+    def test_parallel_conversion_closed_early(self):
+        '''
+        Test a parallel conversion closed after its first bundle leaves no range file behind
+        :return: work directory of the conversion
+        '''
+
+        with open('tests/multiple_patient_data.csv', newline='') as asset:
+            rows = list(csv.DictReader(asset))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.csv')
+            with open(path, 'w', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows * 40)
+            work_directory = os.path.join(directory, 'work')
+            bundles = convert_parallel(path, work_directory, processes=2)
+            row_number, _ = next(bundles)
+            bundles.close()
+
+            self.assertEqual(row_number, 1)
+            self.assertEqual(os.listdir(work_directory), [])
+
+    def test_pdf_fields(self):
+        '''
+        Test the fields of a fillable PDF: form values from the widget or its parent, check boxes as TRUE/FALSE, the
+        text layer for the fields the form leaves empty, and the cached fields of a PDF seen before
+        :return: csv json object of the certificate
+        '''
+
+        columns = ['PATIENTS_GIVENNAME', 'PATIENTS_FAMILYNAME', 'PATIENTS_ADDRESS_STATE', 'PATIENTS_ADDRESS_CITY',
+                   'AUTOPSY_PERFORMED', 'AUTOPSY_AVAILABLE', 'PATIENT_AGE']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'certificate.pdf')
+            fillable_pdf(path)
+            cache_directory = os.path.join(directory, 'cache')
+            rows = list(read_pdf_rows([directory], columns, processes=1, cache_directory=cache_directory))
+            # a PDF seen before isn't parsed again
+            with mock.patch('pdfextractor.PdfReader', side_effect=AssertionError('parsed again')):
+                cached = list(read_pdf_rows([path], columns, processes=1, cache_directory=cache_directory))
+
+        self.assertEqual(rows, [(1, {'PATIENTS_GIVENNAME': 'Jane', 'PATIENTS_FAMILYNAME': 'Doe',
+                                     'PATIENTS_ADDRESS_STATE': 'MA', 'PATIENTS_ADDRESS_CITY': 'Boston',
+                                     'AUTOPSY_PERFORMED': 'TRUE', 'AUTOPSY_AVAILABLE': 'FALSE', 'PATIENT_AGE': ''})])
+        self.assertEqual(cached, rows)
+
+    def test_bytes_csv_reader_quoting(self):
+        '''
+        Test the byte reader returns the rows of the csv module: quoted fields holding commas, newlines and doubled
+        quotes, CRLF line endings, and the unquoted records split without it
+        :return: rows of the reader
+        '''
+
+        rows = [['ROW', 'NOTE', 'CITY'],
+                ['1', 'plain', 'Boston'],
+                ['2', 'a, b', 'Salem'],
+                ['3', 'line one\r\nline two\nline three', 'Lowell'],
+                ['4', 'say ""hi"", "bye"', ''],
+                ['5', '', 'Worcester']]
+        text = StringIO()
+        csv.writer(text, lineterminator='\r\n').writerows(rows)
+        data = text.getvalue().encode('utf-8')
+
+        reader = BytesCsvReader(data)
+        read = list(reader)
+        columns = BytesCsvReader(data, columns=['ROW', 'NOTE'])
+
+        expected = [dict(zip(rows[0], row)) for row in csv.reader(StringIO(text.getvalue(), newline=''))][1:]
+        self.assertEqual(read, list(enumerate(expected, 1)))
+        self.assertEqual([row['NOTE'] for _, row in read], [row[1] for row in rows[1:]])
+        # the header and the three records with a quote go through the csv module
+        self.assertEqual(reader.parsed_records, 4)
+        self.assertEqual([row for _, row in columns], [{'ROW': row['ROW'], 'NOTE': row['NOTE']} for row in expected])
+
+    def test_next_record_start_in_quoted_field(self):
+        '''
+        Test a record start is found past the newlines of a quoted field, from its record start or from inside it
+        :return: byte offsets
+        '''
+
+        data = b'ROW,NOTE\n1,"a\nb, ""c""\nd"\n2,e\n'
+        record = data.index(b'1,')
+        quoted = data.index(b'a\nb')
+        following = data.index(b'2,')
+
+        self.assertEqual(next_record_start(data, record, 0), following)
+        # one quote between the record start and the position, the newlines after it are inside the field
+        self.assertEqual(next_record_start(data, quoted, 1), following)
+        self.assertEqual(next_record_start(data, quoted + 3, data.count(b'"', record, quoted + 3)), following)
+        self.assertEqual(next_record_start(data, following, 0, following + 2), following + 2)
+
+    def test_readiness_after_warm_up(self):
+        '''
+        Test the readiness endpoint answers 503 until the production server has loaded and warmed up the app
+        :return: readiness status
+        '''
+
+        with mock.patch.dict(app.config, WARMED_UP=False):
+            before = self.app.get('health/ready')
+            # the collector of the test process isn't frozen
+            with mock.patch('server.gc'):
+                served = FhirJsonServer({'bind': '127.0.0.1:0', 'preload_app': True}).load()
+            after = served.test_client().get('health/ready')
+
+        self.assertEqual(before.status_code, 503)
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(json.loads(after.get_data(as_text=True)), {"status": "ready"})
+
+    def test_duplicate_index(self):
+        '''
+        Test the duplicate index finds decedents of earlier files across reopenings and filter growth
+        :return: duplicates of the second file
+        '''
+
+        def decedent(number, family='Smith', given='Ann'):
+            return {'PATIENTS_FAMILYNAME': '%s%d' % (family, number), 'PATIENTS_GIVENNAME': given,
+                    'ACTUAL_OR_PRESUMERD_DATE_OF_DEATH': '12-Jan-19', 'PATIENT_AGE': str(40 + number),
+                    'PATIENT_GENDER_ATTIMEOFDEATH': 'Female'}
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'decedents.db')
+            index = DuplicateIndex(path, capacity=10, chunk_size=3)
+            first = [index.check(decedent(number), 'a.csv', number) for number in range(30)]
+            index.close()
+
+            index = DuplicateIndex(path, capacity=10, chunk_size=3)
+            again = [index.check(decedent(number), 'a.csv', number) for number in range(30)]
+            variant = dict(decedent(7, family='smith', given=' Ánn '), ACTUAL_OR_PRESUMERD_DATE_OF_DEATH='2019-01-12',
+                           PATIENT_AGE='047', PATIENT_GENDER_ATTIMEOFDEATH='F')
+            duplicate = index.check(variant, 'b.csv', 1)
+            new = [index.check(decedent(number, family='Jones'), 'b.csv', number) for number in range(2, 30)]
+            capacity = index.filter.capacity
+            index.close()
+
+        self.assertEqual(first, [None] * 30)
+        self.assertEqual(again, [None] * 30)
+        self.assertEqual(duplicate, ('a.csv', 7))
+        self.assertEqual(new, [None] * 28)
+        self.assertGreaterEqual(capacity, 58)
+
+    def test_pipeline_window(self):
+        '''
+        Test a slow item stops the reading of the pipeline source instead of letting later results pile up
+        :return: results in input order
+        '''
+
+        slow_done = threading.Event()
+        read_while_slow = []
+
+        def source():
+            for number in range(100):
+                if not slow_done.is_set():
+                    read_while_slow.append(number)
+                yield number
+
+        def build(number):
+            if number == 0:
+                slow_done.wait(0.5)
+                slow_done.set()
+            return number * 2
+
+        pipeline = Pipeline([('build', build, 3)], depth=2)
+        results = list(pipeline.run(source()))
+
+        self.assertEqual(results, [number * 2 for number in range(100)])
+        # two queues of two items
+        self.assertLessEqual(len(read_while_slow), 4)
+
+    def test_batch_worker_failure(self):
+        '''
+        Test a file whose worker fails ends with an error result and the other files are still converted
+        :return: newline delimited results
+        '''
+
+        with mock.patch.object(sys.modules[app.import_name], 'WORKER_POOL', OneBrokenPool()):
+            with open('tests/multiple_patient_data.csv', 'rb') as first, \
+                    open('tests/single_patient_data.csv', 'rb') as second:
+                response = self.app.post('entity/fhirjson/batch', data=dict(
+                    file=[(first, 'first.csv'), (second, 'second.csv')]
+                            ))
+                results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            pool = sys.modules[app.import_name].WORKER_POOL
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([result for result in results if result['file'] == 'first.csv']), 5)
+        self.assertEqual([result for result in results if result['file'] == 'second.csv'],
+                         [{"file": "second.csv", "error": "BrokenProcessPool('worker died')"}])
+        self.assertIsNone(pool)
+
+    def test_batch_failing_row_number(self):
+        '''
+        Test the error result of a batch file is tagged with the row that failed, after rows the filter skipped
+        :return: results of the file
+        '''
+
+        generate_bundle = conversion.generate_bundle
+
+        def fail_given3(json_object, *args, **kwargs):
+            if json_object['PATIENTS_GIVENNAME'] == 'Given3':
+                raise RuntimeError('bad row')
+            return generate_bundle(json_object, *args, **kwargs)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, 'results.ndjson')
+            with mock.patch('conversion.generate_bundle', fail_given3):
+                convert_named_csv('multiple.csv', 'tests/multiple_patient_data.csv', output_path,
+                                  row_filter=RowFilter(['PATIENTS_GIVENNAME=Given3,Given4']))
+            with open(output_path, encoding='utf-8') as output:
+                results = [json.loads(line) for line in output]
+
+        self.assertEqual(results, [{"file": "multiple.csv", "row": 4, "error": "RuntimeError('bad row')"}])
+
+    def test_asgi_batches_in_flight(self):
+        '''
+        Test the ASGI app keeps at most MAX_IN_FLIGHT batches of an upload in the process pool, even when one chunk
+        holds all the rows
+        :return: JSON array of bundles
+        '''
+
+        log = []
+        with open('tests/multiple_patient_data.csv', 'rb') as csvfile:
+            data = csvfile.read()
+        with mock.patch.object(asgiapp, 'get_executor', lambda: InlineExecutor(log)), \
+                mock.patch.object(asgiapp, 'BATCH_SIZE', 1), mock.patch.object(asgiapp, 'MAX_IN_FLIGHT', 2):
+            status, body = asgi_post([('file', 'data.csv', data)], log)
+
+        # '[' and ']' are the only bodies that aren't a bundle
+        in_flight = [log[:index + 1].count('batch') - max(log[:index + 1].count('body') - 1, 0)
+                     for index in range(len(log))]
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)), 5)
+        self.assertEqual(log.count('batch'), 5)
+        self.assertLessEqual(max(in_flight), 2)
+
+    def test_asgi_without_file(self):
+        '''
+        Test the ASGI app answers an upload without a file part with 400, as the Flask endpoint does
+        :return: error message
+        '''
+
+        status, body = asgi_post([('resources', None, b'Patient')], [])
+
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body), {"message": "a file part is required"})
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)